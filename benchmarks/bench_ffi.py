@@ -0,0 +1,63 @@
+import time
+from functools import partial
+
+import click
+import numpy as np
+
+from pybamm2diffsl.diffeq import Diffeq
+from tests.logistic import logistic
+
+
+def per_call(f, calls: int, repeats: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(calls):
+            f()
+        best = min(best, time.perf_counter() - start)
+    return best / calls
+
+
+@click.command()
+@click.option("--calls", default=100_000)
+def main(calls):
+    """Per-call overhead of wasm exports, checked Func.__call__ versus the bound fast path"""
+    diffeq = Diffeq(logistic)
+    exports = diffeq._linking.exports(diffeq._store)
+    v = diffeq.vector(np.arange(10.0))
+    view = v.view()
+    o = diffeq.options(fixed_times=True)
+    s = diffeq.solver(o)
+    times = diffeq.vector([0.0, 1.0])
+    inputs = diffeq.vector(np.ones(s.number_of_inputs))
+    outputs = diffeq.vector([])
+
+    def checked(name):
+        return partial(exports[name], diffeq._store)
+
+    cases = [
+        ("Vector_get_length", checked("Vector_get_length"), diffeq.Vector_get_length,
+         (v.pointer,)),
+        ("Vector_get_data", checked("Vector_get_data"), diffeq.Vector_get_data, (v.pointer,)),
+        ("Vector_get", checked("Vector_get"), diffeq.Vector_get, (v.pointer, 3)),
+        ("Sundials_solve", checked("Sundials_solve"), diffeq.Solver_solve,
+         (s.pointer, times.pointer, inputs.pointer, s.dummy_vector.pointer,
+          outputs.pointer, s.dummy_vector.pointer)),
+    ]
+    for name, slow, fast, args in cases:
+        t_slow = per_call(lambda: slow(*args), calls)
+        t_fast = per_call(lambda: fast(*args), calls)
+        click.echo(
+            f"{name:20s} checked={t_slow * 1e9:8.0f}ns bound={t_fast * 1e9:8.0f}ns "
+            f"speedup={t_slow / t_fast:5.2f}"
+        )
+    for name, f in [
+        ("memory_size", diffeq.memory_size),
+        ("getFloat64Array", v.getFloat64Array),
+        ("VectorView.array", lambda: view.array),
+    ]:
+        click.echo(f"{name:20s} {per_call(f, calls) * 1e9:8.0f}ns")
+
+
+if __name__ == "__main__":
+    main()
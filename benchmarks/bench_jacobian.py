@@ -0,0 +1,50 @@
+import time
+
+import click
+import numpy as np
+
+from pybamm2diffsl.diffeq import Diffeq
+from tests.logistic import logistic
+
+
+@click.command()
+@click.option("--model", type=click.File(), default=None, help="DiffSL file to use")
+@click.option("--points", default=100, help="number of output times")
+@click.option("--end-time", default=1.0)
+@click.option("--repeats", default=5)
+@click.option("--step", default=1e-6, help="relative finite difference step")
+def main(model, points, end_time, repeats, step):
+    """Solver.jacobian compared with forward finite differences over Solver.solve"""
+    diffeq = Diffeq(model.read() if model is not None else logistic)
+    o = diffeq.options(fixed_times=True, fwd_sens=True)
+    s = diffeq.solver(o)
+    times = diffeq.vector(np.linspace(0, end_time, points))
+    inputs = np.ones(s.number_of_inputs)
+
+    def finite_differences():
+        h = step * np.maximum(np.abs(inputs), 1.0)
+        sets = np.vstack([inputs, inputs + np.diag(h)])
+        results = s.solve_batch(times, sets)
+        return np.moveaxis((results[1:] - results[0]) / h[:, None, None], 0, -1)
+
+    timings = {}
+    for name, f in (("jacobian", lambda: s.jacobian(times, inputs)), ("fd", finite_differences)):
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = f()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = (best, result)
+
+    (t_jac, jac), (t_fd, fd) = timings["jacobian"], timings["fd"]
+    click.echo(f"inputs={s.number_of_inputs} outputs={s.number_of_outputs} times={points}")
+    click.echo(f"jacobian: {t_jac * 1e3:10.3f}ms")
+    click.echo(f"fd:       {t_fd * 1e3:10.3f}ms")
+    click.echo(f"max |jacobian - fd| = {np.max(np.abs(jac - fd)):.3e}")
+    times.destroy()
+    s.destroy()
+    o.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import json
+import platform
+import sys
+import time
+
+import click
+import numpy as np
+import pybamm
+from wasmtime import Module
+
+from pybamm2diffsl.client import HttpCompileClient, client_from_string
+from pybamm2diffsl.diffeq import Diffeq
+from pybamm2diffsl.options import Options
+from pybamm2diffsl.pybamm_model import PybammModel
+from pybamm2diffsl.server import CompileServer
+
+models = {
+    "SPM": pybamm.lithium_ion.SPM,
+    "SPMe": pybamm.lithium_ion.SPMe,
+    "DFN": pybamm.lithium_ion.DFN,
+}
+
+# stages of a case, in the order they run
+stages = [
+    "convert",
+    "compile",
+    "jit",
+    "instantiate",
+    "vectors",
+    "solve",
+    "pybamm_build",
+    "pybamm_solve",
+]
+
+
+def best_of(f, repeats: int) -> tuple[float, object]:
+    """Shortest wall time of `repeats` calls of `f`, and the result of the last call"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = f()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_case(
+    name: str,
+    mesh: int,
+    inputs: list[str],
+    output: str,
+    times: np.ndarray,
+    repeats: int,
+) -> dict:
+    """
+    Time each stage of converting, compiling and solving model `name` with `mesh`
+    points in every spatial variable, and solving the same problem with pybamm.
+    A stage that fails records its error and ends the case.
+    """
+    timings = {}
+
+    def timed(stage, f):
+        timings[stage], result = best_of(f, repeats)
+        return result
+
+    try:
+        model = models[name]()
+        var_pts = {var: mesh for var in model.default_var_pts}
+        pybamm_model = PybammModel(model, var_pts=var_pts)
+        text = timed("convert", lambda: pybamm_model.to_diffeq(inputs, [output]))
+        timings["chars"] = len(text)
+        client = Diffeq.get_client()
+        wasm = timed("compile", lambda: client.compile(text))
+        module = timed("jit", lambda: Module(Diffeq.engine, wasm))
+        diffeq = timed("instantiate", lambda: Diffeq(text, module=module))
+
+        input_values = pybamm_model.input_parameters(inputs).values()
+        t, i, o = timed(
+            "vectors",
+            lambda: (diffeq.vector(times), diffeq.vector(input_values), diffeq.vector([])),
+        )
+        options = diffeq.options(
+            fixed_times=True,
+            jacobian=Options.Jacobian.SPARSE_JACOBIAN,
+            linear_solver=Options.LinearSolver.LINEAR_SOLVER_KLU,
+        )
+        solver = diffeq.solver(options)
+        timed("solve", lambda: solver.solve(t, i, o))
+        result = o.getFloat64Array().copy()
+
+        params = model.default_parameter_values
+        for inpt in inputs:
+            params[inpt] = "[input]"
+
+        def build():
+            sim = pybamm.Simulation(model, parameter_values=params, var_pts=var_pts)
+            sim.build()
+            return sim
+
+        sim = timed("pybamm_build", build)
+        input_dict = dict(zip(inputs, input_values))
+        solution = timed("pybamm_solve", lambda: sim.solve(times, inputs=input_dict))
+        timings["max_error"] = float(np.max(np.abs(solution[output](times) - result)))
+    except Exception as e:
+        timings["error"] = f"{type(e).__name__}: {e}"
+    return timings
+
+
+def regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Stages more than `threshold` (relative) slower in `results` than in `baseline`"""
+    found = []
+    for case, timings in results.items():
+        for stage in stages:
+            old, new = baseline.get(case, {}).get(stage), timings.get(stage)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + threshold):
+                found.append(
+                    f"{case} {stage}: {new * 1e3:.3f}ms vs {old * 1e3:.3f}ms "
+                    f"(+{(new / old - 1) * 100:.0f}%)"
+                )
+    return found
+
+
+@click.command()
+@click.option("--model", "model_names", multiple=True, type=click.Choice(list(models)),
+              default=list(models), help="models to run, all by default")
+@click.option("--mesh", "meshes", multiple=True, type=int, default=[10, 20, 40],
+              help="points in each spatial variable")
+@click.option("--input", "inputs", multiple=True, default=["Current function [A]"])
+@click.option("--output", default="Voltage [V]")
+@click.option("--points", default=100, help="number of output times")
+@click.option("--end-time", default=3600.0)
+@click.option("--repeats", default=3)
+@click.option("--backend", default=None,
+              help="compiler url or command, PYBAMM2DIFFSL_BACKEND by default")
+@click.option("--serve", is_flag=True,
+              help="compile through a local CompileServer in front of the backend")
+@click.option("--save", type=click.Path(dir_okay=False), default=None,
+              help="write the results as a JSON baseline")
+@click.option("--baseline", type=click.File(), default=None,
+              help="JSON baseline to compare with")
+@click.option("--threshold", default=0.2, help="relative slowdown flagged as a regression")
+def main(model_names, meshes, inputs, output, points, end_time, repeats, backend, serve,
+         save, baseline, threshold):
+    """
+    Wall time of each stage from a pybamm model to a solution (convert, compile, jit,
+    instantiate, vectors, solve), compared with pybamm.Simulation on the same problem
+    """
+    if backend is not None:
+        Diffeq.client = client_from_string(backend)
+    backend = Diffeq.get_client().backend
+    server = None
+    if serve:
+        server = CompileServer(Diffeq.get_client()).start()
+        Diffeq.client = HttpCompileClient(server.url)
+
+    times = np.linspace(0, end_time, points)
+    results = {}
+    try:
+        for name in model_names:
+            for mesh in meshes:
+                case = f"{name}/{mesh}"
+                timings = run_case(name, mesh, list(inputs), output, times, repeats)
+                results[case] = timings
+                line = " ".join(
+                    f"{stage}={timings[stage] * 1e3:.3f}ms"
+                    for stage in stages
+                    if stage in timings
+                )
+                if "error" in timings:
+                    line += f" error={timings['error']}"
+                click.echo(f"{case:10s} {line}")
+    finally:
+        if server is not None:
+            Diffeq.client.close()
+            server.stop()
+
+    if save is not None:
+        report = {
+            "python": platform.python_version(),
+            "pybamm": pybamm.__version__,
+            "backend": backend,
+            "served": serve,
+            "results": results,
+        }
+        with open(save, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        found = regressions(results, json.load(baseline)["results"], threshold)
+        for regression in found:
+            click.echo(f"regression: {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
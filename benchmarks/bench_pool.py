@@ -0,0 +1,60 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import numpy as np
+
+from pybamm2diffsl.options import Options
+from pybamm2diffsl.pool import InstancePool
+from tests.logistic import logistic
+
+
+def solve(pool: InstancePool, times: np.ndarray, n: int):
+    with pool.instance() as diffeq:
+        o = diffeq.options(
+            fixed_times=True,
+            jacobian=Options.Jacobian.SPARSE_JACOBIAN,
+            linear_solver=Options.LinearSolver.LINEAR_SOLVER_KLU,
+        )
+        s = diffeq.solver(o)
+        t = diffeq.vector(times)
+        inputs = diffeq.vector([1.0, 1.0])
+        outputs = diffeq.vector([])
+        for _ in range(n):
+            s.solve(t, inputs, outputs)
+        for v in (t, inputs, outputs):
+            v.destroy()
+        s.destroy()
+        o.destroy()
+
+
+@click.command()
+@click.option("--solves", default=2000, help="total number of solves per run")
+@click.option("--batch", default=50, help="solves per pool checkout")
+@click.option("--points", default=1000, help="number of output times")
+@click.option("--max-threads", default=8)
+def main(solves, batch, points, max_threads):
+    """Throughput of Solver.solve on one compiled model as the thread count grows"""
+    times = np.linspace(0, 1, points)
+    threads = 1
+    baseline = None
+    while threads <= max_threads:
+        pool = InstancePool(logistic, max_size=threads)
+        # warm up one instance per thread
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(lambda _: solve(pool, times, 1), range(threads)))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(lambda _: solve(pool, times, batch), range(solves // batch)))
+        elapsed = time.perf_counter() - start
+        throughput = solves / elapsed
+        baseline = baseline or throughput
+        click.echo(
+            f"threads={threads:3d} {throughput:10.1f} solves/s "
+            f"speedup={throughput / baseline:5.2f}"
+        )
+        threads *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import os
+import time
+
+import click
+import numpy as np
+
+from pybamm2diffsl.diffeq import Diffeq
+from pybamm2diffsl.sweep import ParallelSweep
+from tests.logistic import logistic
+
+
+def _number_of_inputs(text: str) -> int:
+    diffeq = Diffeq(text)
+    o = diffeq.options()
+    s = diffeq.solver(o)
+    n = s.number_of_inputs
+    s.destroy()
+    o.destroy()
+    return n
+
+
+@click.command()
+@click.option("--model", type=click.File(), default=None, help="DiffSL file to sweep")
+@click.option("--sets", default=2000, help="number of input sets")
+@click.option("--points", default=100, help="number of output times")
+@click.option("--end-time", default=1.0)
+def main(model, sets, points, end_time):
+    """Wall time of a parameter sweep with ParallelSweep as the worker count grows"""
+    text = model.read() if model is not None else logistic
+    times = np.linspace(0, end_time, points)
+    max_workers = os.cpu_count() or 1
+    workers = 1
+    baseline = None
+    while True:
+        with ParallelSweep(text, max_workers=workers) as sweep:
+            n_inputs = _number_of_inputs(text)
+            inputs = np.random.default_rng(0).uniform(0.5, 1.5, (sets, n_inputs))
+            # start the workers before timing
+            sweep.run(times, inputs[:workers], chunk_size=1)
+            start = time.perf_counter()
+            sweep.run(times, inputs)
+            elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        click.echo(
+            f"workers={workers:3d} {sets / elapsed:10.1f} solves/s "
+            f"speedup={baseline / elapsed:5.2f}"
+        )
+        if workers == max_workers:
+            break
+        workers = min(2 * workers, max_workers)
+
+
+if __name__ == "__main__":
+    main()
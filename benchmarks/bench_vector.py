@@ -0,0 +1,51 @@
+import time
+
+import click
+import numpy as np
+
+from pybamm2diffsl.diffeq import Diffeq
+from tests.logistic import logistic
+
+
+def push(diffeq: Diffeq, array: np.ndarray) -> int:
+    pointer = diffeq.Vector_create_with_capacity(0, len(array))
+    for x in array:
+        diffeq.Vector_push(pointer, np.float64(x))
+    return pointer
+
+
+def bulk(diffeq: Diffeq, array: np.ndarray) -> int:
+    return diffeq.vector(array).pointer
+
+
+def best_of(f, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@click.command()
+@click.option("--max-exponent", default=6, help="largest vector has 10**max_exponent elements")
+@click.option("--repeats", default=3)
+def main(max_exponent, repeats):
+    """Vector creation by per-element Vector_push versus a bulk copy into wasm memory"""
+    diffeq = Diffeq(logistic)
+    for exponent in range(2, max_exponent + 1):
+        array = np.random.default_rng(0).random(10**exponent)
+
+        def run(create):
+            diffeq.Vector_destroy(create(diffeq, array))
+
+        t_push = best_of(lambda: run(push), repeats)
+        t_bulk = best_of(lambda: run(bulk), repeats)
+        click.echo(
+            f"n=1e{exponent} push={t_push * 1e3:10.3f}ms bulk={t_bulk * 1e3:8.3f}ms "
+            f"speedup={t_push / t_bulk:8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import weakref
+
+
+class WasmObject:
+    """
+    Base class of the Python wrappers (Vector, Options, Solver) of objects on the
+    wasm heap.
+
+    The wasm object is released by `destroy`, by leaving a `with` block on the
+    wrapper or on the arena it was created in, or failing all of those when the
+    wrapper is garbage collected. Releasing more than once is harmless.
+    """
+
+    kind = "object"
+    # objects this one owns and destroys with itself, kept along with it by
+    # `Arena.keep`
+    dependents: tuple["WasmObject", ...] = ()
+
+    def _track(self, diffeq, pointer: int, release):
+        self.diffeq = diffeq
+        self.pointer = pointer
+        self._finalizer = diffeq._track(self, release)
+
+    @property
+    def destroyed(self) -> bool:
+        return not self._finalizer.alive
+
+    def destroy(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.destroy()
+
+
+class Arena:
+    """
+    Scope for wasm allocations, created with `Diffeq.arena()`.
+
+    Every Vector, Options and Solver created on the Diffeq while the arena is
+    active (the innermost one, if arenas are nested) is destroyed in bulk when the
+    `with` block exits. Use `keep` for objects that must outlive the arena.
+    """
+
+    def __init__(self, diffeq):
+        self.diffeq = diffeq
+        self.objects: list[WasmObject] = []
+
+    def add(self, obj: WasmObject):
+        self.objects.append(obj)
+
+    def keep(self, obj: WasmObject) -> WasmObject:
+        """
+        Remove `obj`, and the objects it owns, from the arena so that they are not
+        destroyed on exit
+        """
+        self.objects.remove(obj)
+        for dependent in obj.dependents:
+            if dependent in self.objects:
+                self.objects.remove(dependent)
+        return obj
+
+    def release(self):
+        objects, self.objects = self.objects, []
+        for obj in reversed(objects):
+            obj.destroy()
+
+    def __enter__(self) -> "Arena":
+        self.diffeq._arenas.append(self)
+        return self
+
+    def __exit__(self, *args):
+        self.diffeq._arenas.remove(self)
+        self.release()
+
+
+def finalizer(obj, callback, *args) -> weakref.finalize:
+    f = weakref.finalize(obj, callback, *args)
+    # wasm instances may already be torn down at interpreter exit
+    f.atexit = False
+    return f
@@ -0,0 +1,554 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import IO, Callable, Iterable, Iterator
+
+import numpy as np
+from numpy import ndarray
+from wasmtime import Engine, Module, WasmtimeError
+
+
+def default_cache_dir() -> str:
+    """Directory used for on-disk caches, overridable with PYBAMM2DIFFSL_CACHE_DIR"""
+    path = os.environ.get("PYBAMM2DIFFSL_CACHE_DIR")
+    if path is None:
+        path = os.path.join(os.path.expanduser("~"), ".cache", "pybamm2diffsl")
+    return path
+
+
+class DiskCache:
+    """
+    Directory of cache entries, where an entry is one file per extension in
+    `extensions`, named after the entry's key.
+
+    The total size of the cache is capped at `max_size` bytes, least recently used
+    entries are evicted first. If `version` is given, the cache is cleared the first
+    time it is used with a different version than the one it was filled with.
+    """
+
+    extensions: tuple[str, ...] = ()
+
+    def __init__(self, path: str, max_size: int, version: str | None = None):
+        self.path = path
+        self.max_size = max_size
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._version_checked = version is None
+
+    def _filename(self, key: str, ext: str) -> str:
+        return os.path.join(self.path, key + ext)
+
+    def _check_version(self):
+        if self._version_checked:
+            return
+        filename = os.path.join(self.path, "VERSION")
+        stored = self._read(filename)
+        if stored is None or stored.decode() != self.version:
+            self.clear()
+            self._write(filename, self.version.encode())
+        self._version_checked = True
+
+    def _read(self, filename: str) -> bytes | None:
+        try:
+            with open(filename, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, filename: str, data: bytes):
+        with self._writer(filename) as f:
+            f.write(data)
+
+    @contextmanager
+    def _writer(self, filename: str) -> Iterator[IO[bytes]]:
+        """File to write `filename` to, which only appears once the block succeeds"""
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+            os.replace(tmp, filename)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _touch(self, key: str):
+        for ext in self.extensions:
+            try:
+                os.utime(self._filename(key, ext))
+            except FileNotFoundError:
+                pass
+
+    def _entries(self) -> dict[str, tuple[float, int]]:
+        entries = {}
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            key, ext = os.path.splitext(name)
+            if ext not in self.extensions:
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                continue
+            mtime, size = entries.get(key, (0.0, 0))
+            entries[key] = (max(mtime, st.st_mtime), size + st.st_size)
+        return entries
+
+    def _remove(self, key: str):
+        for ext in self.extensions:
+            try:
+                os.unlink(self._filename(key, ext))
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in `max_size`"""
+        entries = self._entries()
+        total = sum(size for _, size in entries.values())
+        for key, (_, size) in sorted(entries.items(), key=lambda e: e[1][0]):
+            if total <= self.max_size:
+                break
+            self._remove(key)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def clear(self):
+        for key in self._entries():
+            self._remove(key)
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(entries),
+            "size": sum(size for _, size in entries.values()),
+        }
+
+
+class ModuleCache(DiskCache):
+    """
+    On-disk cache of compiled wasm modules.
+
+    Entries are keyed by a hash of the DiffSL text and the backend that compiled it.
+    Each entry stores the raw wasm returned by the backend (".wasm") and the
+    serialized wasmtime module (".cwasm"), so a hit needs neither a network call nor
+    a JIT compile. If the serialized module can no longer be loaded (e.g. after a
+    wasmtime upgrade) the module is rebuilt from the raw wasm and re-serialized.
+
+    The total size of the cache is capped at `max_size` bytes, least recently used
+    entries are evicted first. Serialized modules are loaded without validation, so
+    the cache directory must only be writable by trusted users.
+    """
+
+    extensions = (".wasm", ".cwasm")
+
+    def __init__(self, path: str | None = None, max_size: int = 512 * 1024 * 1024):
+        if path is None:
+            path = os.path.join(default_cache_dir(), "modules")
+        super().__init__(path, max_size)
+        self.wasm_hits = 0
+
+    @staticmethod
+    def hasher(backend: str) -> "hashlib._Hash":
+        """Hash that gives `key(model, backend)` once updated with the encoded model"""
+        h = hashlib.sha256()
+        h.update(backend.encode())
+        h.update(b"\0")
+        return h
+
+    @classmethod
+    def key(cls, model: str, backend: str) -> str:
+        h = cls.hasher(backend)
+        h.update(model.encode())
+        return h.hexdigest()
+
+    def get_wasm(self, key: str) -> bytes | None:
+        """Return the raw wasm for `key`, or None if it is not cached"""
+        return self._read(self._filename(key, ".wasm"))
+
+    def get(self, key: str, engine: Engine) -> Module | None:
+        """Return the module for `key` loaded into `engine`, or None on a miss"""
+        serialized = self._read(self._filename(key, ".cwasm"))
+        if serialized is not None:
+            try:
+                module = Module.deserialize(engine, serialized)
+            except WasmtimeError:
+                module = None
+            if module is not None:
+                with self._lock:
+                    self.hits += 1
+                self._touch(key)
+                return module
+
+        wasm = self.get_wasm(key)
+        if wasm is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        module = Module(engine, wasm)
+        with self._lock:
+            self.wasm_hits += 1
+        self._write(self._filename(key, ".cwasm"), module.serialize())
+        self._touch(key)
+        return module
+
+    def put(self, key: str, wasm: bytes, module: Module | None = None):
+        """Store the raw wasm and, if given, the compiled module for `key`"""
+        self._write(self._filename(key, ".wasm"), wasm)
+        if module is not None:
+            self._write(self._filename(key, ".cwasm"), module.serialize())
+        self.evict()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        lookups = self.hits + self.wasm_hits + self.misses
+        stats["wasm_hits"] = self.wasm_hits
+        stats["hit_rate"] = (self.hits + self.wasm_hits) / lookups if lookups else 0.0
+        return stats
+
+
+class _FileChunks:
+    """Iterator over the chunks of `size` characters of the open text file `f`"""
+
+    def __init__(self, f: IO[str], size: int):
+        self._f = f
+        self._size = size
+
+    def __iter__(self) -> "_FileChunks":
+        return self
+
+    def __next__(self) -> str:
+        chunk = self._f.read(self._size) if not self._f.closed else ""
+        if not chunk:
+            self.close()
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        self._f.close()
+
+    def __del__(self):
+        self.close()
+
+
+class ConversionCache(DiskCache):
+    """
+    On-disk cache of the DiffSL text generated from pybamm models, keyed by
+    `PybammModel.fingerprint`, so that converting a model again skips building it
+    with pybamm. A Diffeq created from the cached text is in turn found in the
+    ModuleCache, so neither pybamm nor the backend is involved.
+
+    Next to the text of an entry, a JSON sidecar holds the statistics of the
+    conversion that generated it (`PybammModel.cse_stats`).
+
+    The cache is cleared when it is first used with a different pybamm version than
+    the one that filled it. The total size is capped at `max_size` bytes, least
+    recently used entries are evicted first.
+    """
+
+    extensions = (".ds", ".json")
+
+    def __init__(
+        self,
+        path: str | None = None,
+        max_size: int = 256 * 1024 * 1024,
+        version: str | None = None,
+    ):
+        if path is None:
+            path = os.path.join(default_cache_dir(), "conversions")
+        if version is None:
+            import pybamm
+
+            version = pybamm.__version__
+        super().__init__(path, max_size, version)
+
+    def get(self, key: str) -> str | None:
+        """Return the DiffSL text for `key`, or None on a miss"""
+        self._check_version()
+        text = self._read(self._filename(key, ".ds"))
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if text is None:
+            return None
+        self._touch(key)
+        return text.decode()
+
+    def get_stream(self, key: str, chunk_size: int = 1 << 20) -> Iterator[str] | None:
+        """
+        As `get`, but the text is read in chunks of `chunk_size` characters. The
+        file is opened here, so an entry evicted after this returns is still read
+        whole, and closed once the returned iterator is exhausted, closed or
+        garbage collected.
+        """
+        self._check_version()
+        try:
+            f = open(self._filename(key, ".ds"), encoding="utf-8")
+        except FileNotFoundError:
+            f = None
+        with self._lock:
+            if f is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if f is None:
+            return None
+        self._touch(key)
+        return _FileChunks(f, chunk_size)
+
+    def get_stats(self, key: str) -> dict | None:
+        """Return the conversion statistics stored for `key`, or None if there are none"""
+        data = self._read(self._filename(key, ".json"))
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def put(self, key: str, text: str, stats: dict | None = None):
+        self._check_version()
+        if stats is not None:
+            self._write(self._filename(key, ".json"), json.dumps(stats).encode())
+        self._write(self._filename(key, ".ds"), text.encode())
+        self.evict()
+
+    def put_stream(
+        self, key: str, chunks: Iterable[str], stats: Callable[[], dict] | None = None
+    ) -> Iterator[str]:
+        """
+        Pass `chunks` through, storing their text for `key` as they go. The entry is
+        only stored if all of `chunks` is consumed, along with the result of `stats`,
+        called once they are.
+        """
+        self._check_version()
+        with self._writer(self._filename(key, ".ds")) as f:
+            for chunk in chunks:
+                f.write(chunk.encode())
+                yield chunk
+            if stats is not None:
+                self._write(self._filename(key, ".json"), json.dumps(stats()).encode())
+        self.evict()
+
+
+class TuningCache(DiskCache):
+    """
+    On-disk store of the solver options chosen by `autotune` for each model, keyed
+    by the model's module cache key (a hash of its DiffSL text and backend).
+    """
+
+    extensions = (".json",)
+
+    def __init__(self, path: str | None = None, max_size: int = 16 * 1024 * 1024):
+        if path is None:
+            path = os.path.join(default_cache_dir(), "tuning")
+        super().__init__(path, max_size)
+
+    def get(self, key: str) -> dict | None:
+        """Return the tuned configuration for `key`, or None if there is none"""
+        data = self._read(self._filename(key, ".json"))
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if data is None:
+            return None
+        self._touch(key)
+        return json.loads(data)
+
+    def put(self, key: str, config: dict):
+        self._write(self._filename(key, ".json"), json.dumps(config, sort_keys=True).encode())
+        self.evict()
+
+
+class SolutionCache:
+    """
+    In-memory LRU cache of solver outputs, keyed by `key` (the model, the solver
+    options, the times and the inputs), for callers that solve the same problem
+    repeatedly, e.g. optimisers and samplers revisiting input points.
+
+    At most `max_entries` outputs, taking at most `max_bytes`, are kept in memory,
+    least recently used ones are evicted first. If `spill_path` is given, evicted
+    outputs are written there instead of being dropped (up to `max_spill_bytes`,
+    also least recently used first), and hits on them are read back memory-mapped.
+    Outputs already in `spill_path`, e.g. spilled by an earlier process, are
+    indexed when the cache is created, oldest first, and count towards
+    `max_spill_bytes`. Returned arrays are read-only and must be copied to be
+    modified.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 256 * 1024 * 1024,
+        spill_path: str | None = None,
+        max_spill_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill_path = spill_path
+        self.max_spill_bytes = max_spill_bytes
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory: OrderedDict[str, ndarray] = OrderedDict()
+        self._memory_bytes = 0
+        self._spilled: OrderedDict[str, int] = OrderedDict()
+        self._spilled_bytes = 0
+        self._lock = threading.Lock()
+        if spill_path is not None:
+            self._index_spilled()
+
+    @staticmethod
+    def key(model: str, options: str, times: ndarray, inputs: ndarray) -> str:
+        """
+        Key of the outputs of solving `model` (its module cache key) with `options`
+        (any str identifying the solver settings) at `times` with `inputs`
+        """
+        h = hashlib.blake2b(digest_size=20)
+        for part in [model.encode(), options.encode(), times.tobytes(), inputs.tobytes()]:
+            h.update(len(part).to_bytes(8, "little"))
+            h.update(part)
+        return h.hexdigest()
+
+    def _spill_filename(self, key: str) -> str:
+        return os.path.join(self.spill_path, key + ".npy")
+
+    def _index_spilled(self):
+        """Index the outputs already in `spill_path`, and evict down to the cap"""
+        try:
+            names = os.listdir(self.spill_path)
+        except FileNotFoundError:
+            return
+        found = []
+        for name in names:
+            key, ext = os.path.splitext(name)
+            if ext != ".npy":
+                continue
+            try:
+                st = os.stat(os.path.join(self.spill_path, name))
+            except FileNotFoundError:
+                continue
+            found.append((st.st_mtime, key, st.st_size))
+        for _, key, size in sorted(found):
+            self._spilled[key] = size
+            self._spilled_bytes += size
+        self._evict_spilled()
+
+    def _evict_spilled(self):
+        removed = []
+        with self._lock:
+            while self._spilled_bytes > self.max_spill_bytes:
+                removed_key, size = self._spilled.popitem(last=False)
+                self._spilled_bytes -= size
+                removed.append(removed_key)
+        for removed_key in removed:
+            try:
+                os.unlink(self._spill_filename(removed_key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key: str) -> ndarray | None:
+        """Return the outputs for `key`, or None on a miss"""
+        with self._lock:
+            array = self._memory.get(key)
+            if array is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return array
+            if key not in self._spilled:
+                self.misses += 1
+                return None
+            self._spilled.move_to_end(key)
+            self.spill_hits += 1
+        try:
+            return np.load(self._spill_filename(key), mmap_mode="r")
+        except FileNotFoundError:
+            with self._lock:
+                self._spilled_bytes -= self._spilled.pop(key, 0)
+                self.spill_hits -= 1
+                self.misses += 1
+            return None
+
+    def put(self, key: str, array: ndarray):
+        """Store a copy of `array` as the outputs for `key`"""
+        array = np.array(array, dtype=np.float64)
+        array.setflags(write=False)
+        if array.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= old.nbytes
+            self._memory[key] = array
+            self._memory_bytes += array.nbytes
+            evicted = []
+            while len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes:
+                evicted_key, evicted_array = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_array.nbytes
+                self.evictions += 1
+                evicted.append((evicted_key, evicted_array))
+        if self.spill_path is not None:
+            for evicted_key, evicted_array in evicted:
+                self._spill(evicted_key, evicted_array)
+
+    def _spill(self, key: str, array: ndarray):
+        if array.nbytes > self.max_spill_bytes:
+            return
+        os.makedirs(self.spill_path, exist_ok=True)
+        filename = self._spill_filename(key)
+        fd, tmp = tempfile.mkstemp(dir=self.spill_path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+            size = f.tell()
+        os.replace(tmp, filename)
+        with self._lock:
+            self._spilled_bytes -= self._spilled.pop(key, 0)
+            self._spilled[key] = size
+            self._spilled_bytes += size
+        self._evict_spilled()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            spilled = list(self._spilled)
+            self._spilled.clear()
+            self._spilled_bytes = 0
+        for key in spilled:
+            try:
+                os.unlink(self._spill_filename(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.spill_hits + self.misses
+            return {
+                "hits": self.hits,
+                "spill_hits": self.spill_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.spill_hits) / lookups if lookups else 0.0,
+                "entries": len(self._memory),
+                "size": self._memory_bytes,
+                "spilled_entries": len(self._spilled),
+                "spilled_size": self._spilled_bytes,
+            }
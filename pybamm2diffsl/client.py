@@ -0,0 +1,225 @@
+import json
+import os
+import shlex
+import subprocess
+import tempfile
+import threading
+from typing import IO, Iterable, Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def iter_model(
+    model: str | IO | Iterable[str], chunk_size: int = 1 << 20
+) -> Iterator[str]:
+    """
+    The DiffSL text `model` in chunks. `model` is either the text itself, a file
+    object opened in text or binary (utf-8) mode, or an iterable of str chunks
+    such as `PybammModel.to_diffeq_stream`.
+    """
+    if isinstance(model, str):
+        yield model
+    elif hasattr(model, "read"):
+        for chunk in iter(lambda: model.read(chunk_size), model.read(0)):
+            yield chunk.decode() if isinstance(chunk, bytes) else chunk
+    else:
+        yield from model
+
+
+class SpooledModel:
+    """
+    A DiffSL model written chunk by chunk to a temporary file at `path`, so that it
+    can be compiled (and retried) without ever holding the whole text in memory.
+    `hash`, if given, is updated with the encoded text on the way. The file is
+    removed by `close` or on leaving a `with` block.
+    """
+
+    def __init__(self, model: str | IO | Iterable[str], hash=None):
+        self.hash = hash
+        fd, self.path = tempfile.mkstemp(suffix=".ds")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter_model(model):
+                    data = chunk.encode()
+                    f.write(data)
+                    if hash is not None:
+                        hash.update(data)
+        except BaseException:
+            os.unlink(self.path)
+            raise
+
+    def close(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "SpooledModel":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CompileClient:
+    """Base class for backends that compile DiffSL text into a wasm module"""
+
+    @property
+    def backend(self) -> str:
+        """Identifies the backend, used as part of the module cache key"""
+        raise NotImplementedError
+
+    def compile(self, model: str, name: str = "unknown") -> bytes:
+        raise NotImplementedError
+
+    def compile_file(self, path: str, name: str = "unknown") -> bytes:
+        """
+        Compile the DiffSL text in the file at `path`. By default the text is read
+        and passed to `compile`, backends that can stream it override this.
+        """
+        with open(path, encoding="utf-8") as f:
+            return self.compile(f.read(), name)
+
+
+class HttpCompileClient(CompileClient):
+    """
+    Compiles models by posting them to a diffeq backend server.
+
+    Requests go through a pooled `requests.Session` so connections are kept alive
+    between compiles. At most `max_connections` requests are in flight at once,
+    connection errors and 429/5xx responses are retried `retries` times with
+    exponential backoff, and every request is bounded by `timeout` (seconds, or a
+    (connect, read) tuple).
+    """
+
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        url: str,
+        timeout: float | tuple[float, float] = (10, 300),
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        max_connections: int = 8,
+    ):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(max_connections)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.retry_statuses,
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max_connections, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def backend(self) -> str:
+        return self.url
+
+    def post(self, model: str, name: str = "unknown") -> requests.Response:
+        data = {
+            "text": model,
+            "name": name,
+        }
+        return self._post(json=data)
+
+    def _post(self, **kwargs) -> requests.Response:
+        with self._semaphore:
+            r = self.session.post(self.url + "/compile", timeout=self.timeout, **kwargs)
+        r.raise_for_status()
+        return r
+
+    def compile(self, model: str, name: str = "unknown") -> bytes:
+        return self.post(model, name).content
+
+    def compile_file(self, path: str, name: str = "unknown") -> bytes:
+        """
+        Compile the DiffSL text in the file at `path`. The JSON request body is
+        written to a temporary file a chunk at a time and uploaded from there, so
+        the text is never held in memory whole and the upload can be retried.
+        """
+        with tempfile.TemporaryFile() as body:
+            body.write(b'{"name": ' + json.dumps(name).encode() + b', "text": "')
+            with open(path, encoding="utf-8") as f:
+                for chunk in iter_model(f):
+                    # escape the chunk as the inside of a JSON string
+                    body.write(json.dumps(chunk)[1:-1].encode())
+            body.write(b'"}')
+            body.seek(0)
+            headers = {"Content-Type": "application/json"}
+            return self._post(data=body, headers=headers).content
+
+    def close(self):
+        self.session.close()
+
+
+class LocalCompileClient(CompileClient):
+    """
+    Compiles models with a local compiler executable.
+
+    `command` is the argument list to run, "{input}" and "{output}" are replaced by
+    the path of the DiffSL file to compile and the path the wasm module should be
+    written to. A non-zero exit status raises a RuntimeError with the compiler's
+    output.
+    """
+
+    default_command = ("diffsl", "{input}", "-o", "{output}", "--wasm")
+
+    def __init__(
+        self,
+        command: list[str] | tuple[str, ...] = default_command,
+        timeout: float = 300,
+        max_processes: int = os.cpu_count() or 1,
+    ):
+        self.command = list(command)
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(max_processes)
+
+    @property
+    def backend(self) -> str:
+        return "local:" + shlex.join(self.command)
+
+    def compile(self, model: str, name: str = "unknown") -> bytes:
+        with SpooledModel(model) as spool:
+            return self.compile_file(spool.path, name)
+
+    def compile_file(self, path: str, name: str = "unknown") -> bytes:
+        """Compile the DiffSL text in the file at `path`, which is passed as is"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_path = os.path.join(tmpdir, "model.wasm")
+            args = [
+                arg.replace("{input}", path).replace("{output}", output_path)
+                for arg in self.command
+            ]
+            with self._semaphore:
+                result = subprocess.run(
+                    args, capture_output=True, text=True, timeout=self.timeout
+                )
+            if result.returncode != 0:
+                raise RuntimeError(
+                    f"{args[0]} failed with: {result.stderr or result.stdout}"
+                )
+            with open(output_path, "rb") as f:
+                return f.read()
+
+
+def client_from_string(backend: str) -> CompileClient:
+    """
+    Create a client from a backend description: an http(s) url selects a server,
+    anything else is taken as a local compiler command line.
+    """
+    if backend.startswith(("http://", "https://")):
+        return HttpCompileClient(backend)
+    command = shlex.split(backend)
+    if "{input}" not in command:
+        command += list(LocalCompileClient.default_command[1:])
+    return LocalCompileClient(command)
@@ -1,47 +1,335 @@
+import asyncio
+import codecs
 import ctypes
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from functools import partial
-from requests import Response
-from wasmtime import Linker, Store, Module, WasiConfig
+from typing import IO, AsyncIterator, Callable, Iterable, Iterator
+from wasmtime import Engine, Linker, Store, Module, WasiConfig
 from numpy import ndarray
 import numpy as np
 from ctypes import c_ubyte
 
+from . import instrument
+from .arena import Arena, finalizer
+from .cache import ModuleCache, SolutionCache, TuningCache
+from .client import CompileClient, SpooledModel, client_from_string
+from .ffi import bind
 from .options import Options
 from .solver import Solver
 from .vector import Vector
 
-import requests
+_clients: dict[str, CompileClient] = {}
+_modules: OrderedDict[str, Module] = OrderedDict()
+_module_locks: dict[str, threading.Lock] = {}
+_modules_lock = threading.Lock()
+
+# attributes bound on each Diffeq, mapped to the name of the wasm export they call
+_exports = {
+    "Solver_create": "Sundials_create",
+    "Solver_destroy": "Sundials_destroy",
+    "Solver_solve": "Sundials_solve",
+    "Solver_init": "Sundials_init",
+    "Solver_number_of_states": "Sundials_number_of_states",
+    "Solver_number_of_inputs": "Sundials_number_of_inputs",
+    "Solver_number_of_outputs": "Sundials_number_of_outputs",
+    **{
+        name: name
+        for name in [
+            "Options_create",
+            "Options_destroy",
+            "Options_set_fixed_times",
+            "Options_set_print_stats",
+            "Options_set_fwd_sens",
+            "Options_get_fixed_times",
+            "Options_get_print_stats",
+            "Options_get_fwd_sens",
+            "Options_get_linear_solver",
+            "Options_set_linear_solver",
+            "Options_get_preconditioner",
+            "Options_set_preconditioner",
+            "Options_get_jacobian",
+            "Options_set_jacobian",
+            "Options_set_atol",
+            "Options_get_atol",
+            "Options_set_rtol",
+            "Options_get_rtol",
+            "Options_set_linsol_max_iterations",
+            "Options_get_linsol_max_iterations",
+            "Options_get_debug",
+            "Options_set_debug",
+            "Vector_create",
+            "Vector_destroy",
+            "Vector_get",
+            "Vector_get_length",
+            "Vector_resize",
+            "Vector_get_data",
+            "Vector_linspace_create",
+            "Vector_create_with_capacity",
+            "Vector_push",
+        ]
+    },
+}
+
+
+def _map_as_completed(
+    fn: Callable, items: Iterable, max_workers: int, return_exceptions: bool
+) -> Iterator[tuple[int, object]]:
+    executor = ThreadPoolExecutor(max_workers)
+    try:
+        futures = {executor.submit(fn, item): i for i, item in enumerate(items)}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                result = e
+            yield futures[future], result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+async def _map_as_completed_async(
+    fn: Callable, items: Iterable, concurrency: int, return_exceptions: bool
+) -> AsyncIterator[tuple[int, object]]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(i, item):
+        async with semaphore:
+            try:
+                return i, await asyncio.to_thread(fn, item)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return i, e
+
+    tasks = [asyncio.ensure_future(call(i, item)) for i, item in enumerate(items)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class _Stdout:
+    """
+    WASI stdout of an instance: forwarded to `sys.stdout` as it is written, and kept
+    until it is `take`n. It must not refer to the Diffeq, which would then never be
+    freed, as wasmtime keeps the callback alive as long as the store.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._text = []
+
+    def write(self, data: bytes):
+        text = self._decoder.decode(data)
+        self._text.append(text)
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    def take(self) -> str:
+        """Return the output written since the last call"""
+        text = "".join(self._text)
+        self._text.clear()
+        return text
 
 
 class Diffeq:
     baseUrl = "https://diffeq-backend-staging.fly.dev"
+    client: CompileClient | None = None
+    cache: ModuleCache | None = ModuleCache()
+    tuning: TuningCache | None = TuningCache()
+    engine = Engine()
+    max_free_vectors = 64
+    max_modules = 32
 
     @classmethod
-    def compile(cls, model: str) -> Response:
-        url = cls.baseUrl + "/compile"
-        data = {
-            "text": model,
-            "name": "unknown",
-        }
-        # body = json.dumps(data)
-        # options = {
-        #     "method": "POST",
-        #     "mode": "cors",
-        #     "headers": {
-        #         "Content-Type": "application/json",
-        #     },
-        #     "body": body,
-        # }
-        r = requests.post(url, json=data, stream=True)
-        r.raise_for_status()
-        return r
-
-    def __init__(self, model: str):
+    def get_client(cls) -> CompileClient:
+        """
+        The client used to compile models: `client` if it is set, otherwise a shared
+        client for the backend named by PYBAMM2DIFFSL_BACKEND (a url or a local
+        compiler command), defaulting to `baseUrl`.
+        """
+        if cls.client is not None:
+            return cls.client
+        backend = os.environ.get("PYBAMM2DIFFSL_BACKEND", cls.baseUrl)
+        client = _clients.get(backend)
+        if client is None:
+            client = _clients.setdefault(backend, client_from_string(backend))
+        return client
+
+    @classmethod
+    @contextmanager
+    def _prepare(
+        cls, model: str | IO | Iterable[str]
+    ) -> Iterator[tuple[str, Callable[[], bytes]]]:
+        """
+        The module cache key of `model` and a function compiling it. A model given
+        as a file object or as chunks is spooled to a temporary file (and hashed on
+        the way) for the duration of the block, and compiled from there.
+        """
+        client = cls.get_client()
+        if isinstance(model, str):
+            key = ModuleCache.key(model, client.backend)
+            yield key, partial(cls._compile_with, client.compile, model)
+            return
+        with SpooledModel(model, ModuleCache.hasher(client.backend)) as spool:
+            key = spool.hash.hexdigest()
+            yield key, partial(cls._compile_with, client.compile_file, spool.path)
+
+    @staticmethod
+    def _compile_with(compile: Callable[[str], bytes], model: str) -> bytes:
+        with instrument.span("compile"):
+            wasm_bytes = compile(model)
+        instrument.count("compile.wasm_bytes", len(wasm_bytes))
+        return wasm_bytes
+
+    @classmethod
+    def compile(cls, model: str | IO | Iterable[str]) -> bytes:
+        """
+        Compile `model`: DiffSL text, a file object, or an iterable of str chunks
+        (e.g. `PybammModel.to_diffeq_stream`) which is streamed to the backend
+        """
+        with cls._prepare(model) as (_, compile):
+            return compile()
+
+    @classmethod
+    def compile_cached(cls, model: str | IO | Iterable[str]) -> bytes:
+        """Like `compile`, but returns the raw wasm from `cache` if it is there"""
+        if cls.cache is None:
+            return cls.compile(model)
+        with cls._prepare(model) as (key, compile):
+            wasm_bytes = cls.cache.get_wasm(key)
+            if wasm_bytes is None:
+                wasm_bytes = compile()
+                cls.cache.put(key, wasm_bytes)
+        return wasm_bytes
+
+    @classmethod
+    def compile_many(
+        cls,
+        models: Iterable[str],
+        max_workers: int = 8,
+        return_exceptions: bool = False,
+    ) -> Iterator[tuple[int, bytes]]:
+        """
+        Compile `models` concurrently, with at most `max_workers` compiles in flight.
+        Yields (index, wasm) pairs in the order the compiles finish. If
+        `return_exceptions` is True a failed compile yields its exception instead
+        of raising it.
+        """
+        return _map_as_completed(
+            cls.compile_cached, models, max_workers, return_exceptions
+        )
+
+    @classmethod
+    def from_many(
+        cls,
+        models: Iterable[str],
+        max_workers: int = 8,
+        return_exceptions: bool = False,
+    ) -> Iterator[tuple[int, "Diffeq"]]:
+        """As `compile_many`, but yields (index, Diffeq) pairs"""
+        return _map_as_completed(cls, models, max_workers, return_exceptions)
+
+    @classmethod
+    def compile_many_async(
+        cls,
+        models: Iterable[str],
+        concurrency: int = 8,
+        return_exceptions: bool = False,
+    ) -> AsyncIterator[tuple[int, bytes]]:
+        """Asyncio version of `compile_many`"""
+        return _map_as_completed_async(
+            cls.compile_cached, models, concurrency, return_exceptions
+        )
+
+    @classmethod
+    def from_many_async(
+        cls,
+        models: Iterable[str],
+        concurrency: int = 8,
+        return_exceptions: bool = False,
+    ) -> AsyncIterator[tuple[int, "Diffeq"]]:
+        """Asyncio version of `from_many`"""
+        return _map_as_completed_async(cls, models, concurrency, return_exceptions)
+
+    @classmethod
+    def load_module(cls, model: str | IO | Iterable[str]) -> Module:
+        """
+        Compile `model` into a module on the shared `engine`. The `max_modules`
+        most recently used modules are kept, so a model is compiled (or loaded
+        from `cache`) once while it is in use, and every Diffeq of that model
+        shares it. A module dropped from the registry stays alive for the Diffeqs
+        using it, and is loaded again from `cache` when next needed.
+        """
+        return cls._load_module(model)[1]
+
+    @classmethod
+    def _load_module(cls, model: str | IO | Iterable[str]) -> tuple[str, Module]:
+        with cls._prepare(model) as (key, compile):
+            with _modules_lock:
+                module = _modules.get(key)
+                if module is not None:
+                    _modules.move_to_end(key)
+                    return key, module
+                lock = _module_locks.setdefault(key, threading.Lock())
+            with lock:
+                with _modules_lock:
+                    module = _modules.get(key)
+                if module is None:
+                    module = cls._compile_module(key, compile)
+                    with _modules_lock:
+                        _modules[key] = module
+                        _module_locks.pop(key, None)
+                        while len(_modules) > cls.max_modules:
+                            _modules.popitem(last=False)
+        return key, module
+
+    @classmethod
+    def _compile_module(cls, key: str, compile: Callable[[], bytes]) -> Module:
+        if cls.cache is None:
+            wasm_bytes = compile()
+            with instrument.span("jit"):
+                return Module(cls.engine, wasm_bytes)
+        with instrument.span("module_cache.get"):
+            module = cls.cache.get(key, cls.engine)
+        if module is None:
+            wasm_bytes = compile()
+            with instrument.span("jit"):
+                module = Module(cls.engine, wasm_bytes)
+            cls.cache.put(key, wasm_bytes, module)
+        return module
+
+    @classmethod
+    def clear_modules(cls):
+        """Forget all modules compiled by this process"""
+        with _modules_lock:
+            _modules.clear()
+
+    def __init__(self, model: str | IO | Iterable[str], module: Module | None = None):
+        """
+        Instantiate `model` (see `compile` for the forms it can take). The module is
+        compiled with `load_module` unless an already compiled `module` (on the
+        shared `engine`) is given.
+
+        `key` is the module cache key of the model, which identifies it in `tuning`.
+        It is None if a compiled `module` is given with a model that is not a str.
+        """
         self._model = model
-        wasm_bytes = self.compile(model).content
-        self._store = Store()
+        self._store = Store(self.engine)
         wasi = WasiConfig()
-        wasi.inherit_stdout()
+        # captured, so that solvers can parse the statistics they print
+        self._stdout = _Stdout()
+        wasi.stdout_custom = self._stdout.write
         wasi.inherit_stderr()
         wasi.inherit_stdin()
         wasi.inherit_argv()
@@ -49,131 +337,189 @@ class Diffeq:
         self._store.set_wasi(wasi)
         linker = Linker(self._store.engine)
         linker.define_wasi()
-        self._module = Module(self._store.engine, wasm_bytes)
-        self._linking = linker.instantiate(self._store, self._module)
-
-        exports = self._linking.exports(self._store)
-        self.Solver_create = partial(exports["Sundials_create"], self._store)
-        self.Solver_destroy = partial(exports["Sundials_destroy"], self._store)
-        self.Solver_solve = partial(exports["Sundials_solve"], self._store)
-        self.Solver_init = partial(exports["Sundials_init"], self._store)
-        self.Solver_number_of_states = partial(
-            exports["Sundials_number_of_states"], self._store
-        )
-        self.Solver_number_of_inputs = partial(
-            exports["Sundials_number_of_inputs"], self._store
-        )
-        self.Solver_number_of_outputs = partial(
-            exports["Sundials_number_of_outputs"], self._store
-        )
+        if module is not None:
+            self._module = module
+            self.key = (
+                ModuleCache.key(model, self.get_client().backend)
+                if isinstance(model, str)
+                else None
+            )
+        else:
+            self.key, self._module = self._load_module(model)
+        self._tuned = None
+        with instrument.span("instantiate"):
+            self._linking = linker.instantiate(self._store, self._module)
 
-        self.Options_create = partial(exports["Options_create"], self._store)
-        self.Options_destroy = partial(exports["Options_destroy"], self._store)
-        self.Options_set_fixed_times = partial(
-            exports["Options_set_fixed_times"], self._store
-        )
-        self.Options_set_print_stats = partial(
-            exports["Options_set_print_stats"], self._store
-        )
-        self.Options_set_fwd_sens = partial(
-            exports["Options_set_fwd_sens"], self._store
-        )
-        self.Options_get_fixed_times = partial(
-            exports["Options_get_fixed_times"], self._store
-        )
-        self.Options_get_print_stats = partial(
-            exports["Options_get_print_stats"], self._store
-        )
-        self.Options_get_fwd_sens = partial(
-            exports["Options_get_fwd_sens"], self._store
-        )
-        self.Options_get_linear_solver = partial(
-            exports["Options_get_linear_solver"], self._store
-        )
-        self.Options_set_linear_solver = partial(
-            exports["Options_set_linear_solver"], self._store
-        )
-        self.Options_get_preconditioner = partial(
-            exports["Options_get_preconditioner"], self._store
-        )
-        self.Options_set_preconditioner = partial(
-            exports["Options_set_preconditioner"], self._store
-        )
-        self.Options_get_jacobian = partial(
-            exports["Options_get_jacobian"], self._store
-        )
-        self.Options_set_jacobian = partial(
-            exports["Options_set_jacobian"], self._store
-        )
-        self.Options_set_atol = partial(exports["Options_set_atol"], self._store)
-        self.Options_get_atol = partial(exports["Options_get_atol"], self._store)
-        self.Options_set_rtol = partial(exports["Options_set_rtol"], self._store)
-        self.Options_get_rtol = partial(exports["Options_get_rtol"], self._store)
-        self.Options_set_linsol_max_iterations = partial(
-            exports["Options_set_linsol_max_iterations"], self._store
-        )
-        self.Options_get_linsol_max_iterations = partial(
-            exports["Options_get_linsol_max_iterations"], self._store
-        )
-        self.Options_get_debug = partial(exports["Options_get_debug"], self._store)
-        self.Options_set_debug = partial(exports["Options_set_debug"], self._store)
-
-        self.Vector_create = partial(exports["Vector_create"], self._store)
-        self.Vector_destroy = partial(exports["Vector_destroy"], self._store)
-        self.Vector_get = partial(exports["Vector_get"], self._store)
-        self.Vector_get_length = partial(exports["Vector_get_length"], self._store)
-        self.Vector_resize = partial(exports["Vector_resize"], self._store)
-        self.Vector_get_data = partial(exports["Vector_get_data"], self._store)
-        self.Vector_linspace_create = partial(
-            exports["Vector_linspace_create"], self._store
-        )
-        self.Vector_create_with_capacity = partial(
-            exports["Vector_create_with_capacity"], self._store
-        )
-        self.Vector_push = partial(exports["Vector_push"], self._store)
+            exports = self._linking.exports(self._store)
+            for name, export in _exports.items():
+                func = bind(self._store, exports[export])
+                if instrument.enabled:
+                    func = instrument.counted(f"ffi.{export}", func)
+                setattr(self, name, func)
+            self._memory = exports["memory"]
+
+        self._memory_len = self.memory_size()
+        self._memory_generation = 0
+        self._memory_array = None
+        self._memory_array_generation = -1
+
+        self.live = {"Vector": 0, "Options": 0, "Solver": 0}
+        self._vectors = weakref.WeakSet()
+        self._free_vectors: dict[int, list[int]] = {}
+        self._n_free_vectors = 0
+        self._arenas: list[Arena] = []
 
     def memory_ndarray(self) -> ndarray:
-        mem = self._linking.exports(self._store)["memory"].data_ptr(self._store)
-        size = self._linking.exports(self._store)["memory"].data_len(self._store)
-        ptr_type = ctypes.c_ubyte * size
-        buffer = ptr_type.from_address(ctypes.addressof(mem))
-        return np.frombuffer(buffer, dtype=np.uint8)
+        """
+        uint8 view of the whole of wasm linear memory. The view is cached and
+        re-created when memory grows, it must not be kept across calls into wasm.
+        """
+        generation = self.memory_generation()
+        if self._memory_array_generation != generation:
+            ptr_type = ctypes.c_ubyte * self._memory_len
+            buffer = ptr_type.from_address(ctypes.addressof(self.memory_ptr().contents))
+            self._memory_array = np.frombuffer(buffer, dtype=np.uint8)
+            self._memory_array_generation = generation
+        return self._memory_array
 
     def memory_ptr(self) -> "ctypes._Pointer[c_ubyte]":
-        return self._linking.exports(self._store)["memory"].data_ptr(self._store)
+        return self._memory.data_ptr(self._store)
 
     def memory_size(self) -> int:
-        return self._linking.exports(self._store)["memory"].data_len(self._store)
+        return self._memory.data_len(self._store)
+
+    def memory_generation(self) -> int:
+        """
+        Counter that is incremented whenever wasm linear memory is found to have
+        grown (and so may have moved) since the last call. Host views of linear
+        memory taken at one generation must not be used at a later one.
+        """
+        size = self.memory_size()
+        if size != self._memory_len:
+            self._memory_len = size
+            self._memory_generation += 1
+        return self._memory_generation
+
+    def arena(self) -> Arena:
+        """
+        Scope in which all Vectors, Options and Solvers created on this Diffeq are
+        destroyed together on exit, e.g. `with diffeq.arena(): ...`
+        """
+        return Arena(self)
+
+    def _track(self, obj, release: Callable[[int], None]) -> weakref.finalize:
+        self.live[obj.kind] += 1
+        if obj.kind == "Vector":
+            self._vectors.add(obj)
+        if self._arenas:
+            self._arenas[-1].add(obj)
+        return finalizer(obj, self._release, obj.kind, release, obj.pointer)
+
+    def _release(self, kind: str, release: Callable[[int], None], pointer: int):
+        self.live[kind] -= 1
+        release(pointer)
+
+    def _take_vector(self, length: int) -> int | None:
+        pointers = self._free_vectors.get(length)
+        if not pointers:
+            return None
+        self._n_free_vectors -= 1
+        return pointers.pop()
 
-    def solver(self, options: Options) -> Solver:
-        return Solver(self, options)
+    def _free_vector(self, pointer: int):
+        # keep released vectors for reuse by the next vector of the same length
+        if self._n_free_vectors >= self.max_free_vectors:
+            self.Vector_destroy(pointer)
+            return
+        length = self.Vector_get_length(pointer)
+        self._free_vectors.setdefault(length, []).append(pointer)
+        self._n_free_vectors += 1
+
+    def release_free_vectors(self):
+        """Destroy the vectors kept for reuse"""
+        for pointers in self._free_vectors.values():
+            for pointer in pointers:
+                self.Vector_destroy(pointer)
+        self._free_vectors.clear()
+        self._n_free_vectors = 0
+
+    def allocation_stats(self) -> dict:
+        """Number of live wasm objects, and bytes held by live and free vectors"""
+        vector_bytes = sum(8 * len(v) for v in list(self._vectors) if not v.destroyed)
+        free_bytes = sum(
+            8 * length * len(pointers) for length, pointers in self._free_vectors.items()
+        )
+        return {
+            "vectors": self.live["Vector"],
+            "options": self.live["Options"],
+            "solvers": self.live["Solver"],
+            "vector_bytes": vector_bytes,
+            "free_vectors": self._n_free_vectors,
+            "free_vector_bytes": free_bytes,
+        }
+
+    def solver(
+        self,
+        options: Options,
+        cache: SolutionCache | None = None,
+        input_parameters=None,
+    ) -> Solver:
+        return Solver(self, options, cache, input_parameters)
 
     def vector(self, array: list | ndarray) -> Vector:
         return Vector(self, array)
 
+    def linspace(self, start: float, stop: float, num: int) -> Vector:
+        return Vector.linspace(self, start, stop, num)
+
     def options(
         self,
         fixed_times=False,
         print_stats=False,
         fwd_sens=False,
-        atol=1e-6,
-        rtol=1e-6,
-        linear_solver=Options.LinearSolver.LINEAR_SOLVER_DENSE,
-        preconditioner=Options.Preconditioner.PRECON_NONE,
-        jacobian=Options.Jacobian.DENSE_JACOBIAN,
-        linsol_max_iterations=100,
+        atol=None,
+        rtol=None,
+        linear_solver=None,
+        preconditioner=None,
+        jacobian=None,
+        linsol_max_iterations=None,
         debug=False,
     ) -> Options:
+        """
+        Options for solving this model. The solver settings that are not given (atol,
+        rtol, linear_solver, preconditioner, jacobian and linsol_max_iterations) are
+        those chosen by `autotune` if the model has been tuned, and otherwise the
+        defaults of `Options`.
+        """
+        settings = {
+            "atol": atol,
+            "rtol": rtol,
+            "linear_solver": linear_solver,
+            "preconditioner": preconditioner,
+            "jacobian": jacobian,
+            "linsol_max_iterations": linsol_max_iterations,
+        }
+        defaults = {**Options.default_settings(), **self.tuned_options()}
+        for name, value in settings.items():
+            if value is None:
+                settings[name] = defaults[name]
         return Options(
             self,
             fixed_times,
             print_stats,
             fwd_sens,
-            atol,
-            rtol,
-            linear_solver,
-            preconditioner,
-            jacobian,
-            linsol_max_iterations,
-            debug,
+            debug=debug,
+            **settings,
         )
+
+    def tuned_options(self) -> dict:
+        """
+        The solver settings stored in `tuning` for this model by `autotune`, as
+        keyword arguments of `options`, or {} if it has not been tuned
+        """
+        if self._tuned is None:
+            config = None
+            if self.tuning is not None and self.key is not None:
+                config = self.tuning.get(self.key)
+            self._tuned = Options.settings_from_config(config or {})
+        return self._tuned
@@ -0,0 +1,118 @@
+import ctypes
+from functools import partial
+from typing import Callable
+
+from wasmtime import Func, Store, Trap, ValType, WasmtimeError
+from wasmtime import _ffi as ffi
+from wasmtime import _func
+
+_raw_fields = {
+    str(ValType.i32()): "i32",
+    str(ValType.i64()): "i64",
+    str(ValType.f32()): "f32",
+    str(ValType.f64()): "f64",
+}
+
+_raw_field_types = {
+    "i32": ctypes.c_int32,
+    "i64": ctypes.c_int64,
+    "f32": ctypes.c_float,
+    "f64": ctypes.c_double,
+}
+
+
+def _unchecked_call():
+    """
+    wasmtime's unchecked call, if its ctypes signature and raw value layout are the
+    ones `bind` was written against (wasmtime-py 49), otherwise None
+    """
+    try:
+        call = ffi.dll.wasmtime_func_call_unchecked
+        expected = [
+            ctypes.POINTER(ffi.wasmtime_context_t),
+            ctypes.POINTER(ffi.wasmtime_func_t),
+            ctypes.POINTER(ffi.wasmtime_val_raw_t),
+            ctypes.c_size_t,
+            ctypes.POINTER(ctypes.POINTER(ffi.wasm_trap_t)),
+        ]
+        if list(call.argtypes or []) != expected:
+            return None
+        if call.restype != ctypes.POINTER(ffi.wasmtime_error_t):
+            return None
+        fields = dict(ffi.wasmtime_val_raw_t._fields_)
+        if any(fields.get(name) != ty for name, ty in _raw_field_types.items()):
+            return None
+        if not all(
+            callable(getattr(cls, "_from_ptr", None)) for cls in (WasmtimeError, Trap)
+        ):
+            return None
+        if not callable(getattr(_func, "maybe_raise_last_exn", None)):
+            return None
+    except AttributeError:
+        return None
+    return call
+
+
+_call = _unchecked_call()
+
+
+def bind(store: Store, func: Func) -> Callable:
+    """
+    Return a callable for the exported function `func` of an instance in `store`.
+
+    `Func.__call__` looks up the function's type and converts every argument and
+    result through a `Val` on each call. For functions taking and returning only
+    numbers, which is every export of the solver apart from memory, the signature
+    is resolved once here and calls go straight to wasmtime's unchecked call with a
+    preallocated raw value buffer. Anything else, or a wasmtime whose internals
+    differ from the ones this was written against, falls back to `Func.__call__`.
+
+    The returned callable is not thread-safe, but neither is the store it uses.
+    """
+    if _call is None:
+        return partial(func, store)
+    try:
+        ty = func.type(store)
+        param_fields = [_raw_fields[str(t)] for t in ty.params]
+        result_fields = [_raw_fields[str(t)] for t in ty.results]
+        context = store._context()
+        func_ref = ctypes.byref(func._func)
+    except (AttributeError, KeyError):
+        return partial(func, store)
+    if not isinstance(context, ctypes.POINTER(ffi.wasmtime_context_t)) or not isinstance(
+        func._func, ffi.wasmtime_func_t
+    ):
+        return partial(func, store)
+    if len(result_fields) > 1:
+        return partial(func, store)
+
+    n = max(len(param_fields), len(result_fields), 1)
+    raw = (ffi.wasmtime_val_raw_t * n)()
+    params = list(enumerate(param_fields))
+    result_field = result_fields[0] if result_fields else None
+
+    def bound(*args):
+        if len(args) != len(params):
+            raise WasmtimeError(
+                f"expected {len(params)} parameters, given {len(args)}"
+            )
+        for (i, field), arg in zip(params, args):
+            setattr(raw[i], field, arg)
+        trap = ctypes.POINTER(ffi.wasm_trap_t)()
+        # `store` is referenced here, not just its context, so that the context
+        # is not freed while the bound function is alive
+        error = _call(store._context(), func_ref, raw, n, ctypes.byref(trap))
+        # as in wasmtime's `enter_wasm`, an exception raised by a host function
+        # called from wasm is re-raised in place of the error or trap it caused
+        if error:
+            error = WasmtimeError._from_ptr(error)
+            _func.maybe_raise_last_exn()
+            raise error
+        if trap:
+            trap = Trap._from_ptr(trap)
+            _func.maybe_raise_last_exn()
+            raise trap
+        if result_field is not None:
+            return getattr(raw[0], result_field)
+
+    return bound
@@ -0,0 +1,218 @@
+"""
+Opt-in timing and counters for conversion, compilation and solving.
+
+Instrumentation is off by default, and while it is off `span` returns a shared
+no-op context manager and `count` returns immediately, so the instrumented code
+paths cost next to nothing. Call `enable()` to start recording:
+
+    instrument.enable()
+    diffeq = Diffeq(model.to_diffeq(inputs, outputs))
+    ...
+    print(instrument.report())
+
+Every finished span and counter increment is also passed, as a dict, to the hooks
+added with `add_hook`, e.g. an `OtelJsonExporter`. Counts of wasm calls are only
+recorded for Diffeqs created while instrumentation is enabled.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import IO, Callable
+
+enabled = False
+
+_lock = threading.Lock()
+_local = threading.local()
+_timers: dict[str, list[float]] = {}
+_counters: dict[str, float] = {}
+_hooks: list[Callable[[dict], None]] = []
+_disabled_span = nullcontext()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Forget all recorded timings and counts"""
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def add_hook(hook: Callable[[dict], None]):
+    """
+    Call `hook` with every finished span, as a dict with "type" "span", "name",
+    "attributes", "start" and "end" (ns since the epoch), "duration" (s),
+    "trace_id", "span_id" and "parent_id", and every counter increment, as a dict
+    with "type" "counter", "name" and "value".
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Callable[[dict], None]):
+    _hooks.remove(hook)
+
+
+class _Span:
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> "_Span":
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        parent = stack[-1] if stack else None
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        stack.append(self)
+        self.start = time.time_ns()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        duration = time.perf_counter() - self._start
+        _local.stack.pop()
+        with _lock:
+            timer = _timers.get(self.name)
+            if timer is None:
+                _timers[self.name] = [1, duration, duration, duration]
+            else:
+                timer[0] += 1
+                timer[1] += duration
+                timer[2] = min(timer[2], duration)
+                timer[3] = max(timer[3], duration)
+        if _hooks:
+            event = {
+                "type": "span",
+                "name": self.name,
+                "attributes": self.attributes,
+                "start": self.start,
+                "end": self.start + int(duration * 1e9),
+                "duration": duration,
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+            }
+            for hook in list(_hooks):
+                hook(event)
+
+
+def span(name: str, **attributes):
+    """Context manager timing its block under `name`"""
+    if not enabled:
+        return _disabled_span
+    return _Span(name, attributes)
+
+
+def count(name: str, value: float = 1):
+    """Add `value` to the counter `name`"""
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    if _hooks:
+        event = {"type": "counter", "name": name, "value": value}
+        for hook in list(_hooks):
+            hook(event)
+
+
+def report() -> dict:
+    """
+    The recorded timings, by span name, as count, total, mean, min and max wall
+    time in seconds, and the counters, by name
+    """
+    with _lock:
+        timers = {
+            name: {
+                "count": n,
+                "total": total,
+                "mean": total / n,
+                "min": shortest,
+                "max": longest,
+            }
+            for name, (n, total, shortest, longest) in sorted(_timers.items())
+        }
+        counters = dict(sorted(_counters.items()))
+    return {"timers": timers, "counters": counters}
+
+
+def counted(name: str, func: Callable) -> Callable:
+    """Wrap `func` to count its calls under `name`"""
+
+    def wrapper(*args):
+        count(name)
+        return func(*args)
+
+    return wrapper
+
+
+def _otel_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtelJsonExporter:
+    """
+    Hook writing each finished span to `file` (a path or a text file object) as one
+    line of OTLP/JSON, the JSON encoding of an OpenTelemetry ExportTraceServiceRequest,
+    as read by e.g. the OpenTelemetry collector's otlpjsonfile receiver. Counter
+    increments are not exported, they are in `report()`.
+    """
+
+    def __init__(self, file: str | IO[str], service_name: str = "pybamm2diffsl"):
+        self._file = open(file, "a") if isinstance(file, str) else file
+        self._owns_file = isinstance(file, str)
+        self._lock = threading.Lock()
+        self.resource = {
+            "attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]
+        }
+
+    def __call__(self, event: dict):
+        if event["type"] != "span":
+            return
+        span = {
+            "traceId": event["trace_id"],
+            "spanId": event["span_id"],
+            "name": event["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(event["start"]),
+            "endTimeUnixNano": str(event["end"]),
+            "attributes": [
+                {"key": key, "value": _otel_value(value)}
+                for key, value in event["attributes"].items()
+            ],
+        }
+        if event["parent_id"] is not None:
+            span["parentSpanId"] = event["parent_id"]
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": self.resource,
+                    "scopeSpans": [{"scope": {"name": "pybamm2diffsl"}, "spans": [span]}],
+                }
+            ]
+        }
+        line = json.dumps(request)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._owns_file:
+            self._file.close()
@@ -1,7 +1,22 @@
+import inspect
 from enum import Enum
 
+from .arena import WasmObject
+
+# the settings of the solver itself, which `autotune` chooses between
+_settings = [
+    "atol",
+    "rtol",
+    "linear_solver",
+    "preconditioner",
+    "jacobian",
+    "linsol_max_iterations",
+]
+
+
+class Options(WasmObject):
+    kind = "Options"
 
-class Options:
     class LinearSolver(Enum):
         LINEAR_SOLVER_DENSE = 0
         LINEAR_SOLVER_KLU = 1
@@ -35,7 +50,7 @@ class Options:
         linsol_max_iterations=100,
         debug: bool = False,
     ):
-        self.pointer = diffeq.Options_create()
+        self._track(diffeq, diffeq.Options_create(), diffeq.Options_destroy)
         diffeq.Options_set_fixed_times(self.pointer, 1 if fixed_times else 0)
         diffeq.Options_set_print_stats(self.pointer, 1 if print_stats else 0)
         diffeq.Options_set_fwd_sens(self.pointer, 1 if fwd_sens else 0)
@@ -47,11 +62,6 @@ class Options:
         diffeq.Options_set_linsol_max_iterations(self.pointer, linsol_max_iterations)
         diffeq.Options_set_debug(self.pointer, 1 if debug else 0)
 
-        self.diffeq = diffeq
-
-    def destroy(self):
-        self.diffeq.Options_destroy(self.pointer)
-
     def get_fixed_times(self) -> bool:
         return self.diffeq.Options_get_fixed_times(self.pointer) == 1
 
@@ -83,3 +93,38 @@ class Options:
 
     def get_debug(self) -> bool:
         return self.diffeq.Options_get_debug(self.pointer) == 1
+
+    def config(self) -> dict:
+        """The solver settings, as a dict of JSON types, see `settings_from_config`"""
+        return {
+            "atol": self.get_atol(),
+            "rtol": self.get_rtol(),
+            "linear_solver": self.get_linear_solver().name,
+            "preconditioner": self.get_preconditioner().name,
+            "jacobian": self.get_jacobian().name,
+            "linsol_max_iterations": self.get_linsol_max_iterations(),
+        }
+
+    @staticmethod
+    def default_settings() -> dict:
+        """The solver settings used when they are not given, as keyword arguments"""
+        parameters = inspect.signature(Options).parameters
+        return {name: parameters[name].default for name in _settings}
+
+    @staticmethod
+    def settings_from_config(config: dict) -> dict:
+        """
+        Keyword arguments of `Options` for the solver settings in `config`, a dict
+        as returned by `config`. Keys that are not settings are ignored.
+        """
+        enums = {
+            "linear_solver": Options.LinearSolver,
+            "preconditioner": Options.Preconditioner,
+            "jacobian": Options.Jacobian,
+        }
+        settings = {}
+        for name in _settings:
+            if name in config:
+                value = config[name]
+                settings[name] = enums[name][value] if name in enums else value
+        return settings
@@ -0,0 +1,68 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+from .diffeq import Diffeq
+
+
+class InstancePool:
+    """
+    Pool of independent instances of one model.
+
+    The model is compiled once (see `Diffeq.load_module`) and the pool holds on to
+    the module. Each instance handed out by the pool has its own wasmtime Store, so
+    different threads can solve with different instances at the same time. An
+    instance must only be used by one thread at a time: `checkout` one, use it, then
+    `checkin` it again (or use the `instance` context manager). At most `max_size`
+    instances are created, `checkout` blocks until one is returned once they are
+    all in use.
+    """
+
+    def __init__(self, model: str, max_size: int | None = None):
+        self.model = model
+        self.max_size = max_size
+        self._idle: list[Diffeq] = []
+        self._created = 0
+        self._available = threading.Condition()
+        # compile up front so that checkouts only pay for instantiation
+        self.module = Diffeq.load_module(model)
+
+    def checkout(self, timeout: float | None = None) -> Diffeq:
+        with self._available:
+            while not self._idle:
+                if self.max_size is None or self._created < self.max_size:
+                    self._created += 1
+                    break
+                if not self._available.wait(timeout):
+                    raise TimeoutError("no instance available")
+            else:
+                return self._idle.pop()
+        try:
+            return Diffeq(self.model, module=self.module)
+        except BaseException:
+            with self._available:
+                self._created -= 1
+                self._available.notify()
+            raise
+
+    def checkin(self, diffeq: Diffeq):
+        with self._available:
+            self._idle.append(diffeq)
+            self._available.notify()
+
+    @contextmanager
+    def instance(self, timeout: float | None = None) -> Iterator[Diffeq]:
+        diffeq = self.checkout(timeout)
+        try:
+            yield diffeq
+        finally:
+            self.checkin(diffeq)
+
+    def size(self) -> int:
+        """Number of instances created by the pool"""
+        return self._created
+
+    def idle(self) -> int:
+        """Number of instances waiting to be checked out"""
+        with self._available:
+            return len(self._idle)
@@ -1,34 +1,45 @@
+import hashlib
+import inspect
 from itertools import chain
 import numbers
+import types
 from types import NoneType
-from typing import Set
+import re
+from typing import IO, Iterable, Iterator
 from scipy.sparse import csr_matrix
 import pybamm
 import numpy as np
 
+from . import instrument
+from .cache import ConversionCache
+
 
 def _equation_to_diffeq(
     equation: pybamm.Symbol,
     y_slice_to_label: dict[tuple[int], str],
     symbol_to_tensor_name: dict[pybamm.Symbol, str],
     transpose: bool = False,
+    scalars: set[pybamm.Symbol] | frozenset = frozenset(),
 ) -> str:
+    if is_operator(equation) and equation in symbol_to_tensor_name:
+        # hoisted into its own tensor, scalars are unindexed
+        if equation in scalars:
+            return symbol_to_tensor_name[equation]
+        index = "j" if transpose else "i"
+        return f"{symbol_to_tensor_name[equation]}_{index}"
     if isinstance(equation, pybamm.BinaryOperator):
         left = _equation_to_diffeq(
-            equation.left, y_slice_to_label, symbol_to_tensor_name
+            equation.left, y_slice_to_label, symbol_to_tensor_name, scalars=scalars
         )
 
         if equation.name == "@" and isinstance(equation.left, pybamm.Matrix):
-            if equation in symbol_to_tensor_name:
-                return f"{symbol_to_tensor_name[equation]}_i"
-            else:
-                right = _equation_to_diffeq(
-                    equation.right, y_slice_to_label, symbol_to_tensor_name, True
-                )
-                return f"({left} * {right})"
+            right = _equation_to_diffeq(
+                equation.right, y_slice_to_label, symbol_to_tensor_name, True, scalars
+            )
+            return f"({left} * {right})"
 
         right = _equation_to_diffeq(
-            equation.right, y_slice_to_label, symbol_to_tensor_name
+            equation.right, y_slice_to_label, symbol_to_tensor_name, scalars=scalars
         )
 
         if equation.name == "maximum":
@@ -41,12 +52,14 @@ def _equation_to_diffeq(
             return f"pow({left}, {right})"
         return f"({left} {equation.name} {right})"
     elif isinstance(equation, pybamm.UnaryOperator):
-        return f"{equation.name}({_equation_to_diffeq(equation.child, y_slice_to_label, symbol_to_tensor_name)})"  # noqa: E501
+        return f"{equation.name}({_equation_to_diffeq(equation.child, y_slice_to_label, symbol_to_tensor_name, scalars=scalars)})"  # noqa: E501
     elif isinstance(equation, pybamm.Function):
         name = equation.function.__name__
         args = ", ".join(
             [
-                _equation_to_diffeq(x, y_slice_to_label, symbol_to_tensor_name)
+                _equation_to_diffeq(
+                    x, y_slice_to_label, symbol_to_tensor_name, scalars=scalars
+                )
                 for x in equation.children
             ]
         )
@@ -90,10 +103,238 @@ def equation_to_diffeq(
     start_index: int,
     slice_to_label: dict[tuple[int], str],
     symbol_to_tensor_name: dict[pybamm.Symbol, str],
+    scalars: set[pybamm.Symbol] | frozenset = frozenset(),
 ) -> str:
+    """
+    DiffSL expression of `equation`. Operations in `symbol_to_tensor_name` have
+    been hoisted into tensors, those also in `scalars` into unindexed ones.
+    """
     if not isinstance(equation, pybamm.Symbol):
         raise TypeError("equation must be a pybamm.Symbol")
-    return _equation_to_diffeq(equation, slice_to_label, symbol_to_tensor_name)
+    return _equation_to_diffeq(
+        equation, slice_to_label, symbol_to_tensor_name, scalars=scalars
+    )
+
+
+def is_operator(symbol: pybamm.Symbol) -> bool:
+    """True if `symbol` is emitted as an operation on its children"""
+    return isinstance(
+        symbol, (pybamm.BinaryOperator, pybamm.UnaryOperator, pybamm.Function)
+    )
+
+
+def is_unindexed(
+    symbol: pybamm.Symbol,
+    symbol_to_tensor_name: dict[pybamm.Symbol, str],
+    scalars: set[pybamm.Symbol] | frozenset = frozenset(),
+) -> bool:
+    """
+    True if the DiffSL expression of `symbol` has no free index, i.e. it only refers
+    to numbers, inputs, time and the hoisted tensors in `scalars`, so that it can
+    define an unindexed tensor
+    """
+    stack = list(symbol.children)
+    while stack:
+        node = stack.pop()
+        if is_operator(node) and node in symbol_to_tensor_name:
+            if node not in scalars:
+                return False
+        elif isinstance(node, (pybamm.StateVector, pybamm.Matrix)):
+            return False
+        elif isinstance(node, pybamm.Vector):
+            entries = node.entries
+            if not (isinstance(entries, np.ndarray) and np.all(entries == entries[0, 0])):
+                return False
+        else:
+            stack.extend(node.children)
+    return True
+
+
+class ShapeCache:
+    """
+    Memoized `evaluate_for_shape` of symbols, keyed by symbol id.
+
+    pybamm caches the result on each symbol instance, but evaluates recursively and
+    again for every copy of a subtree. Here the DAG below a symbol is evaluated
+    bottom-up, without recursion, each distinct subtree once, and copies of an
+    already evaluated subtree reuse the result.
+    """
+
+    def __init__(self):
+        self._values = {}
+
+    def evaluate(self, symbol: pybamm.Symbol):
+        """`symbol.evaluate_for_shape()`"""
+        if symbol.id in self._values:
+            return self._values[symbol.id]
+        stack = [(symbol, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if node.id in self._values:
+                # seed pybamm's own cache, so evaluating the parent stops here
+                node._saved_evaluate_for_shape = self._values[node.id]
+            elif children_done:
+                self._values[node.id] = node.evaluate_for_shape()
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children)
+        return self._values[symbol.id]
+
+    def shape(self, symbol: pybamm.Symbol) -> tuple[int, ...]:
+        """Shape of `symbol`, (1, 1) for scalars"""
+        value = self.evaluate(symbol)
+        if isinstance(value, numbers.Number):
+            return (1, 1)
+        return value.shape
+
+
+def is_column(symbol: pybamm.Symbol, shapes: ShapeCache | None = None) -> bool:
+    """True if `symbol` evaluates to a scalar or a column vector"""
+    try:
+        shape = (shapes or ShapeCache()).shape(symbol)
+    except Exception:
+        return False
+    return len(shape) == 2 and shape[1] == 1
+
+
+def is_state_matrix_vector_product(
+    symbol: pybamm.Symbol, shapes: ShapeCache | None = None
+) -> bool:
+    """True for a matrix-vector product whose vector depends on the state"""
+    if not (
+        isinstance(symbol, pybamm.BinaryOperator)
+        and symbol.name == "@"
+        and isinstance(symbol.left, pybamm.Matrix)
+    ):
+        return False
+    n = symbol.left.entries.shape[1]
+
+    # check that rhs is a vector with n rows
+    eval_for_shape = (shapes or ShapeCache()).evaluate(symbol.right)
+    if isinstance(eval_for_shape, numbers.Number):
+        return False
+    if eval_for_shape.shape[0] != n:
+        return False
+
+    # check that rhs has a state vector or dot state vector somewhere
+    return any(
+        isinstance(s, (pybamm.StateVector, pybamm.StateVectorDot))
+        for s in symbol.right.pre_order()
+    )
+
+
+class ReferenceCounts:
+    """
+    Number of references to each symbol (by id) in the expression DAG formed by a
+    list of equations, which can be extended with more equations later. Equal
+    subtrees are only counted once per distinct parent.
+    """
+
+    def __init__(
+        self,
+        equations: Iterable[pybamm.Symbol] = (),
+        shapes: ShapeCache | None = None,
+    ):
+        self.shapes = shapes or ShapeCache()
+        self.counts: dict[int, int] = {}
+        self.symbols: dict[int, pybamm.Symbol] = {}
+        # matrix-vector products of the state below the top level of an equation
+        self.nested_products: set[int] = set()
+        self.add(equations)
+
+    def add(self, equations: Iterable[pybamm.Symbol]):
+        stack = [(eqn, True) for eqn in equations]
+        while stack:
+            symbol, top = stack.pop()
+            n = self.counts.get(symbol.id, 0)
+            self.counts[symbol.id] = n + 1
+            if (
+                not top
+                and symbol.id not in self.nested_products
+                and is_state_matrix_vector_product(symbol, self.shapes)
+            ):
+                self.nested_products.add(symbol.id)
+            if n == 0:
+                self.symbols[symbol.id] = symbol
+                stack.extend((child, False) for child in symbol.children)
+
+    def copy(self) -> "ReferenceCounts":
+        other = ReferenceCounts(shapes=self.shapes)
+        other.counts = dict(self.counts)
+        other.symbols = dict(self.symbols)
+        other.nested_products = set(self.nested_products)
+        return other
+
+
+def count_references(equations: Iterable[pybamm.Symbol]) -> dict[int, int]:
+    """
+    Count the references to each symbol (by id) in the expression DAG formed by
+    `equations`, so equal subtrees are only counted once per distinct parent.
+    """
+    return ReferenceCounts(equations).counts
+
+
+def subexpressions_to_hoist(
+    equations: list[pybamm.Symbol], references: ReferenceCounts | None = None
+) -> list[pybamm.Symbol]:
+    """
+    Return the subexpressions of `equations` that get their own tensor, in an order
+    where each one only depends on those before it. `references` are the reference
+    counts of `equations`, if already known.
+
+    These are the matrix-vector products of the state below the top level of an
+    equation, plus every other operation referenced more than once in the DAG
+    (common subexpression elimination).
+    """
+    if references is None:
+        references = ReferenceCounts(equations)
+    hoist = set(references.nested_products)
+    for symbol_id, count in references.counts.items():
+        if count > 1 and symbol_id not in hoist:
+            symbol = references.symbols[symbol_id]
+            if is_operator(symbol) and is_column(symbol, references.shapes):
+                hoist.add(symbol_id)
+
+    # post-order, so dependencies come first
+    order = []
+    seen = set()
+
+    def visit(symbol):
+        if symbol.id in seen:
+            return
+        seen.add(symbol.id)
+        for child in symbol.children:
+            visit(child)
+        if symbol.id in hoist:
+            order.append(symbol)
+
+    for eqn in equations:
+        visit(eqn)
+    return order
+
+
+def count_operations(
+    equations: Iterable[pybamm.Symbol], hoisted: Iterable[pybamm.Symbol] = ()
+) -> int:
+    """
+    Number of operations needed to evaluate `equations` and each of the `hoisted`
+    subexpressions once, where references to a hoisted subexpression are free.
+    """
+    hoisted = list(hoisted)
+    hoisted_ids = {symbol.id for symbol in hoisted}
+    memo = {}
+
+    def own(symbol):
+        return (1 if is_operator(symbol) else 0) + sum(ops(c) for c in symbol.children)
+
+    def ops(symbol):
+        if symbol.id in hoisted_ids:
+            return 0
+        if symbol.id not in memo:
+            memo[symbol.id] = own(symbol)
+        return memo[symbol.id]
+
+    return sum(ops(eqn) for eqn in equations) + sum(own(h) for h in hoisted)
 
 
 def to_variable_name(name: str) -> str:
@@ -132,15 +373,295 @@ def vector_to_diffeq_constant(
         raise TypeError("vector must be a pybamm.Vector and ndarray")
 
 
+def _runs(
+    keys: list[np.ndarray], position: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    First and last indices of the runs of (already sorted) entries with equal
+    `keys` and a `position` that increases by one from each entry to the next.
+    """
+    breaks = np.ones(position.size, dtype=bool)
+    breaks[1:] = position[1:] != position[:-1] + 1
+    for key in keys:
+        breaks[1:] |= key[1:] != key[:-1]
+    starts = np.flatnonzero(breaks)
+    ends = np.append(starts[1:], position.size)[: starts.size] - 1
+    return starts, ends
+
+
+def _diagonal_runs(rows, cols, data) -> tuple[np.ndarray, ...]:
+    """
+    Cover the nonzeros with runs of equal values along diagonals, returned as the
+    arrays (first row, last row, first col, last col, value)
+    """
+    offset = cols - rows
+    order = np.lexsort((rows, data, offset))
+    rows, cols, data, offset = rows[order], cols[order], data[order], offset[order]
+    starts, ends = _runs([offset, data], rows)
+    return rows[starts], rows[ends], cols[starts], cols[ends], data[starts]
+
+
+def _block_runs(rows, cols, data) -> tuple[np.ndarray, ...]:
+    """
+    Cover the nonzeros with rectangular blocks of equal values, returned as the
+    arrays (first row, last row, first col, last col, value)
+    """
+    # runs along each row
+    order = np.lexsort((cols, data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    starts, ends = _runs([rows, data], cols)
+    rows, data = rows[starts], data[starts]
+    c0, c1 = cols[starts], cols[ends]
+
+    # merge identical runs on consecutive rows
+    order = np.lexsort((rows, data, c1, c0))
+    rows, data, c0, c1 = rows[order], data[order], c0[order], c1[order]
+    starts, ends = _runs([c0, c1, data], rows)
+    return rows[starts], rows[ends], c0[starts], c1[starts], data[starts]
+
+
+def constant_key(symbol: pybamm.Array) -> bytes:
+    """
+    Hash of the kind, shape, sparsity pattern and values of a constant vector or
+    matrix, equal for constants that emit the same tensor
+    """
+    entries = csr_matrix(symbol.entries, dtype=np.float64)
+    entries.sum_duplicates()
+    entries.eliminate_zeros()
+    if isinstance(symbol, pybamm.Vector):
+        # vectors are emitted dense, zeros included
+        entries = entries.toarray()
+        parts = [entries]
+    else:
+        parts = [
+            entries.indptr.astype(np.int64),
+            entries.indices.astype(np.int64),
+            entries.data,
+        ]
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{type(symbol).__name__}{entries.shape}".encode())
+    for part in parts:
+        h.update(np.ascontiguousarray(part).tobytes())
+    return h.digest()
+
+
+def vector_to_diffeq_tensor(tensor_name: str, entries) -> str:
+    """
+    Define the constant vector tensor `tensor_name` with `entries` (a dense or
+    sparse column), combining runs of equal values into ranges
+    """
+    if isinstance(entries, csr_matrix):
+        vector = entries.toarray().flatten()
+    elif isinstance(entries, np.ndarray):
+        vector = entries.flatten()
+    else:
+        raise TypeError(f"{type(entries)} not implemented")
+
+    starts, ends = _runs([vector], np.arange(vector.size))
+    ends += 1
+    lines = [f"{tensor_name}_i " + "{"]
+    lines += [
+        f"  ({start}:{end}): {value},"
+        for start, end, value in zip(
+            starts.tolist(), ends.tolist(), vector[starts].astype(float).tolist()
+        )
+    ]
+    return "\n".join(lines) + "\n}"
+
+
+def matrix_to_diffeq_tensor(tensor_name: str, entries) -> str:
+    """
+    Define the constant matrix tensor `tensor_name` with `entries` (dense or
+    sparse). Zeros are dropped and the nonzeros are covered with whichever of
+    diagonal ranges or rectangular blocks of equal values gives fewer entries.
+    """
+    if isinstance(entries, csr_matrix):
+        coo = entries.tocoo()
+        coo.sum_duplicates()
+        nonzero = coo.data != 0
+        rows, cols, data = coo.row[nonzero], coo.col[nonzero], coo.data[nonzero]
+    elif isinstance(entries, np.ndarray):
+        rows, cols = np.nonzero(entries)
+        data = entries[rows, cols]
+    else:
+        raise TypeError(f"{type(entries)} not implemented")
+    nrows, ncols = entries.shape
+    rows, cols = rows.astype(np.int64), cols.astype(np.int64)
+    data = data.astype(float)
+
+    diagonal = _diagonal_runs(rows, cols, data)
+    blocks = _block_runs(rows, cols, data)
+    runs = blocks if blocks[0].size < diagonal[0].size else diagonal
+    order = np.lexsort((runs[2], runs[0]))
+    lines = [f"{tensor_name}_ij " + "{"]
+    for r0, r1, c0, c1, v in zip(*(a[order].tolist() for a in runs)):
+        if r0 == r1 and c0 == c1:
+            lines.append(f"  ({r0},{c0}): {v},")
+        elif runs is diagonal:
+            lines.append(f"  ({r0}..{r1},{c0}..{c1}): {v},")
+        else:
+            lines.append(f"  ({r0}:{r1 + 1},{c0}:{c1 + 1}): {v},")
+    if rows.size == 0 or rows.max() < nrows - 1 or cols.max() < ncols - 1:
+        # add a zero entry to the end to make sure the matrix is the right size
+        lines += [f"  ({nrows-1},{ncols-1}): 0.0,"]
+    return "\n".join(lines) + "\n}"
+
+
+def _update_fingerprint(h, value):
+    """Feed a canonical encoding of `value` into the hash `h`"""
+    if value is None or isinstance(value, (bool, str)):
+        h.update(f"{type(value).__name__}:{value};".encode())
+    elif isinstance(value, numbers.Integral):
+        h.update(f"int:{int(value)};".encode())
+    elif isinstance(value, numbers.Real):
+        h.update(f"float:{float(value)!r};".encode())
+    elif isinstance(value, np.ndarray):
+        h.update(f"array:{value.dtype.str}{value.shape};".encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        h.update(f"{type(value).__name__}:{len(value)};".encode())
+        for item in value:
+            _update_fingerprint(h, item)
+    elif isinstance(value, (set, frozenset)):
+        _update_fingerprint(h, sorted(value, key=repr))
+    elif isinstance(value, type):
+        h.update(f"type:{value.__module__}.{value.__qualname__};".encode())
+    elif isinstance(value, types.FunctionType):
+        try:
+            source = inspect.getsource(value)
+        except (OSError, TypeError):
+            source = repr(value.__code__.co_code) + repr(value.__code__.co_consts)
+        h.update(f"function:{value.__module__}.{value.__qualname__};".encode())
+        h.update(source.encode())
+    elif isinstance(value, pybamm.Symbol):
+        h.update(f"symbol:{type(value).__name__}:{value};".encode())
+    elif hasattr(value, "items"):
+        items = sorted(value.items(), key=lambda item: str(item[0]))
+        h.update(f"mapping:{type(value).__name__}:{len(items)};".encode())
+        for key, item in items:
+            _update_fingerprint(h, str(key))
+            _update_fingerprint(h, item)
+    elif hasattr(value, "__dict__"):
+        # e.g. spatial methods, whose state is their public attributes
+        _update_fingerprint(h, type(value))
+        _update_fingerprint(
+            h, {k: v for k, v in vars(value).items() if not k.startswith("_")}
+        )
+    else:
+        h.update(f"{type(value).__name__}:{value!r};".encode())
+
+
+with open(__file__, "rb") as f:
+    # generated text changes whenever the converter does
+    _converter_source_hash = hashlib.sha256(f.read()).hexdigest()
+
+
 def state_name_to_dstate_name(state_name: str) -> str:
     """Convert a state name to a dstate name"""
     return f"d{state_name}dt"
 
 
+class InputParameters:
+    """
+    Names and default values of the inputs of a converted model, in the order of
+    its `in` tensor, for building input vectors where only some values differ from
+    the defaults. Inputs can be named either by their pybamm parameter name or by
+    their DiffSL name.
+    """
+
+    def __init__(self, names: list[str], defaults: list[float | None]):
+        if len(names) != len(defaults):
+            raise ValueError("names and defaults must have the same length")
+        self.names = list(names)
+        self.defaults = list(defaults)
+        self._index = {}
+        for i, name in enumerate(self.names):
+            self._index[name] = i
+            self._index[to_variable_name(name)] = i
+
+    @property
+    def diffsl_names(self) -> list[str]:
+        return [to_variable_name(name) for name in self.names]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def index(self, name: str) -> int:
+        if name not in self._index:
+            raise ValueError(f"{name} is not an input")
+        return self._index[name]
+
+    def values(self, overrides: dict[str, float] | None = None) -> np.ndarray:
+        """Input values, the defaults apart from those given in `overrides`"""
+        values = np.array(
+            [np.nan if d is None else d for d in self.defaults], dtype=np.float64
+        )
+        given = np.zeros(len(self.names), dtype=bool)
+        for name, value in (overrides or {}).items():
+            i = self.index(name)
+            values[i] = value
+            given[i] = True
+        for i, default in enumerate(self.defaults):
+            if default is None and not given[i]:
+                raise ValueError(f"input {self.names[i]} has no default value")
+        return values
+
+    def batch(self, overrides: list[dict[str, float]]) -> np.ndarray:
+        """Input values for each set of `overrides`, shape (n_sets, n_inputs)"""
+        values = np.empty((len(overrides), len(self.names)), dtype=np.float64)
+        for i, o in enumerate(overrides):
+            values[i] = self.values(o)
+        return values
+
+
 class PybammModel:
+    """
+    Converts a pybamm model to DiffSL. If `cache` is given, generated text is stored
+    there and reused by later conversions with the same fingerprint. `var_pts`
+    overrides the number of mesh points of some of the model's spatial variables.
+
+    `cse_stats` holds the statistics of the last conversion, restored from the
+    cache on a hit. It is empty until the text has been generated (or read) in
+    full, and after a hit on an entry stored without statistics.
+    """
 
-    def __init__(self, model: pybamm.BaseModel):
+    def __init__(
+        self,
+        model: pybamm.BaseModel,
+        cache: ConversionCache | None = None,
+        var_pts: dict[str, int] | None = None,
+    ):
         self.model = model
+        self.cache = cache
+        self.var_pts = {**model.default_var_pts, **(var_pts or {})}
+        self.cse_stats = {}
+
+    def fingerprint(self, inputs: list[str], outputs: list[str]) -> str:
+        """
+        Hash of everything the DiffSL text of `to_diffeq(inputs, outputs)` depends
+        on: the model class and options, the default parameter values (functions by
+        name and source), the mesh settings, the inputs and outputs, and the
+        versions of pybamm and of this converter.
+
+        Changes made to the equations of the model instance itself are not seen.
+        """
+        model = self.model
+        h = hashlib.sha256()
+        for value in [
+            pybamm.__version__,
+            _converter_source_hash,
+            type(model),
+            model.name,
+            getattr(model, "options", None),
+            model.default_parameter_values,
+            self.var_pts,
+            model.default_submesh_types,
+            model.default_spatial_methods,
+            list(inputs),
+            list(outputs),
+        ]:
+            _update_fingerprint(h, value)
+        return h.hexdigest()
 
     def get_all_parameters(self) -> list[str]:
         params = self.model.parameters
@@ -169,24 +690,40 @@ class PybammModel:
         ]
         params = [p for p in params if p.name not in filter_out]
 
-        return [p.name for p in params]
+        # model.parameters is unordered and has repeats
+        return sorted({p.name for p in params})
+
+    def get_all_inputs(self) -> list[str]:
+        """
+        The parameters of `get_all_parameters` with a numeric default value, sorted.
+        Making all of them inputs gives a model that only needs compiling once for
+        any combination of their values.
+        """
+        params = self.model.default_parameter_values
+        return [
+            p for p in self.get_all_parameters() if isinstance(params[p], numbers.Number)
+        ]
+
+    def input_parameters(self, inputs: list[str]) -> InputParameters:
+        """
+        Names and default values of `inputs`. Parameters without a numeric default
+        (e.g. functions) have no default, so a value must always be given for them.
+        """
+        params = self.model.default_parameter_values
+        defaults = []
+        for inpt in inputs:
+            if inpt not in params.keys():
+                raise ValueError(f"input {inpt} not in params")
+            value = params[inpt]
+            defaults.append(float(value) if isinstance(value, numbers.Number) else None)
+        return InputParameters(inputs, defaults)
 
     def get_all_outputs(self) -> list[str]:
         all_vars = self.model.variables
 
-        vars = []
-        for var in all_vars.keys():
-            reject = False
-            for s in all_vars[var].pre_order():
-                # only scalar outputs
-                eval_for_shape = all_vars[var].evaluate_for_shape()
-                if not isinstance(eval_for_shape, numbers.Number):
-                    shape = eval_for_shape.shape
-                    if shape != (1, 1):
-                        reject = True
-
-            if not reject:
-                vars.append(var)
+        # only scalar outputs
+        shapes = ShapeCache()
+        vars = [var for var, eqn in all_vars.items() if shapes.shape(eqn) == (1, 1)]
 
         # filter out some variables that we don't support yet
         filter_out = [
@@ -212,307 +749,338 @@ class PybammModel:
 
     def to_diffeq(self, inputs: list[str], outputs: list[str]) -> str:
         """Convert a pybamm model to a diffeq model"""
-        model = self.model.new_copy()
-        params = self.model.default_parameter_values
+        with instrument.span("convert", model=self.model.name):
+            return "".join(self.to_diffeq_stream(inputs, outputs))
+
+    def to_diffeq_stream(self, inputs: list[str], outputs: list[str]) -> Iterator[str]:
+        """
+        As `to_diffeq`, but yields the text in chunks (one tensor at a time) as it
+        is generated, so that a large model is never held in memory whole.
+        """
+        self.cse_stats = {}
+        if self.cache is None:
+            yield from self._to_diffeq_stream(inputs, outputs)
+            return
+        key = self.fingerprint(inputs, outputs)
+        cached = self.cache.get_stream(key)
+        if cached is None:
+            yield from self.cache.put_stream(
+                key, self._to_diffeq_stream(inputs, outputs), lambda: self.cse_stats
+            )
+            return
+        stats = self.cache.get_stats(key)
+        yield from cached
+        self.cse_stats = stats or {}
+
+    def write_diffeq(self, fileobj: IO[str], inputs: list[str], outputs: list[str]):
+        """Write the DiffSL text of `to_diffeq(inputs, outputs)` to `fileobj`"""
+        for chunk in self.to_diffeq_stream(inputs, outputs):
+            fileobj.write(chunk)
+
+    def _to_diffeq_stream(self, inputs: list[str], outputs: list[str]) -> Iterator[str]:
+        converter = Converter(self, inputs)
+        yield from converter.emit_stream(outputs)
+        self.cse_stats = converter.cse_stats
+
+
+class Converter:
+    """
+    A pybamm model built once with a fixed list of `inputs`, which is then emitted
+    as DiffSL for any number of output lists.
+
+    Building (parameter processing and discretisation), the constant tensors and
+    the state, dudt and M tensors are done once, in the constructor. `emit` only
+    adds the tensors of the outputs, hoists subexpressions and writes the text.
+    """
+
+    def __init__(self, pybamm_model: PybammModel, inputs: list[str]):
+        self.pybamm_model = pybamm_model
+        self.inputs = list(inputs)
+        model = pybamm_model.model.new_copy()
+        params = pybamm_model.model.default_parameter_values
         params_names = params.keys()
-        for inpt in inputs:
+        for inpt in self.inputs:
             if not isinstance(inpt, str):
                 raise TypeError("inputs must be a list of str")
             if inpt not in params_names:
                 raise ValueError(f"input {inpt} not in params")
             params[inpt] = "[input]"
-        if len(outputs) == 0:
-            raise ValueError("outputs must be a non-empty list of str")
-        for out in outputs:
-            if not isinstance(out, str):
-                raise TypeError("outputs must be a list of str")
-            if out not in model.variables:
-                raise ValueError(f"output {out} not in model")
-            eqn = model.variables[out]
-            eval_for_shape = eqn.evaluate_for_shape()
-            if isinstance(eval_for_shape, numbers.Number):
-                shape = (1, 1)
-            else:
-                shape = eval_for_shape.shape
-            if shape != (1, 1):
-                raise ValueError(
-                    f"output {out} has shape {shape}, but only scalar outputs are supported"
-                )
-        sim = pybamm.Simulation(model, parameter_values=params)
-        sim.build()
+        self.input_parameters = pybamm_model.input_parameters(self.inputs)
+        sim = pybamm.Simulation(
+            model, parameter_values=params, var_pts=pybamm_model.var_pts
+        )
+        with instrument.span("convert.build", model=model.name):
+            sim.build()
         model = sim._built_model
-        has_events = len(model.events) > 0
-        is_ode = model.len_alg == 0
+        self.model = model
+        self.is_ode = model.len_alg == 0
 
         states = list(chain(model.rhs.keys(), model.algebraic.keys()))
-        state_labels = [to_variable_name(v.name) for v in states]
+        self.state_labels = [to_variable_name(v.name) for v in states]
         initial_conditions = [model.initial_conditions[v] for v in states]
-        diffeq = {}
+        self.events = [
+            event.expression
+            for event in model.events
+            if event.event_type == pybamm.EventType.TERMINATION
+        ]
+        # the equations of F, in order
+        self.f_equations = list(chain(model.rhs.values(), model.algebraic.values()))
+
+        # constants are named by first appearance in F, stop and the initial
+        # conditions, then in the outputs, so the text is the same in every process.
+        # Only the symbols are kept, their text is written when it is emitted.
+        self._constant_keys = {}
+        self.symbol_to_tensor_name = {}
+        self.constants = {}
+        with instrument.span("convert.extract"):
+            self._add_constants(
+                chain(self.f_equations, self.events, initial_conditions),
+                self.symbol_to_tensor_name,
+                self.constants,
+            )
+            self.shapes = ShapeCache()
+            self._references = ReferenceCounts(
+                chain(self.f_equations, self.events), self.shapes
+            )
+        self.cse_stats = {}
         new_line = "\n"
 
         # inputs
-        for inpt in inputs:
+        self.input_tensors = []
+        for inpt in self.inputs:
             lines = [f"{to_variable_name(inpt)} " + "{"]
             lines += ["  1"]
-            diffeq[to_variable_name(inpt)] = new_line.join(lines) + new_line + "}"
-
-        # extract constant vectors and matrices from model as tensors
-        symbol_to_tensor_name = {}
-        tensor_index = 0
-        vectors: Set[pybamm.Vector] = set()
-        matrices: Set[pybamm.Matrix] = set()
-        for eqn in chain(
-            model.rhs.values(),
-            model.algebraic.values(),
-            [model.variables[output] for output in outputs],
-        ):
-            for symbol in eqn.pre_order():
-                if isinstance(symbol, pybamm.Vector):
-                    vectors.add(symbol)
-                    tensor_index += 1
-                elif isinstance(symbol, pybamm.Matrix):
-                    matrices.add(symbol)
-                    tensor_index += 1
-
-        tensor_index = 0
-        for symbol in vectors:
-            if isinstance(symbol.entries, csr_matrix):
-                vector = symbol.entries.toarray().flatten()
-            elif isinstance(symbol.entries, np.ndarray):
-                vector = symbol.entries.flatten()
-            else:
-                raise TypeError(f"{type(symbol.entries)} not implemented")
-
-            tensor_name = f"constant{tensor_index}"
-            tensor_index += 1
-
-            symbol_to_tensor_name[symbol] = tensor_name
-
-            # any segments of the vector that are the same value are combined
-            curr_value = vector[0]
-            start_index = 0
-            lines = [f"{tensor_name}_i " + "{"]
-            for i in range(1, vector.size):
-                if vector[i] != curr_value:
-                    end_index = i
-                    lines += [f"  ({start_index}:{end_index}): {curr_value},"]
-                    start_index = i
-                    curr_value = vector[i]
-            end_index = vector.size
-            lines += [f"  ({start_index}:{end_index}): {curr_value},"]
-
-            diffeq[tensor_name] = new_line.join(lines) + new_line + "}"
-
-        for symbol in matrices:
-            tensor_name = f"constant{tensor_index}"
-            tensor_index += 1
-            symbol_to_tensor_name[symbol] = tensor_name
-            if isinstance(symbol.entries, csr_matrix):
-                nrows, ncols = symbol.entries.shape
-                lines = [f"{tensor_name}_ij " + "{"]
-                is_diagonal = True
-                is_constant = True
-                max_colj = 0
-                max_rowi = 0
-                for rowi in range(nrows):
-                    for j in range(
-                        symbol.entries.indptr[rowi], symbol.entries.indptr[rowi + 1]
-                    ):
-                        colj = symbol.entries.indices[j]
-                        value = symbol.entries.data[j]
-                        max_colj = max(max_colj, colj)
-                        max_rowi = max(max_rowi, rowi)
-                        if value != symbol.entries.data[0]:
-                            is_constant = False
-                        if rowi != colj:
-                            is_diagonal = False
-                if is_diagonal and is_constant:
-                    lines += [
-                        f"  (0..{nrows-1},0..{ncols-1}): {symbol.entries.data[0]},"
-                    ]
-                else:
-                    for rowi in range(nrows):
-                        for j in range(
-                            symbol.entries.indptr[rowi], symbol.entries.indptr[rowi + 1]
-                        ):
-                            colj = symbol.entries.indices[j]
-                            lines += [f"  ({rowi},{colj}): {symbol.entries.data[j]},"]
-                    if max_colj < ncols - 1 or max_rowi < nrows - 1:
-                        # add a zero entry to the end to make sure the matrix is the right size
-                        lines += [f"  ({nrows-1},{ncols-1}): 0.0,"]
-            elif isinstance(symbol.entries, np.ndarray):
-                lines = [f"{tensor_name}_ij " + "{"]
-                nrows, ncols = symbol.entries.shape
-                for rowi in range(nrows):
-                    for colj in range(ncols):
-                        lines += [f"  ({rowi},{colj}): {symbol.entries[rowi, colj]},"]
-            else:
-                raise TypeError(f"{type(symbol.entries)} not implemented")
-
-            diffeq[tensor_name] = new_line.join(lines) + new_line + "}"
+            self.input_tensors.append(new_line.join(lines) + new_line + "}")
 
         # state vector u
         lines = ["u_i {"]
         start_index = 0
-        y_slice_to_label = {}
+        self.y_slice_to_label = {}
         for i, ic in enumerate(initial_conditions):
-            label = state_labels[i]
+            label = self.state_labels[i]
             indices = (
                 f"({start_index}:{start_index + ic.size}): " if ic.size > 1 else ""
             )
-            eqn = equation_to_diffeq(ic, start_index, {}, symbol_to_tensor_name)
+            eqn = equation_to_diffeq(ic, start_index, {}, self.symbol_to_tensor_name)
             lines += [f"  {indices}{label} = {eqn},"]
-            y_slice_to_label[(start_index, start_index + ic.size)] = label
+            self.y_slice_to_label[(start_index, start_index + ic.size)] = label
             start_index += ic.size
-        diffeq["u"] = new_line.join(lines) + new_line + "}"
+        self.state_tensors = [new_line.join(lines) + new_line + "}"]
 
-        # diff of state vector u
-        if not is_ode:
+        if not self.is_ode:
+            # diff of state vector u
             lines = ["dudt_i {"]
-            yp_slice_to_label = {}
             start_index = 0
             for i, ic in enumerate(initial_conditions):
-                label = state_name_to_dstate_name(state_labels[i])
+                label = state_name_to_dstate_name(self.state_labels[i])
                 indices = (
                     f"({start_index}:{start_index + ic.size}): " if ic.size > 1 else ""
                 )
                 zero = pybamm.Scalar(0)
-                eqn = equation_to_diffeq(zero, start_index, {}, symbol_to_tensor_name)
+                eqn = equation_to_diffeq(
+                    zero, start_index, {}, self.symbol_to_tensor_name
+                )
                 lines += [f"  {indices}{label} = {eqn},"]
-                yp_slice_to_label[(start_index, start_index + ic.size)] = label
                 start_index += ic.size
-            diffeq["dudt"] = new_line.join(lines) + new_line + "}"
-
-        # extract matrix * vector products from model as pre-calculated tensors
-        matrix_vector_products = []
-        for eqn in chain(
-            model.rhs.values(),
-            model.algebraic.values(),
-            [model.variables[output] for output in outputs],
-        ):
-            # skip top-level matrix-vector products
-            for child in eqn.children:
-                for symbol in child.pre_order():
-                    if (
-                        isinstance(symbol, pybamm.BinaryOperator)
-                        and symbol.name == "@"
-                        and isinstance(symbol.left, pybamm.Matrix)
-                    ):
-                        n = symbol.left.entries.shape[1]
-
-                        # check that rhs is a vector with n rows
-                        eval_for_shape = symbol.right.evaluate_for_shape()
-                        if isinstance(eval_for_shape, numbers.Number):
-                            continue
-                        shape = eval_for_shape.shape
-                        if shape[0] != n:
-                            continue
-
-                        # check that rhs has a state vector or dot state vector somewhere
-                        has_state_vector = False
-                        for s in symbol.right.pre_order():
-                            if isinstance(
-                                s, (pybamm.StateVector, pybamm.StateVectorDot)
-                            ):
-                                has_state_vector = True
-                                break
-                        if not has_state_vector:
-                            continue
-                        matrix_vector_products += [symbol]
-
-        tensor_index = 0
-        for symbol in matrix_vector_products:
-            if symbol in symbol_to_tensor_name:
-                continue
-            tensor_name = f"varying{tensor_index}"
-            tensor_index += 1
-            lines = [f"{tensor_name}_i " + "{"]
-            eqn = equation_to_diffeq(
-                symbol, start_index, y_slice_to_label, symbol_to_tensor_name
-            )
-            lines += [f"  {eqn},"]
-            symbol_to_tensor_name[symbol] = tensor_name
-            diffeq[tensor_name] = new_line.join(lines) + new_line + "}"
+            self.state_tensors.append(new_line.join(lines) + new_line + "}")
 
-        # M
-        if not is_ode:
+            # M
             lines = ["M_i {"]
             start_index = 0
             for i, rhs in enumerate(model.rhs.values()):
-                eqn = f"{state_name_to_dstate_name(state_labels[i])}_i"
+                eqn = f"{state_name_to_dstate_name(self.state_labels[i])}_i"
                 lines += [f"  {eqn},"]
                 start_index += rhs.size
-            for i, algebraic in enumerate(model.algebraic.keys()):
-                eqn = "0.0"
-                lines += [f"  {eqn},"]
+            for algebraic in model.algebraic.values():
+                indices = (
+                    f"({start_index}:{start_index + algebraic.size}): "
+                    if algebraic.size > 1
+                    else ""
+                )
+                lines += [f"  {indices}0.0,"]
                 start_index += algebraic.size
-            diffeq["F"] = new_line.join(lines) + new_line + "}"
+            self.mass_tensor = new_line.join(lines) + new_line + "}"
 
-        # F
-        lines = ["F_i {"]
-        for i, rhs in enumerate(model.rhs.values()):
-            eqn = equation_to_diffeq(
-                rhs, start_index, y_slice_to_label, symbol_to_tensor_name
-            )
-            lines += [f"  {eqn},"]
-            start_index += rhs.size
-        for i, algebraic in enumerate(model.algebraic.keys()):
-            eqn = equation_to_diffeq(
-                algebraic, start_index, y_slice_to_label, symbol_to_tensor_name
-            )
-            lines += [f"  {eqn},"]
-            start_index += algebraic.size
-        diffeq["F"] = new_line.join(lines) + new_line + "}"
+    def _add_constants(
+        self,
+        equations: Iterable[pybamm.Symbol],
+        symbol_to_tensor_name: dict[pybamm.Symbol, str],
+        constants: dict[str, pybamm.Symbol],
+    ):
+        """
+        Extract the constant vectors and matrices of `equations` that are not in
+        `symbol_to_tensor_name` yet as tensors, named by first appearance in a
+        pre-order traversal, and add them to `constants`
+        """
+        key_to_tensor_name = {}
+        for symbol, name in symbol_to_tensor_name.items():
+            key_to_tensor_name[self._constant_keys[symbol.id]] = name
+
+        visited = set()
+        stack = list(reversed(list(equations)))
+        while stack:
+            symbol = stack.pop()
+            if symbol.id in visited:
+                continue
+            visited.add(symbol.id)
+            stack.extend(reversed(symbol.children))
+            if not isinstance(symbol, (pybamm.Vector, pybamm.Matrix)):
+                continue
+            if symbol in symbol_to_tensor_name:
+                continue
+
+            # numerically identical constants share one tensor
+            key = self._constant_keys.get(symbol.id)
+            if key is None:
+                key = constant_key(symbol)
+                self._constant_keys[symbol.id] = key
+            if key not in key_to_tensor_name:
+                tensor_name = f"constant{len(constants)}"
+                key_to_tensor_name[key] = tensor_name
+                constants[tensor_name] = symbol
+            symbol_to_tensor_name[symbol] = key_to_tensor_name[key]
+
+    def check_outputs(self, outputs: list[str]):
+        if len(outputs) == 0:
+            raise ValueError("outputs must be a non-empty list of str")
+        for out in outputs:
+            if not isinstance(out, str):
+                raise TypeError("outputs must be a list of str")
+            if out not in self.model.variables:
+                raise ValueError(f"output {out} not in model")
+            shape = self.shapes.shape(self.model.variables[out])
+            if shape != (1, 1):
+                raise ValueError(
+                    f"output {out} has shape {shape}, but only scalar outputs are supported"
+                )
+
+    def emit(self, outputs: list[str]) -> str:
+        """Return the DiffSL text of the model with `outputs`"""
+        with instrument.span("convert.emit"):
+            return "".join(self.emit_stream(outputs))
+
+    def emit_stream(self, outputs: list[str]) -> Iterator[str]:
+        """
+        Yield the DiffSL text of the model with `outputs` one tensor at a time, as
+        it is written, so that at most one tensor is held in memory as text.
+        `cse_stats` is set once the last tensor has been yielded.
+        """
+        chars = 0
+        chunks = 0
+        for chunk in self._emit_stream(outputs):
+            chars += len(chunk)
+            chunks += 1
+            yield chunk
+        instrument.count("convert.chars", chars)
+        # every chunk but the list of inputs is a tensor
+        instrument.count("convert.tensors", chunks - 1)
+        instrument.count("convert.hoisted", self.cse_stats.get("hoisted", 0))
 
-        # out
-        lines = ["out_i {"]
-        for output in outputs:
+    def _emit_stream(self, outputs: list[str]) -> Iterator[str]:
+        self.check_outputs(outputs)
+        output_equations = [self.model.variables[output] for output in outputs]
+        symbol_to_tensor_name = dict(self.symbol_to_tensor_name)
+        constants = dict(self.constants)
+        self._add_constants(output_equations, symbol_to_tensor_name, constants)
+
+        # the equations of F, out and stop, in order
+        equations = self.f_equations + output_equations + self.events
+        references = self._references.copy()
+        references.add(output_equations)
+
+        new_line = "\n"
+        y_slice_to_label = self.y_slice_to_label
+        stats = _TextStats()
+
+        yield f"in = [{', '.join([to_variable_name(p) for p in self.inputs])}]"
+        for tensor in self.input_tensors:
+            yield new_line + tensor
+        for tensor_name, symbol in constants.items():
+            if isinstance(symbol, pybamm.Matrix):
+                yield new_line + matrix_to_diffeq_tensor(tensor_name, symbol.entries)
+            else:
+                yield new_line + vector_to_diffeq_tensor(tensor_name, symbol.entries)
+        for tensor in self.state_tensors:
+            yield new_line + tensor
+
+        # extract matrix * vector products of the state and repeated subexpressions
+        # from model as pre-calculated tensors. Scalars are unindexed, like the
+        # inputs, unless their expression has a free index (e.g. a row vector times
+        # the state), which an unindexed tensor could not bind
+        hoisted = subexpressions_to_hoist(equations, references)
+        scalars = set()
+        for tensor_index, symbol in enumerate(hoisted):
+            tensor_name = f"varying{tensor_index}"
             eqn = equation_to_diffeq(
-                model.variables[output],
-                start_index,
-                y_slice_to_label,
-                symbol_to_tensor_name,
+                symbol, 0, y_slice_to_label, symbol_to_tensor_name, scalars
             )
-            lines += [f"  {eqn},"]
-        diffeq["out"] = new_line.join(lines) + new_line + "}"
-        
-        # events
-        if has_events:
-            lines = ["stop_i {"]
-            for event in model.events:
-                print(event)
-                if event.event_type == pybamm.EventType.TERMINATION:
-                    eqn = equation_to_diffeq(
-                        event.expression,
-                        start_index,
-                        y_slice_to_label,
-                        symbol_to_tensor_name,
-                    )
-                    lines += [f"  {eqn},"]
-            diffeq["stop"] = new_line.join(lines) + new_line + "}"
-
-        all_lines = [f"in = [{', '.join([to_variable_name(p) for p in inputs])}]"]
-
-        if is_ode:
-            state_tensors = ["u"]
-            f_and_g_and_out = ["F", "out"]
-        else:
-            state_tensors = ["u", "dudt"]
-            f_and_g_and_out = ["M", "F", "out"]
-        if has_events:
-            f_and_g_and_out += ["stop"]
+            if self.shapes.shape(symbol) == (1, 1) and is_unindexed(
+                symbol, symbol_to_tensor_name, scalars
+            ):
+                lines = [f"{tensor_name} " + "{", f"  {eqn}"]
+                scalars.add(symbol)
+            else:
+                lines = [f"{tensor_name}_i " + "{", f"  {eqn},"]
+            symbol_to_tensor_name[symbol] = tensor_name
+            stats.add_hoisted(tensor_name, eqn)
+            yield new_line + new_line.join(lines) + new_line + "}"
 
-        # inputs and constants
-        for inpt in inputs:
-            all_lines += [diffeq[to_variable_name(inpt)]]
-        for key in diffeq.keys():
-            if key.startswith("constant"):
-                all_lines += [diffeq[key]]
-        for key in state_tensors:
-            all_lines += [diffeq[key]]
-        for key in diffeq.keys():
-            if key.startswith("varying"):
-                all_lines += [diffeq[key]]
-        for key in f_and_g_and_out:
-            all_lines += [diffeq[key]]
-        return "\n".join(all_lines)
+        # M, F, out and stop
+        if not self.is_ode:
+            yield new_line + self.mass_tensor
+        blocks = [("F", self.f_equations), ("out", output_equations)]
+        if self.events:
+            blocks.append(("stop", self.events))
+        for name, block_equations in blocks:
+            lines = [f"{name}_i " + "{"]
+            for equation in block_equations:
+                eqn = equation_to_diffeq(
+                    equation, 0, y_slice_to_label, symbol_to_tensor_name, scalars
+                )
+                lines += [f"  {eqn},"]
+                stats.add(eqn)
+            yield new_line + new_line.join(lines) + new_line + "}"
+
+        self.cse_stats = stats.cse_stats(equations, hoisted)
+
+
+class _TextStats:
+    """
+    Lengths of the emitted equations and hoisted tensors, compared with writing
+    every equation out in full.
+    """
+
+    reference = re.compile(r"\b(varying\d+)(?:_[ij])?\b")
+
+    def __init__(self):
+        # length of each hoisted tensor with the tensors it uses substituted back in
+        self.inlined_length = {}
+        self.chars = 0
+        self.chars_inlined = 0
+
+    def inlined(self, text: str) -> int:
+        return len(text) + sum(
+            self.inlined_length[m.group(1)] - len(m.group(0))
+            for m in self.reference.finditer(text)
+        )
+
+    def add_hoisted(self, name: str, text: str):
+        self.inlined_length[name] = self.inlined(text)
+        self.chars += len(text)
+
+    def add(self, text: str):
+        self.chars += len(text)
+        self.chars_inlined += self.inlined(text)
+
+    def cse_stats(
+        self, equations: list[pybamm.Symbol], hoisted: list[pybamm.Symbol]
+    ) -> dict:
+        ops = count_operations(equations, hoisted)
+        ops_inlined = count_operations(equations)
+        return {
+            "hoisted": len(hoisted),
+            "operations": ops,
+            "operations_saved": ops_inlined - ops,
+            "chars": self.chars,
+            "chars_saved": self.chars_inlined - self.chars,
+        }
@@ -0,0 +1,94 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+from .client import CompileClient, client_from_string
+
+
+class _CompileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/compile":
+            self._reply(404, b"not found", "text/plain")
+            return
+        try:
+            data = json.loads(self._read_body())
+            wasm = self.server.client.compile(data["text"], data.get("name", "unknown"))
+        except (ValueError, KeyError, RuntimeError) as e:
+            self._reply(400, str(e).encode(), "text/plain")
+            return
+        except Exception as e:
+            self._reply(500, str(e).encode(), "text/plain")
+            return
+        self._reply(200, wasm, "application/wasm")
+
+    def _read_body(self) -> bytes:
+        """The request body, sent either with a Content-Length or chunked"""
+        if self.headers.get("Transfer-Encoding", "").lower() != "chunked":
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b";")[0], 16)
+            if size == 0:
+                break
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+        # skip trailers, up to the blank line that ends the request
+        while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+            pass
+        return b"".join(chunks)
+
+    def _reply(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CompileServer(ThreadingHTTPServer):
+    """
+    Minimal stand-in for the diffeq backend, answering POST /compile using `client`
+    (typically a LocalCompileClient), so that everything can run without network.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, client: CompileClient, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _CompileHandler)
+        self.client = client
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "CompileServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+@click.command()
+@click.option("--compiler", default="diffsl", help="local compiler command")
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=8080)
+def serve(compiler, host, port):
+    server = CompileServer(client_from_string(compiler), host, port)
+    click.echo(f"serving on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    serve()
@@ -1,37 +1,144 @@
+import json
+import re
+
+import numpy as np
+from numpy import ndarray
+
+from . import instrument
+from .arena import WasmObject
+from .cache import SolutionCache
 from .options import Options
+from .vector import Vector
+
+
+_stat_line = re.compile(
+    r"^\s*(?:Number of )?(.+?)\s*[=:]\s*(-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)\s*$",
+    re.MULTILINE,
+)
+
+
+def parse_stats(text: str) -> dict[str, int | float]:
+    """
+    Integrator statistics from the output of a solve with `print_stats` set, e.g.
+    "Number of steps = 42" gives {"steps": 42}. Values of statistics printed more
+    than once (by several solves) are summed, other lines are ignored.
+    """
+    stats = {}
+    for m in _stat_line.finditer(text):
+        key = re.sub(r"\W+", "_", m.group(1).lower()).strip("_")
+        value = m.group(2)
+        value = int(value) if value.lstrip("-").isdigit() else float(value)
+        stats[key] = stats.get(key, 0) + value
+    return stats
+
+
+class Solver(WasmObject):
+    """
+    Solver of a Diffeq's model with the given `options`. If the options have
+    `print_stats` set, `last_stats` holds the integrator statistics of the last
+    solve (summed over all solves of the last `solve_batch`), see `parse_stats`.
+    The printed statistics are still forwarded to `sys.stdout`.
+
+    If a `cache` is given, `solve` and `solve_batch` look up the outputs of each
+    solve there before solving, and store them after. Outputs found in the cache
+    are copied into the outputs without solving, and no statistics are recorded
+    for them. Models without a `key` (see `Diffeq`) are not cached.
 
+    If `input_parameters` (the `InputParameters` of the converted model) are given,
+    the inputs of `solve` can be a dict of the values that differ from the
+    defaults, and those of `solve_batch` a list of such dicts.
+    """
 
-class Solver:
-    def __init__(self, diffeq, options: Options):
+    kind = "Solver"
+
+    def __init__(
+        self,
+        diffeq,
+        options: Options,
+        cache: SolutionCache | None = None,
+        input_parameters=None,
+    ):
         self.options = options
-        self.pointer = diffeq.Solver_create()
+        self.input_parameters = input_parameters
+        self.last_stats: dict[str, int | float] = {}
+        self.cache = cache
+        self._cache_options = None
+        if cache is not None and diffeq.key is not None:
+            settings = {**options.config(), "fixed_times": options.get_fixed_times()}
+            self._cache_options = json.dumps(settings, sort_keys=True)
+        self._track(diffeq, diffeq.Solver_create(), diffeq.Solver_destroy)
         diffeq.Solver_init(self.pointer, options.pointer)
         self.number_of_inputs = diffeq.Solver_number_of_inputs(self.pointer)
         self.number_of_outputs = diffeq.Solver_number_of_outputs(self.pointer)
         self.number_of_states = diffeq.Solver_number_of_states(self.pointer)
         self.dummy_vector = diffeq.vector([])
-        self.diffeq = diffeq
+        self.dependents = (self.dummy_vector,)
+        if input_parameters is not None and len(input_parameters) != self.number_of_inputs:
+            self.destroy()
+            raise ValueError(
+                f"Expected {self.number_of_inputs} input parameters, "
+                f"got {len(input_parameters)}"
+            )
 
     def destroy(self):
-        self.diffeq.Solver_destroy(self.pointer)
+        super().destroy()
+        self.dummy_vector.destroy()
+
+    def _cache_key(self, times: ndarray, inputs: ndarray) -> str | None:
+        if self._cache_options is None:
+            return None
+        return self.cache.key(self.diffeq.key, self._cache_options, times, inputs)
+
+    def _take_stats(self) -> dict[str, int | float]:
+        text = self.diffeq._stdout.take()
+        if not text or not self.options.get_print_stats():
+            return {}
+        return parse_stats(text)
+
+    def _parameters(self):
+        if self.input_parameters is None:
+            raise ValueError("inputs can only be given by name with input_parameters")
+        return self.input_parameters
 
     def solve(self, times, inputs, outputs):
+        """
+        Solve at `times` with `inputs` (a Vector, or a dict of the inputs that differ
+        from their defaults, see `input_parameters`), into the Vector `outputs`
+        """
+        if isinstance(inputs, dict):
+            with self.diffeq.vector(self._parameters().values(inputs)) as inputs_vector:
+                return self.solve(times, inputs_vector, outputs)
         if len(inputs) != self.number_of_inputs:
             raise ValueError(
                 f"Expected {self.number_of_inputs} inputs, got {len(inputs)}"
             )
         if len(times) < 2:
             raise ValueError("Times vector must have at least two elements")
-        result = self.diffeq.Solver_solve(
-            self.pointer,
-            times.pointer,
-            inputs.pointer,
-            self.dummy_vector.pointer,
-            outputs.pointer,
-            self.dummy_vector.pointer,
-        )
+        key = self._cache_key(times.getFloat64Array(), inputs.getFloat64Array())
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                outputs.resize(len(cached))
+                outputs.getFloat64Array()[:] = cached
+                self.last_stats = {}
+                return
+        self.diffeq._stdout.take()
+        with instrument.span("solve"):
+            result = self.diffeq.Solver_solve(
+                self.pointer,
+                times.pointer,
+                inputs.pointer,
+                self.dummy_vector.pointer,
+                outputs.pointer,
+                self.dummy_vector.pointer,
+            )
+        instrument.count("solve.count")
+        self.last_stats = self._take_stats()
+        outputs.version += 1
         if result != 0:
             raise ValueError("Solve failed")
+        if key is not None:
+            self.cache.put(key, outputs.getFloat64Array())
 
     def solve_with_sensitivities(self, times, inputs, dinputs, outputs, doutputs):
         if len(inputs) != self.number_of_inputs:
@@ -42,13 +149,183 @@ class Solver:
             raise ValueError(f"Expected {len(inputs)} dinputs, got {len(dinputs)}")
         if len(times) < 2:
             raise ValueError("Times vector must have at least two elements")
-        result = self.diffeq.Solver_solve(
-            self.pointer,
-            times.pointer,
-            inputs.pointer,
-            dinputs.pointer,
-            outputs.pointer,
-            doutputs.pointer,
-        )
+        self.diffeq._stdout.take()
+        with instrument.span("solve", sensitivities=True):
+            result = self.diffeq.Solver_solve(
+                self.pointer,
+                times.pointer,
+                inputs.pointer,
+                dinputs.pointer,
+                outputs.pointer,
+                doutputs.pointer,
+            )
+        instrument.count("solve.count")
+        self.last_stats = self._take_stats()
+        outputs.version += 1
+        doutputs.version += 1
         if result != 0:
             raise ValueError("Solve failed")
+
+    def solve_batch(
+        self,
+        times: Vector | ndarray,
+        inputs: ndarray | list[dict[str, float]],
+        stop_on_failure: bool = False,
+    ) -> ndarray:
+        """
+        Solve for each row of `inputs` (shape (n_sets, n_inputs), or a list of dicts
+        of the inputs that differ from their defaults, see `input_parameters`) at
+        `times`, which requires the solver options to have fixed_times set. One set of input and
+        output vectors is reused for every row, and the results are returned as an
+        array of shape (n_sets, n_times, n_outputs).
+
+        A failed solve raises a ValueError, unless `stop_on_failure` is True, in
+        which case the sweep stops and the rows from the failed one onwards are NaN.
+        """
+        if isinstance(inputs, list) and all(isinstance(i, dict) for i in inputs):
+            inputs = self._parameters().batch(inputs)
+        inputs = np.ascontiguousarray(inputs, dtype=np.float64)
+        if inputs.ndim != 2 or inputs.shape[1] != self.number_of_inputs:
+            raise ValueError(
+                f"Expected inputs of shape (n_sets, {self.number_of_inputs}), "
+                f"got {inputs.shape}"
+            )
+        with instrument.span("solve_batch", sets=len(inputs)):
+            return self._solve_batch(times, inputs, stop_on_failure)
+
+    def _solve_batch(
+        self, times: Vector | ndarray, inputs: ndarray, stop_on_failure: bool
+    ) -> ndarray:
+        if not self.options.get_fixed_times():
+            raise ValueError("solve_batch requires fixed_times to be set")
+        if len(times) < 2:
+            raise ValueError("Times vector must have at least two elements")
+        times_vector = times if isinstance(times, Vector) else self.diffeq.vector(times)
+        n_times = len(times_vector)
+        n_sets = inputs.shape[0]
+        result = np.full((n_sets, n_times, self.number_of_outputs), np.nan)
+        flat_result = result.reshape(n_sets, -1)
+        input_vector = self.diffeq.vector(np.zeros(self.number_of_inputs))
+        output_vector = self.diffeq.vector(np.zeros(flat_result.shape[1]))
+        input_view = input_vector.view()
+        output_view = output_vector.view()
+        solve = self.diffeq.Solver_solve
+        solved = 0
+        # copied, as solving can move wasm memory
+        times_array = (
+            times_vector.getFloat64Array().copy()
+            if self._cache_options is not None
+            else None
+        )
+        self.diffeq._stdout.take()
+        try:
+            for i in range(n_sets):
+                key = self._cache_key(times_array, inputs[i])
+                if key is not None:
+                    cached = self.cache.get(key)
+                    if cached is not None and cached.size == flat_result.shape[1]:
+                        flat_result[i] = cached
+                        solved += 1
+                        continue
+                input_view.array[:] = inputs[i]
+                status = solve(
+                    self.pointer,
+                    times_vector.pointer,
+                    input_vector.pointer,
+                    self.dummy_vector.pointer,
+                    output_vector.pointer,
+                    self.dummy_vector.pointer,
+                )
+                output_vector.version += 1
+                if status != 0:
+                    if stop_on_failure:
+                        break
+                    raise ValueError(f"Solve failed for input set {i}")
+                output = output_view.array
+                if output.size != flat_result.shape[1]:
+                    raise ValueError(
+                        f"Expected {flat_result.shape[1]} outputs, got {output.size}"
+                    )
+                flat_result[i] = output
+                if key is not None:
+                    self.cache.put(key, output)
+                solved += 1
+        finally:
+            self.last_stats = self._take_stats()
+            if instrument.enabled:
+                instrument.count("solve.count", solved)
+                instrument.count("vector.bytes_in", inputs[:solved].nbytes)
+                instrument.count("vector.bytes_out", flat_result[:solved].nbytes)
+            input_vector.destroy()
+            output_vector.destroy()
+            if times_vector is not times:
+                times_vector.destroy()
+        return result
+
+    def jacobian(
+        self, times: Vector | ndarray, inputs: ndarray, return_outputs: bool = False
+    ) -> ndarray | tuple[ndarray, ndarray]:
+        """
+        Sensitivities of the outputs to the inputs at `times`, as an array of shape
+        (n_times, n_outputs, n_inputs). Requires the solver options to have both
+        fixed_times and fwd_sens set.
+
+        The wasm solver propagates one input direction per solve, so this does one
+        forward sensitivity solve per input, reusing the same wasm vectors for all
+        of them and setting each direction in place. If `return_outputs` is True the
+        outputs, of shape (n_times, n_outputs), are returned as well.
+        """
+        inputs = np.ascontiguousarray(inputs, dtype=np.float64).ravel()
+        if len(inputs) != self.number_of_inputs:
+            raise ValueError(
+                f"Expected {self.number_of_inputs} inputs, got {len(inputs)}"
+            )
+        if not self.options.get_fixed_times() or not self.options.get_fwd_sens():
+            raise ValueError("jacobian requires fixed_times and fwd_sens to be set")
+        if len(times) < 2:
+            raise ValueError("Times vector must have at least two elements")
+        times_vector = times if isinstance(times, Vector) else self.diffeq.vector(times)
+        n_times = len(times_vector)
+        n_outputs = self.number_of_outputs
+        n_inputs = self.number_of_inputs
+        jac = np.empty((n_times, n_outputs, n_inputs))
+        outputs = np.empty((n_times, n_outputs))
+
+        inputs_vector = self.diffeq.vector(inputs)
+        dinputs_vector = self.diffeq.vector(np.zeros(n_inputs))
+        outputs_vector = self.diffeq.vector(np.zeros(n_times * n_outputs))
+        doutputs_vector = self.diffeq.vector(np.zeros(n_times * n_outputs))
+        dinputs_view = dinputs_vector.view()
+        outputs_view = outputs_vector.view()
+        doutputs_view = doutputs_vector.view()
+        try:
+            if n_inputs == 0 and return_outputs:
+                self.solve(times_vector, inputs_vector, outputs_vector)
+                outputs[:] = outputs_view.array.reshape(n_times, n_outputs)
+            for j in range(n_inputs):
+                dinputs = dinputs_view.array
+                dinputs[:] = 0.0
+                dinputs[j] = 1.0
+                self.solve_with_sensitivities(
+                    times_vector,
+                    inputs_vector,
+                    dinputs_vector,
+                    outputs_vector,
+                    doutputs_vector,
+                )
+                if j == 0:
+                    outputs[:] = outputs_view.array.reshape(n_times, n_outputs)
+                jac[:, :, j] = doutputs_view.array.reshape(n_times, n_outputs)
+        finally:
+            for vector in (
+                inputs_vector,
+                dinputs_vector,
+                outputs_vector,
+                doutputs_vector,
+            ):
+                vector.destroy()
+            if times_vector is not times:
+                times_vector.destroy()
+        if return_outputs:
+            return outputs, jac
+        return jac
@@ -0,0 +1,168 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable
+
+import numpy as np
+from numpy import ndarray
+from wasmtime import Module
+
+from .diffeq import Diffeq
+
+# per-process state of a sweep worker
+_worker = {}
+
+
+def _init_worker(model: str, serialized: bytes, options: dict):
+    module = Module.deserialize(Diffeq.engine, serialized)
+    diffeq = Diffeq(model, module)
+    _worker["diffeq"] = diffeq
+    _worker["options"] = diffeq.options(**options)
+    _worker["solver"] = diffeq.solver(_worker["options"])
+
+
+def _solve_chunk(
+    times: ndarray,
+    inputs_name: str,
+    inputs_shape: tuple[int, int],
+    results_name: str,
+    results_shape: tuple[int, int, int],
+    start: int,
+    stop: int,
+    stop_on_failure: bool,
+) -> int:
+    inputs_shm = SharedMemory(inputs_name)
+    results_shm = SharedMemory(results_name)
+    inputs = results = None
+    try:
+        inputs = np.ndarray(inputs_shape, dtype=np.float64, buffer=inputs_shm.buf)
+        results = np.ndarray(results_shape, dtype=np.float64, buffer=results_shm.buf)
+        results[start:stop] = _worker["solver"].solve_batch(
+            times, inputs[start:stop], stop_on_failure
+        )
+    finally:
+        # the arrays must be released before the shared memory can be closed
+        inputs = results = None
+        inputs_shm.close()
+        results_shm.close()
+    return stop - start
+
+
+class ParallelSweep:
+    """
+    Runs parameter sweeps of one model on a pool of worker processes.
+
+    The model is compiled once in this process and the serialized module is sent to
+    each worker when it starts. The workers stay alive between calls to `run`, which
+    splits the input sets into chunks solved with `Solver.solve_batch`. Inputs and
+    results are passed through shared memory, only chunk bounds are pickled.
+
+    `options` are keyword arguments for `Diffeq.options`, fixed_times is always set.
+    """
+
+    def __init__(
+        self, model: str, options: dict | None = None, max_workers: int | None = None
+    ):
+        self.model = model
+        self.options = dict(options or {}, fixed_times=True)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.number_of_outputs = None
+        self._executor = None
+
+    def _start(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            module = Diffeq.load_module(self.model)
+            diffeq = Diffeq(self.model, module)
+            options = diffeq.options()
+            solver = diffeq.solver(options)
+            self.number_of_outputs = solver.number_of_outputs
+            solver.destroy()
+            options.destroy()
+            serialized = bytes(module.serialize())
+            self._executor = ProcessPoolExecutor(
+                self.max_workers,
+                initializer=_init_worker,
+                initargs=(self.model, serialized, self.options),
+            )
+        return self._executor
+
+    def run(
+        self,
+        times: ndarray,
+        inputs: ndarray,
+        chunk_size: int | None = None,
+        progress: Callable[[int, int], None] | None = None,
+        stop_on_failure: bool = False,
+    ) -> ndarray:
+        """
+        Solve for each row of `inputs` at `times`, returning an array of shape
+        (n_sets, n_times, n_outputs) as `Solver.solve_batch` does.
+
+        `chunk_size` is the number of input sets sent to a worker at a time, by
+        default the sets are split into about four chunks per worker. `progress`
+        is called with (sets_done, n_sets) as each chunk completes. With
+        `stop_on_failure` a failed solve leaves the rest of its chunk as NaN
+        instead of raising.
+        """
+        times = np.ascontiguousarray(times, dtype=np.float64)
+        inputs = np.ascontiguousarray(inputs, dtype=np.float64)
+        if inputs.ndim != 2:
+            raise ValueError(
+                f"Expected inputs of shape (n_sets, n_inputs), got {inputs.shape}"
+            )
+        n_sets = inputs.shape[0]
+        executor = self._start()
+        results_shape = (n_sets, len(times), self.number_of_outputs)
+        if chunk_size is None:
+            chunk_size = max(1, math.ceil(n_sets / (4 * self.max_workers)))
+
+        inputs_shm = SharedMemory(create=True, size=max(inputs.nbytes, 1))
+        results_shm = SharedMemory(
+            create=True, size=max(math.prod(results_shape) * 8, 1)
+        )
+        try:
+            np.ndarray(inputs.shape, dtype=np.float64, buffer=inputs_shm.buf)[:] = inputs
+            futures = [
+                executor.submit(
+                    _solve_chunk,
+                    times,
+                    inputs_shm.name,
+                    inputs.shape,
+                    results_shm.name,
+                    results_shape,
+                    start,
+                    min(start + chunk_size, n_sets),
+                    stop_on_failure,
+                )
+                for start in range(0, n_sets, chunk_size)
+            ]
+            done = 0
+            try:
+                for future in as_completed(futures):
+                    done += future.result()
+                    if progress is not None:
+                        progress(done, n_sets)
+            finally:
+                for future in futures:
+                    future.cancel()
+            results = np.ndarray(
+                results_shape, dtype=np.float64, buffer=results_shm.buf
+            ).copy()
+        finally:
+            inputs_shm.close()
+            inputs_shm.unlink()
+            results_shm.close()
+            results_shm.unlink()
+        return results
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> "ParallelSweep":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,145 @@
+import time
+from itertools import product
+from typing import Iterable
+
+import numpy as np
+from numpy import ndarray
+
+from .options import Options
+
+_iterative_solvers = {
+    Options.LinearSolver.LINEAR_SOLVER_SPBCGS,
+    Options.LinearSolver.LINEAR_SOLVER_SPFGMR,
+    Options.LinearSolver.LINEAR_SOLVER_SPGMR,
+    Options.LinearSolver.LINEAR_SOLVER_SPTFQMR,
+}
+
+
+def candidate_configs(
+    atols: Iterable[float] = (1e-6,),
+    rtols: Iterable[float] = (1e-6,),
+    linsol_max_iterations: Iterable[int] = (100,),
+) -> list[dict]:
+    """
+    Solver settings to try, as keyword arguments of `Diffeq.options`: every usable
+    combination of linear solver, preconditioner and Jacobian, for each of the given
+    tolerances. The dense solver takes a dense (or finite difference) Jacobian and
+    KLU a sparse one, neither is preconditioned. The iterative solvers take any
+    Jacobian and preconditioner, and each of `linsol_max_iterations`.
+    """
+    configs = []
+    tolerances = list(product(atols, rtols))
+    for linear_solver, preconditioner, jacobian in product(
+        Options.LinearSolver, Options.Preconditioner, Options.Jacobian
+    ):
+        iterative = linear_solver in _iterative_solvers
+        if not iterative and preconditioner != Options.Preconditioner.PRECON_NONE:
+            continue
+        if linear_solver == Options.LinearSolver.LINEAR_SOLVER_DENSE and jacobian not in (
+            Options.Jacobian.DENSE_JACOBIAN,
+            Options.Jacobian.NO_JACOBIAN,
+        ):
+            continue
+        if (
+            linear_solver == Options.LinearSolver.LINEAR_SOLVER_KLU
+            and jacobian != Options.Jacobian.SPARSE_JACOBIAN
+        ):
+            continue
+        for atol, rtol in tolerances:
+            for max_iterations in linsol_max_iterations if iterative else [100]:
+                configs.append(
+                    {
+                        "atol": atol,
+                        "rtol": rtol,
+                        "linear_solver": linear_solver,
+                        "preconditioner": preconditioner,
+                        "jacobian": jacobian,
+                        "linsol_max_iterations": max_iterations,
+                    }
+                )
+    return configs
+
+
+def _solve(diffeq, settings: dict, times: ndarray, inputs: ndarray, repeats: int):
+    """Shortest time of `repeats` solves with `settings`, and the outputs"""
+    with diffeq.arena():
+        o = diffeq.options(fixed_times=True, **settings)
+        s = diffeq.solver(o)
+        times_vector = diffeq.vector(times)
+        inputs_vector = diffeq.vector(inputs)
+        outputs = diffeq.vector([])
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            s.solve(times_vector, inputs_vector, outputs)
+            best = min(best, time.perf_counter() - start)
+        return best, outputs.getFloat64Array().copy()
+
+
+def autotune(
+    diffeq,
+    times: ndarray,
+    inputs: ndarray | None = None,
+    configs: list[dict] | None = None,
+    reference: ndarray | None = None,
+    check_rtol: float = 1e-3,
+    check_atol: float = 1e-6,
+    repeats: int = 3,
+    save: bool = True,
+) -> dict:
+    """
+    Find the fastest solver settings for the model of `diffeq`, by solving it at
+    `times` (with `inputs`, ones by default) with each of `configs` (by default
+    `candidate_configs()`) and timing the best of `repeats` solves.
+
+    Settings that fail, or whose outputs are not within `check_rtol`/`check_atol` of
+    `reference` (by default the outputs of a solve with the `Options` defaults and
+    100 times tighter tolerances), are discarded. Unless `save` is False the winner
+    is stored in `Diffeq.tuning` under the model's key, so that the `options()` of
+    `diffeq`, and of every Diffeq of the same model created later, default to it.
+
+    Returns a dict with "options", the winning config, and "trials", one dict per
+    config with its "options", "time" (None if it failed) and "error" (why it was
+    discarded, or None). Raises a RuntimeError if every config is discarded.
+    """
+    times = np.ascontiguousarray(times, dtype=np.float64)
+    if configs is None:
+        configs = candidate_configs()
+    if inputs is None:
+        with diffeq.arena():
+            inputs = np.ones(diffeq.solver(diffeq.options()).number_of_inputs)
+    if reference is None:
+        tightest = {
+            "atol": min(c.get("atol", 1e-6) for c in configs) / 100,
+            "rtol": min(c.get("rtol", 1e-6) for c in configs) / 100,
+        }
+        settings = {**Options.default_settings(), **tightest}
+        reference = _solve(diffeq, settings, times, inputs, 1)[1]
+
+    trials = []
+    for config in configs:
+        trial = {"options": config, "time": None, "error": None}
+        trials.append(trial)
+        try:
+            elapsed, outputs = _solve(diffeq, config, times, inputs, repeats)
+        except Exception as e:
+            trial["error"] = f"{type(e).__name__}: {e}"
+            continue
+        if outputs.shape != reference.shape or not np.allclose(
+            outputs, reference, rtol=check_rtol, atol=check_atol
+        ):
+            trial["error"] = "outputs differ from the reference"
+            continue
+        trial["time"] = elapsed
+
+    passed = [trial for trial in trials if trial["error"] is None]
+    if not passed:
+        raise RuntimeError("no solver configuration passed the accuracy check")
+    best = min(passed, key=lambda trial: trial["time"])["options"]
+    if save and diffeq.tuning is not None and diffeq.key is not None:
+        with diffeq.arena():
+            config = diffeq.options(**best).config()
+        config["time"] = min(trial["time"] for trial in passed)
+        diffeq.tuning.put(diffeq.key, config)
+        diffeq._tuned = None
+    return {"options": best, "trials": trials}
@@ -1,35 +1,109 @@
-import ctypes
 from numpy import ndarray
 import numpy as np
 
+from . import instrument
+from .arena import WasmObject
+
+
+class Vector(WasmObject):
+    kind = "Vector"
 
-class Vector:
     def __init__(self, diffeq, array: list | ndarray):
-        self.pointer = diffeq.Vector_create_with_capacity(0, len(array))
-        push = diffeq.Vector_push
-        for i in range(len(array)):
-            push(self.pointer, np.float64(array[i]))
-        self.diffeq = diffeq
+        """
+        Create a vector holding the values of `array` (a list, ndarray or any other
+        buffer-protocol object), copied into wasm memory in a single block.
+        """
+        array = np.ascontiguousarray(array, dtype=np.float64).ravel()
+        n = array.size
+        pointer = diffeq._take_vector(n)
+        if pointer is None:
+            pointer = diffeq.Vector_create_with_capacity(0, n)
+            if n > 0:
+                diffeq.Vector_resize(pointer, n)
+        self._track(diffeq, pointer, diffeq._free_vector)
+        self.version = 0
+        if n > 0:
+            data = diffeq.Vector_get_data(self.pointer)
+            diffeq.memory_ndarray()[data:data + array.nbytes] = array.view(np.uint8)
+        if instrument.enabled:
+            instrument.count("vector.created")
+            instrument.count("vector.bytes_in", array.nbytes)
+
+    @classmethod
+    def linspace(cls, diffeq, start: float, stop: float, num: int) -> "Vector":
+        """Create a vector of `num` evenly spaced values over [start, stop]"""
+        vector = cls.__new__(cls)
+        pointer = diffeq.Vector_linspace_create(float(start), float(stop), num)
+        vector._track(diffeq, pointer, diffeq._free_vector)
+        vector.version = 0
+        return vector
 
     def get(self, index):
         return self.diffeq.Vector_get(self.pointer, index)
 
     def getFloat64Array(self) -> ndarray:
-        length = self.diffeq.Vector_get_length(self.pointer)
-        data = self.diffeq.Vector_get_data(self.pointer)
-        ptr_type = ctypes.c_double * length
-        mem_address = ctypes.addressof(self.diffeq.memory_ptr().contents) + data
-        buffer = ptr_type.from_address(mem_address)
-        return np.frombuffer(buffer, dtype=np.float64)
+        """
+        Return an ndarray that shares the vector's data in wasm memory. The array is
+        only valid until the next call that can resize the vector or grow memory,
+        use `view` to hold on to the data safely.
+        """
+        diffeq = self.diffeq
+        length = diffeq.Vector_get_length(self.pointer)
+        data = diffeq.Vector_get_data(self.pointer)
+        return diffeq.memory_ndarray()[data:data + 8 * length].view(np.float64)
 
-    def destroy(self):
-        self.diffeq.Vector_destroy(self.pointer)
+    def view(self) -> "VectorView":
+        return VectorView(self)
 
     def resize(self, len):
         self.diffeq.Vector_resize(self.pointer, len)
+        self.version += 1
 
     def length(self):
         return self.diffeq.Vector_get_length(self.pointer)
 
     def __len__(self):
         return self.length()
+
+
+class VectorView:
+    """
+    Zero-copy view of a Vector's data in wasm linear memory.
+
+    The ndarray returned by `array` is re-mapped whenever linear memory has grown or
+    the vector has been resized (by `Vector.resize` or by a solve writing to it)
+    since it was last mapped, so it never points at stale memory. Using the view of
+    a destroyed vector raises a RuntimeError. Take the array from the view each time
+    it is needed rather than keeping it across calls into wasm.
+    """
+
+    def __init__(self, vector: Vector):
+        self.vector = vector
+        self._key = None
+        self._array = None
+
+    @property
+    def array(self) -> ndarray:
+        vector = self.vector
+        if vector.destroyed:
+            raise RuntimeError("view of a destroyed vector")
+        key = (vector.diffeq.memory_generation(), vector.version)
+        if key != self._key:
+            self._array = vector.getFloat64Array()
+            self._key = key
+        return self._array
+
+    def __array__(self, dtype=None, copy=None) -> ndarray:
+        array = self.array
+        if copy:
+            return np.array(array, dtype=dtype)
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        return self.array[index]
+
+    def __setitem__(self, index, value):
+        self.array[index] = value
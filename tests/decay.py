@@ -0,0 +1,18 @@
+import pybamm
+
+
+class Decay(pybamm.BaseModel):
+    """dx/dt = s - s x, with s = exp(-rate t) a scalar used twice, and so hoisted"""
+
+    def __init__(self):
+        super().__init__("decay")
+        x = pybamm.Variable("x")
+        rate = pybamm.Parameter("Rate [s-1]")
+        source = pybamm.exp(-rate * pybamm.t)
+        self.rhs = {x: source - source * x}
+        self.initial_conditions = {x: pybamm.Scalar(0)}
+        self.variables = {"x": x}
+
+    @property
+    def default_parameter_values(self):
+        return pybamm.ParameterValues({"Rate [s-1]": 0.5})
@@ -0,0 +1,78 @@
+import gc
+import unittest
+
+import numpy as np
+
+from pybamm2diffsl.diffeq import Diffeq
+from tests.logistic import logistic
+
+
+class TestArena(unittest.TestCase):
+    def setUp(self):
+        self.diffeq = Diffeq(logistic)
+
+    def test_arena(self):
+        before = self.diffeq.allocation_stats()
+        with self.diffeq.arena() as arena:
+            o = self.diffeq.options(fixed_times=True)
+            s = self.diffeq.solver(o)
+            times = self.diffeq.vector(np.linspace(0, 1, 10))
+            inputs = self.diffeq.vector([1.0, 1.0])
+            outputs = arena.keep(self.diffeq.vector([]))
+            s.solve(times, inputs, outputs)
+            self.assertEqual(self.diffeq.live["Solver"], before["solvers"] + 1)
+        for obj in (o, s, times, inputs):
+            self.assertTrue(obj.destroyed)
+        self.assertFalse(outputs.destroyed)
+        self.assertEqual(len(outputs), 20)
+        outputs.destroy()
+        after = self.diffeq.allocation_stats()
+        for kind in ("vectors", "options", "solvers"):
+            self.assertEqual(after[kind], before[kind])
+
+    def test_keep_solver(self):
+        with self.diffeq.arena() as arena:
+            o = arena.keep(self.diffeq.options(fixed_times=True))
+            s = arena.keep(self.diffeq.solver(o))
+        # the solver's own vector is kept with it, not reused for a new vector
+        self.assertFalse(s.dummy_vector.destroyed)
+        outputs = self.diffeq.vector([])
+        self.assertNotEqual(outputs.pointer, s.dummy_vector.pointer)
+        times = self.diffeq.vector(np.linspace(0, 1, 10))
+        inputs = self.diffeq.vector([1.0, 1.0])
+        s.solve(times, inputs, outputs)
+        expected = self.diffeq.vector([])
+        with self.diffeq.solver(o) as fresh:
+            fresh.solve(times, inputs, expected)
+        np.testing.assert_array_equal(outputs.getFloat64Array(), expected.getFloat64Array())
+        self.assertEqual(len(s.dummy_vector), 0)
+        s.destroy()
+        self.assertTrue(s.dummy_vector.destroyed)
+        o.destroy()
+
+    def test_context_manager(self):
+        with self.diffeq.vector([1, 2, 3]) as v:
+            self.assertEqual(len(v), 3)
+        self.assertTrue(v.destroyed)
+        v.destroy()
+
+    def test_free_list(self):
+        v = self.diffeq.vector([1, 2, 3])
+        pointer = v.pointer
+        v.destroy()
+        self.assertEqual(self.diffeq.allocation_stats()["free_vectors"], 1)
+        w = self.diffeq.vector([4, 5, 6])
+        self.assertEqual(w.pointer, pointer)
+        np.testing.assert_array_equal(w.getFloat64Array(), [4, 5, 6])
+        w.destroy()
+        self.diffeq.release_free_vectors()
+        self.assertEqual(self.diffeq.allocation_stats()["free_vectors"], 0)
+
+    def test_finalizer(self):
+        live = self.diffeq.live["Vector"]
+        v = self.diffeq.vector([1, 2, 3])
+        self.assertEqual(self.diffeq.live["Vector"], live + 1)
+        self.assertEqual(self.diffeq.allocation_stats()["vector_bytes"], 24)
+        del v
+        gc.collect()
+        self.assertEqual(self.diffeq.live["Vector"], live)
@@ -0,0 +1,216 @@
+import gc
+import io
+import os
+import tempfile
+import unittest
+import warnings
+
+import numpy as np
+from wasmtime import Engine, Module, wat2wasm
+
+from pybamm2diffsl.cache import ConversionCache, ModuleCache, SolutionCache
+
+
+class TestModuleCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ModuleCache(self.tmpdir.name)
+        self.engine = Engine()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def wasm(self, value: int) -> bytes:
+        return wat2wasm(f'(module (func (export "f") (result i32) i32.const {value}))')
+
+    def test_key(self):
+        key = self.cache.key("model", "http://a")
+        self.assertEqual(key, self.cache.key("model", "http://a"))
+        self.assertNotEqual(key, self.cache.key("model", "http://b"))
+        self.assertNotEqual(key, self.cache.key("model2", "http://a"))
+
+    def test_hit_and_miss(self):
+        key = self.cache.key("model", "http://a")
+        self.assertIsNone(self.cache.get(key, self.engine))
+        wasm = self.wasm(1)
+        self.cache.put(key, wasm, Module(self.engine, wasm))
+        module = self.cache.get(key, self.engine)
+        self.assertIsNotNone(module)
+        self.assertEqual(self.cache.get_wasm(key), wasm)
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["entries"], 1)
+
+    def test_rebuild_from_wasm(self):
+        key = self.cache.key("model", "http://a")
+        wasm = self.wasm(1)
+        self.cache.put(key, wasm, Module(self.engine, wasm))
+        with open(os.path.join(self.tmpdir.name, key + ".cwasm"), "wb") as f:
+            f.write(b"not a module")
+        self.assertIsNotNone(self.cache.get(key, self.engine))
+        self.assertEqual(self.cache.wasm_hits, 1)
+        self.assertIsNotNone(self.cache.get(key, self.engine))
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_eviction(self):
+        wasm = self.wasm(1)
+        entry_size = len(wasm) + len(Module(self.engine, wasm).serialize())
+        self.cache.max_size = 2 * entry_size
+        keys = [self.cache.key(f"model{i}", "http://a") for i in range(3)]
+        for i, key in enumerate(keys):
+            wasm = self.wasm(i)
+            self.cache.put(key, wasm, Module(self.engine, wasm))
+            os.utime(os.path.join(self.tmpdir.name, key + ".wasm"), (i, i))
+            os.utime(os.path.join(self.tmpdir.name, key + ".cwasm"), (i, i))
+        self.cache.evict()
+        self.assertIsNone(self.cache.get_wasm(keys[0]))
+        self.assertIsNotNone(self.cache.get_wasm(keys[2]))
+        self.assertGreaterEqual(self.cache.evictions, 1)
+
+
+class TestConversionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_hit_and_miss(self):
+        cache = ConversionCache(self.tmpdir.name, version="1")
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", "in = []")
+        self.assertEqual(cache.get("a"), "in = []")
+        self.assertEqual(cache.stats()["hit_rate"], 0.5)
+
+    def test_version_change(self):
+        ConversionCache(self.tmpdir.name, version="1").put("a", "in = []")
+        self.assertEqual(ConversionCache(self.tmpdir.name, version="1").get("a"), "in = []")
+        self.assertIsNone(ConversionCache(self.tmpdir.name, version="2").get("a"))
+
+    def test_eviction(self):
+        cache = ConversionCache(self.tmpdir.name, max_size=10, version="1")
+        cache.put("a", "0123456789")
+        os.utime(os.path.join(self.tmpdir.name, "a.ds"), (0, 0))
+        cache.put("b", "0123456789")
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("b"))
+
+    def test_stream(self):
+        cache = ConversionCache(self.tmpdir.name, version="1")
+        self.assertIsNone(cache.get_stream("a"))
+        chunks = ["in = []", "\nu_i {", "\n}"]
+        stream = cache.put_stream("a", iter(chunks))
+        next(stream)
+        stream.close()  # an abandoned stream is not stored
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(list(cache.put_stream("a", iter(chunks))), chunks)
+        self.assertEqual("".join(cache.get_stream("a", chunk_size=4)), "".join(chunks))
+        self.assertIsNone(cache.get_stats("a"))
+        list(cache.put_stream("b", iter(chunks), lambda: {"hoisted": 2}))
+        self.assertEqual(cache.get_stats("b"), {"hoisted": 2})
+
+        # an entry evicted after get_stream returns is still read whole
+        stream = cache.get_stream("a", chunk_size=4)
+        cache.clear()
+        self.assertIsNone(cache.get_stream("a"))
+        self.assertEqual("".join(stream), "".join(chunks))
+        list(cache.put_stream("a", iter(chunks)))
+
+        # a stream that is never iterated, or abandoned, leaves no file open
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", ResourceWarning)
+            cache.get_stream("a")
+            stream = cache.get_stream("a", chunk_size=4)
+            next(stream)
+            stream.close()
+            gc.collect()
+        self.assertEqual([w for w in caught if w.category is ResourceWarning], [])
+
+
+class TestSolutionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.times = np.linspace(0, 1, 5)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def key(self, value: float) -> str:
+        return SolutionCache.key("model", "options", self.times, np.array([value]))
+
+    def test_key(self):
+        self.assertEqual(self.key(1.0), self.key(1.0))
+        self.assertNotEqual(self.key(1.0), self.key(2.0))
+        self.assertNotEqual(
+            self.key(1.0), SolutionCache.key("model", "options", self.times[:4], np.ones(1))
+        )
+
+    def test_lru(self):
+        cache = SolutionCache(max_entries=2)
+        for value in (1.0, 2.0):
+            cache.put(self.key(value), np.full(3, value))
+        cache.get(self.key(1.0))
+        cache.put(self.key(3.0), np.full(3, 3.0))
+        self.assertIsNone(cache.get(self.key(2.0)))
+        result = cache.get(self.key(1.0))
+        np.testing.assert_array_equal(result, [1.0, 1.0, 1.0])
+        self.assertFalse(result.flags.writeable)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (2, 1, 2))
+        self.assertAlmostEqual(stats["hit_rate"], 2 / 3)
+
+    def test_max_bytes(self):
+        cache = SolutionCache(max_bytes=100)
+        cache.put(self.key(1.0), np.ones(10))
+        cache.put(self.key(2.0), np.ones(10))
+        self.assertIsNone(cache.get(self.key(1.0)))
+        cache.put(self.key(3.0), np.ones(20))
+        self.assertIsNone(cache.get(self.key(3.0)))
+        self.assertEqual(cache.stats()["size"], 80)
+
+    def spilled_size(self, array: np.ndarray) -> int:
+        f = io.BytesIO()
+        np.save(f, array)
+        return f.tell()
+
+    def test_spill(self):
+        cache = SolutionCache(
+            max_entries=1,
+            spill_path=self.tmpdir.name,
+            max_spill_bytes=2 * self.spilled_size(np.ones(3)),
+        )
+        for value in (1.0, 2.0, 3.0):
+            cache.put(self.key(value), np.full(3, value))
+        result = cache.get(self.key(2.0))
+        self.assertIsInstance(result, np.memmap)
+        np.testing.assert_array_equal(result, [2.0, 2.0, 2.0])
+        self.assertEqual(cache.stats()["spill_hits"], 1)
+        cache.put(self.key(4.0), np.full(3, 4.0))
+        # the least recently used spilled entry went when the spill was full
+        self.assertIsNone(cache.get(self.key(1.0)))
+        self.assertEqual(cache.stats()["spilled_entries"], 2)
+        cache.clear()
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    def test_spill_shared(self):
+        size = self.spilled_size(np.ones(3))
+        first = SolutionCache(max_entries=1, spill_path=self.tmpdir.name)
+        for value in (1.0, 2.0, 3.0):
+            first.put(self.key(value), np.full(3, value))
+        self.assertEqual(first.stats()["spilled_entries"], 2)
+
+        # a later cache on the same directory reuses, and counts, what was spilled
+        second = SolutionCache(max_entries=1, spill_path=self.tmpdir.name)
+        self.assertEqual(second.stats()["spilled_entries"], 2)
+        self.assertEqual(second.stats()["spilled_size"], 2 * size)
+        np.testing.assert_array_equal(second.get(self.key(2.0)), [2.0, 2.0, 2.0])
+        self.assertEqual(second.stats()["spill_hits"], 1)
+
+        # and evicts it to stay within its cap
+        os.utime(first._spill_filename(self.key(1.0)), (0, 0))
+        third = SolutionCache(spill_path=self.tmpdir.name, max_spill_bytes=size)
+        self.assertEqual(third.stats()["spilled_entries"], 1)
+        self.assertEqual(os.listdir(self.tmpdir.name), [self.key(2.0) + ".npy"])
+        third.clear()
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
@@ -0,0 +1,179 @@
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import requests
+from wasmtime import Engine, Module
+
+from pybamm2diffsl.cache import ModuleCache
+from pybamm2diffsl.client import (
+    CompileClient,
+    HttpCompileClient,
+    LocalCompileClient,
+    client_from_string,
+)
+from pybamm2diffsl.diffeq import Diffeq
+from pybamm2diffsl.server import CompileServer
+
+# a stand-in "compiler" that assembles its input as WebAssembly text
+wat_compiler = [
+    sys.executable,
+    "-c",
+    "import sys, wasmtime; "
+    "open(sys.argv[2], 'wb').write(wasmtime.wat2wasm(open(sys.argv[1]).read()))",
+    "{input}",
+    "{output}",
+]
+
+wat = '(module (func (export "f") (result i32) i32.const 1))'
+
+
+class FlakyClient(CompileClient):
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    @property
+    def backend(self) -> str:
+        return "flaky"
+
+    def compile(self, model: str, name: str = "unknown") -> bytes:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise OSError("backend unavailable")
+        return LocalCompileClient(wat_compiler).compile(model, name)
+
+
+class TestClient(unittest.TestCase):
+    def test_local(self):
+        client = LocalCompileClient(wat_compiler)
+        Module(Engine(), client.compile(wat))
+        with self.assertRaises(RuntimeError):
+            client.compile("not wat")
+
+    def test_http(self):
+        server = CompileServer(LocalCompileClient(wat_compiler)).start()
+        client = HttpCompileClient(server.url)
+        try:
+            Module(Engine(), client.compile(wat))
+            Module(Engine(), client.compile(wat))
+            with self.assertRaises(requests.exceptions.HTTPError) as e:
+                client.compile("not wat")
+            self.assertEqual(e.exception.response.status_code, 400)
+        finally:
+            client.close()
+            server.stop()
+
+    def test_http_retry(self):
+        backend = FlakyClient(failures=2)
+        server = CompileServer(backend).start()
+        client = HttpCompileClient(server.url, retries=3, backoff_factor=0.01)
+        try:
+            Module(Engine(), client.compile(wat))
+            self.assertEqual(backend.calls, 3)
+        finally:
+            client.close()
+            server.stop()
+
+    def test_compile_file(self):
+        server = CompileServer(LocalCompileClient(wat_compiler)).start()
+        client = HttpCompileClient(server.url)
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, "model.wat")
+                with open(path, "w") as f:
+                    # a comment that needs escaping in JSON
+                    f.write(wat + ' ;; "quoted" \\ \t \u00e9\n')
+                self.assertEqual(client.compile_file(path), client.compile(wat))
+                self.assertEqual(
+                    LocalCompileClient(wat_compiler).compile_file(path), client.compile(wat)
+                )
+        finally:
+            client.close()
+            server.stop()
+
+    def test_chunked_upload(self):
+        server = CompileServer(LocalCompileClient(wat_compiler)).start()
+        try:
+            body = json.dumps({"text": wat}).encode()
+            chunks = (body[i:i + 7] for i in range(0, len(body), 7))
+            r = requests.post(server.url + "/compile", data=chunks)
+            r.raise_for_status()
+            Module(Engine(), r.content)
+        finally:
+            server.stop()
+
+    def test_from_string(self):
+        client = client_from_string("http://localhost:8080/")
+        self.assertIsInstance(client, HttpCompileClient)
+        self.assertEqual(client.backend, "http://localhost:8080")
+        client = client_from_string("/opt/diffsl/bin/diffsl")
+        self.assertIsInstance(client, LocalCompileClient)
+        self.assertEqual(client.command[0], "/opt/diffsl/bin/diffsl")
+        self.assertIn("{input}", client.command)
+
+
+class TestCompileMany(unittest.TestCase):
+    def setUp(self):
+        self.client, self.cache = Diffeq.client, Diffeq.cache
+        Diffeq.client = LocalCompileClient(wat_compiler)
+        Diffeq.cache = None
+        self.models = [
+            f'(module (func (export "f") (result i32) i32.const {i}))' for i in range(6)
+        ]
+
+    def tearDown(self):
+        Diffeq.client, Diffeq.cache = self.client, self.cache
+
+    def test_compile_many(self):
+        results = dict(Diffeq.compile_many(self.models, max_workers=3))
+        self.assertEqual(sorted(results), list(range(len(self.models))))
+        for i, wasm in results.items():
+            self.assertEqual(wasm, Diffeq.compile(self.models[i]))
+
+    def test_compile_stream(self):
+        model = self.models[0]
+        wasm = Diffeq.compile(model)
+        self.assertEqual(Diffeq.compile(io.StringIO(model)), wasm)
+        self.assertEqual(Diffeq.compile(io.BytesIO(model.encode())), wasm)
+        self.assertEqual(Diffeq.compile(iter([model[:10], model[10:]])), wasm)
+
+        # a streamed model is cached under the same key as its text
+        with tempfile.TemporaryDirectory() as tmpdir:
+            Diffeq.cache = ModuleCache(tmpdir)
+            Diffeq.compile_cached(iter([model[:10], model[10:]]))
+            Diffeq.compile_cached(model)
+            self.assertEqual(Diffeq.cache.misses, 0)
+            self.assertEqual(len(Diffeq.cache._entries()), 1)
+
+    def test_module_lru(self):
+        Diffeq.clear_modules()
+        max_modules, Diffeq.max_modules = Diffeq.max_modules, 2
+        try:
+            first, second = (Diffeq.load_module(m) for m in self.models[:2])
+            self.assertIs(Diffeq.load_module(self.models[0]), first)
+            Diffeq.load_module(self.models[2])
+            # the least recently used module was dropped, and is compiled again
+            self.assertIs(Diffeq.load_module(self.models[0]), first)
+            self.assertIsNot(Diffeq.load_module(self.models[1]), second)
+        finally:
+            Diffeq.max_modules = max_modules
+            Diffeq.clear_modules()
+
+    def test_compile_many_exceptions(self):
+        models = self.models + ["not wat"]
+        with self.assertRaises(RuntimeError):
+            list(Diffeq.compile_many(models))
+        results = dict(Diffeq.compile_many(models, return_exceptions=True))
+        self.assertIsInstance(results[len(models) - 1], RuntimeError)
+
+    def test_compile_many_async(self):
+        async def compile_all():
+            return [r async for r in Diffeq.compile_many_async(self.models, 3)]
+
+        results = dict(asyncio.run(compile_all()))
+        self.assertEqual(sorted(results), list(range(len(self.models))))
@@ -5,7 +5,8 @@ import requests
 
 from pybamm2diffsl.diffeq import Diffeq
 from pybamm2diffsl.options import Options
-from pybamm2diffsl.pybamm_model import PybammModel
+from pybamm2diffsl.pybamm_model import Converter, PybammModel
+from tests.decay import Decay
 
 
 class TestConvert(unittest.TestCase):
@@ -16,9 +17,13 @@ class TestConvert(unittest.TestCase):
         inputs: list,
         outputs: list,
         pybamm_model: PybammModel,
+        diffeq: Diffeq | Exception | None = None,
     ):
         try:
-            diffeq = Diffeq(model)
+            if diffeq is None:
+                diffeq = Diffeq(model)
+            elif isinstance(diffeq, Exception):
+                raise diffeq
         except requests.exceptions.HTTPError as e:
             inpts_str = "_".join(inputs)
             outputs_str = "_".join(outputs)
@@ -82,6 +87,14 @@ class TestConvert(unittest.TestCase):
         s.destroy()
         o.destroy()
 
+    def test_hoisted_scalar(self):
+        model = PybammModel(Decay())
+        inpt = "Rate [s-1]"
+        output = "x"
+        result = model.to_diffeq(inputs=[inpt], outputs=[output])
+        self.assertIn("varying0 {", result)
+        self.checks(result, "test_hoisted_scalar", [inpt], [output], model)
+
     def test_spm_no_inputs(self):
         model = PybammModel(pybamm.lithium_ion.SPM())
         output = "Voltage [V]"
@@ -100,15 +113,22 @@ class TestConvert(unittest.TestCase):
     def test_spm_all_inputs(self):
         model = PybammModel(pybamm.lithium_ion.SPM())
         all_inputs = model.get_all_parameters()
-        for inpt in all_inputs:
-            output = "Voltage [V]"
-            result = model.to_diffeq(inputs=[inpt], outputs=[output])
-            self.checks(result, "test_spm_all_inputs", [inpt], [output], model)
+        output = "Voltage [V]"
+        results = [
+            model.to_diffeq(inputs=[inpt], outputs=[output]) for inpt in all_inputs
+        ]
+        for i, diffeq in Diffeq.from_many(results, return_exceptions=True):
+            self.checks(
+                results[i], "test_spm_all_inputs", [all_inputs[i]], [output], model, diffeq
+            )
 
     def test_spm_all_outputs(self):
         model = PybammModel(pybamm.lithium_ion.SPM())
         all_outputs = model.get_all_outputs()
-        for output in all_outputs:
-            inpt = "Current function [A]"
-            result = model.to_diffeq(inputs=[inpt], outputs=[output])
-            self.checks(result, "test_spm_all_outputs", [inpt], [output], model)
+        inpt = "Current function [A]"
+        converter = Converter(model, inputs=[inpt])
+        results = [converter.emit(outputs=[output]) for output in all_outputs]
+        for i, diffeq in Diffeq.from_many(results, return_exceptions=True):
+            self.checks(
+                results[i], "test_spm_all_outputs", [inpt], [all_outputs[i]], model, diffeq
+            )
@@ -0,0 +1,89 @@
+import gc
+import unittest
+from functools import partial
+
+from wasmtime import (
+    Func,
+    FuncType,
+    Instance,
+    Module,
+    Store,
+    Trap,
+    WasmtimeError,
+    wat2wasm,
+)
+
+from pybamm2diffsl import ffi
+from pybamm2diffsl.ffi import bind
+
+wat = """
+(module
+  (import "host" "fail" (func $fail))
+  (func (export "add") (param i32 i32) (result i32)
+    (i32.add (local.get 0) (local.get 1)))
+  (func (export "scale") (param f64 i64) (result f64)
+    (f64.mul (local.get 0) (f64.convert_i64_s (local.get 1))))
+  (func (export "nothing") (param i32))
+  (func (export "pair") (result i32 i32) (i32.const 1) (i32.const 2))
+  (func (export "trap") (unreachable))
+  (func (export "call_host") (call $fail))
+)
+"""
+
+
+class TestBind(unittest.TestCase):
+    def setUp(self):
+        self.store = Store()
+        module = Module(self.store.engine, wat2wasm(wat))
+
+        def fail():
+            raise KeyError("from the host")
+
+        host = Func(self.store, FuncType([], []), fail)
+        self.exports = Instance(self.store, module, [host]).exports(self.store)
+
+    def bind(self, name):
+        return bind(self.store, self.exports[name])
+
+    def test_call(self):
+        add = self.bind("add")
+        self.assertEqual(add(2, 3), 5)
+        self.assertEqual(add(-2, 1), -1)
+        self.assertEqual(self.bind("scale")(1.5, 4), 6.0)
+        self.assertIsNone(self.bind("nothing")(1))
+        with self.assertRaises(WasmtimeError):
+            add(1)
+
+    def test_trap(self):
+        with self.assertRaises(Trap):
+            self.bind("trap")()
+
+    def test_host_exception(self):
+        call_host = self.bind("call_host")
+        self.assertNotIsInstance(call_host, partial)
+        with self.assertRaisesRegex(KeyError, "from the host"):
+            call_host()
+        # and it is not raised again by the next call
+        self.assertEqual(self.bind("add")(2, 3), 5)
+
+    def test_fallback(self):
+        pair = self.bind("pair")
+        self.assertIsInstance(pair, partial)
+        self.assertEqual(pair(), [1, 2])
+
+    def test_fallback_signature(self):
+        # a wasmtime whose unchecked call does not have the expected signature
+        call, ffi._call = ffi._call, None
+        try:
+            add = self.bind("add")
+        finally:
+            ffi._call = call
+        self.assertIsInstance(add, partial)
+        self.assertEqual(add(2, 3), 5)
+
+    def test_store_dropped(self):
+        # the bound function keeps the store, and so its context, alive
+        add = self.bind("add")
+        del self.store, self.exports
+        gc.collect()
+        self.assertEqual(add(2, 3), 5)
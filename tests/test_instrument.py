@@ -0,0 +1,105 @@
+import io
+import json
+import unittest
+
+import numpy as np
+import pybamm
+
+from pybamm2diffsl import instrument
+from pybamm2diffsl.diffeq import Diffeq
+from pybamm2diffsl.pybamm_model import PybammModel
+from tests.logistic import logistic
+
+
+class TestInstrument(unittest.TestCase):
+    def setUp(self):
+        instrument.reset()
+        instrument.enable()
+        self.events = []
+        instrument.add_hook(self.events.append)
+
+    def tearDown(self):
+        instrument.remove_hook(self.events.append)
+        instrument.disable()
+        instrument.reset()
+
+    def test_disabled(self):
+        instrument.disable()
+        with instrument.span("a"):
+            instrument.count("b")
+        self.assertIs(instrument.span("a"), instrument.span("c"))
+        self.assertEqual(instrument.report(), {"timers": {}, "counters": {}})
+        self.assertEqual(self.events, [])
+
+    def test_report(self):
+        with instrument.span("outer", size=3):
+            with instrument.span("inner"):
+                instrument.count("items", 2)
+            with instrument.span("inner"):
+                instrument.count("items")
+        report = instrument.report()
+        self.assertEqual(report["timers"]["inner"]["count"], 2)
+        self.assertEqual(report["timers"]["outer"]["count"], 1)
+        self.assertGreaterEqual(
+            report["timers"]["outer"]["total"], report["timers"]["inner"]["total"]
+        )
+        self.assertEqual(report["counters"], {"items": 3})
+
+        spans = [e for e in self.events if e["type"] == "span"]
+        self.assertEqual([s["name"] for s in spans], ["inner", "inner", "outer"])
+        self.assertEqual(spans[0]["parent_id"], spans[2]["span_id"])
+        self.assertEqual(spans[0]["trace_id"], spans[2]["trace_id"])
+        self.assertIsNone(spans[2]["parent_id"])
+        self.assertEqual(spans[2]["attributes"], {"size": 3})
+
+    def test_otel_exporter(self):
+        f = io.StringIO()
+        exporter = instrument.OtelJsonExporter(f)
+        instrument.add_hook(exporter)
+        try:
+            with instrument.span("outer", size=3):
+                with instrument.span("inner"):
+                    pass
+        finally:
+            instrument.remove_hook(exporter)
+        lines = [json.loads(line) for line in f.getvalue().splitlines()]
+        spans = [line["resourceSpans"][0]["scopeSpans"][0]["spans"][0] for line in lines]
+        inner, outer = spans
+        self.assertEqual(inner["parentSpanId"], outer["spanId"])
+        self.assertNotIn("parentSpanId", outer)
+        self.assertEqual(outer["attributes"], [{"key": "size", "value": {"intValue": "3"}}])
+        self.assertLessEqual(int(outer["startTimeUnixNano"]), int(inner["startTimeUnixNano"]))
+        self.assertEqual(len(outer["traceId"]), 32)
+
+    def test_convert(self):
+        model = PybammModel(pybamm.lithium_ion.SPM())
+        text = model.to_diffeq(["Current function [A]"], ["Voltage [V]"])
+        report = instrument.report()
+        for name in ["convert", "convert.build", "convert.extract"]:
+            self.assertEqual(report["timers"][name]["count"], 1)
+        self.assertEqual(report["counters"]["convert.chars"], len(text))
+        self.assertEqual(report["counters"]["convert.hoisted"], model.cse_stats["hoisted"])
+
+    def test_solve(self):
+        diffeq = Diffeq(logistic)
+        o = diffeq.options(fixed_times=True)
+        s = diffeq.solver(o)
+        times = diffeq.vector(np.linspace(0, 1, 10))
+        inputs = diffeq.vector([1.0, 1.0])
+        outputs = diffeq.vector([])
+        s.solve(times, inputs, outputs)
+        s.solve_batch(times, np.ones((3, 2)))
+        report = instrument.report()
+        self.assertEqual(report["timers"]["instantiate"]["count"], 1)
+        self.assertEqual(report["timers"]["solve"]["count"], 1)
+        self.assertEqual(report["timers"]["solve_batch"]["count"], 1)
+        self.assertEqual(report["counters"]["solve.count"], 4)
+        self.assertEqual(report["counters"]["ffi.Sundials_solve"], 4)
+        self.assertGreaterEqual(report["counters"]["vector.bytes_in"], 8 * (10 + 2 + 3 * 2))
+        self.assertEqual(
+            report["counters"]["vector.bytes_out"], 3 * 10 * s.number_of_outputs * 8
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
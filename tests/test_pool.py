@@ -0,0 +1,49 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from pybamm2diffsl.pool import InstancePool
+from tests.logistic import logistic
+
+
+class TestInstancePool(unittest.TestCase):
+    def setUp(self):
+        self.pool = InstancePool(logistic, max_size=2)
+
+    def test_checkout(self):
+        a = self.pool.checkout()
+        b = self.pool.checkout()
+        self.assertIsNot(a, b)
+        self.assertIs(a._module, b._module)
+        with self.assertRaises(TimeoutError):
+            self.pool.checkout(timeout=0.01)
+        self.pool.checkin(a)
+        self.assertIs(self.pool.checkout(), a)
+        self.pool.checkin(a)
+        self.pool.checkin(b)
+        self.assertEqual(self.pool.size(), 2)
+        self.assertEqual(self.pool.idle(), 2)
+
+    def test_threads(self):
+        def solve(r):
+            with self.pool.instance() as diffeq:
+                o = diffeq.options(fixed_times=True)
+                s = diffeq.solver(o)
+                times = diffeq.vector(np.linspace(0, 1, 10))
+                inputs = diffeq.vector([r, 1.0])
+                outputs = diffeq.vector([])
+                s.solve(times, inputs, outputs)
+                result = outputs.getFloat64Array().copy()
+                for v in (times, inputs, outputs):
+                    v.destroy()
+                s.destroy()
+                o.destroy()
+                return result
+
+        rs = [0.5, 1.0, 1.5, 2.0, 2.5, 3.0]
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(solve, rs))
+        for r, result in zip(rs, results):
+            np.testing.assert_array_almost_equal(result, solve(r))
+        self.assertLessEqual(self.pool.size(), 2)
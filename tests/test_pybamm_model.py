@@ -0,0 +1,324 @@
+import io
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pybamm
+from scipy.sparse import csr_matrix, diags
+
+from pybamm2diffsl.cache import ConversionCache
+from pybamm2diffsl.pybamm_model import (
+    Converter,
+    InputParameters,
+    PybammModel,
+    ShapeCache,
+    constant_key,
+    count_operations,
+    count_references,
+    matrix_to_diffeq_tensor,
+    subexpressions_to_hoist,
+    vector_to_diffeq_tensor,
+)
+from tests.decay import Decay
+
+
+class TestCommonSubexpressions(unittest.TestCase):
+    def setUp(self):
+        self.y = pybamm.StateVector(slice(0, 1))
+        self.shared = pybamm.exp(self.y * 2)
+        self.a = self.shared + 1
+        self.b = pybamm.sin(self.shared) * self.shared
+
+    def test_count_references(self):
+        counts = count_references([self.a, self.b])
+        self.assertEqual(counts[self.shared.id], 3)
+        # children of a repeated subexpression are only visited once
+        self.assertEqual(counts[self.y.id], 1)
+
+    def test_hoist(self):
+        hoisted = subexpressions_to_hoist([self.a, self.b])
+        self.assertEqual([h.id for h in hoisted], [self.shared.id])
+
+    def test_count_operations(self):
+        equations = [self.a, self.b]
+        self.assertEqual(count_operations(equations), 9)
+        self.assertEqual(count_operations(equations, [self.shared]), 5)
+
+    def test_spm(self):
+        model = PybammModel(pybamm.lithium_ion.SPM())
+        text = model.to_diffeq(inputs=["Current function [A]"], outputs=["Voltage [V]"])
+
+        # each hoisted tensor is defined once, before it is used
+        defined = re.findall(r"^(varying\d+(?:_i)?) \{$", text, re.MULTILINE)
+        self.assertEqual(len(defined), len(set(defined)))
+        self.assertEqual(len(defined), model.cse_stats["hoisted"])
+        for name in defined:
+            definition = text.index(f"{name} {{")
+            self.assertNotRegex(text[:definition], rf"\b{name}\b")
+
+        self.assertGreater(model.cse_stats["operations_saved"], 0)
+        self.assertGreater(model.cse_stats["chars_saved"], 0)
+        self.assertLessEqual(model.cse_stats["chars"], len(text))
+
+    def test_scalar(self):
+        model = PybammModel(Decay())
+        text = model.to_diffeq(inputs=["Rate [s-1]"], outputs=["x"])
+        # a scalar is hoisted into an unindexed tensor, like the inputs
+        self.assertIn("varying0 {\n  exp((-(rates1) * t))\n}", text)
+        self.assertIn("(varying0 - (varying0 * x_i)),", text)
+
+        # unless its expression has a free index, here a row vector times the state
+        text = PybammModel(pybamm.lithium_ion.SPM()).to_diffeq(
+            inputs=["Current function [A]"], outputs=["Voltage [V]"]
+        )
+        self.assertRegex(text, r"varying\d+_i \{\n  \(constant\d+_ij \* \w+_j\),\n\}")
+
+
+class TestShapeCache(unittest.TestCase):
+    def test_shape(self):
+        shapes = ShapeCache()
+        y = pybamm.StateVector(slice(0, 3))
+        matrix = pybamm.Matrix(np.ones((2, 3)))
+        self.assertEqual(shapes.shape(matrix @ y), (2, 1))
+        self.assertEqual(shapes.shape(pybamm.Scalar(1) + pybamm.Scalar(2)), (1, 1))
+
+        # a copy of an evaluated subtree is not evaluated again
+        copy = pybamm.Matrix(np.ones((2, 3))) @ pybamm.StateVector(slice(0, 3))
+        self.assertEqual(copy.id, (matrix @ y).id)
+        expression = pybamm.exp(copy) * 2
+        self.assertEqual(shapes.shape(expression), (2, 1))
+        self.assertIs(copy._saved_evaluate_for_shape, shapes.evaluate(matrix @ y))
+
+    def test_deep(self):
+        # deeper than the recursion limit allows pybamm to evaluate directly
+        y = pybamm.StateVector(slice(0, 1))
+        expression = y
+        for _ in range(5000):
+            expression = pybamm.Addition(expression, y)
+        self.assertEqual(ShapeCache().shape(expression), (1, 1))
+
+
+class TestConverter(unittest.TestCase):
+    def test_emit(self):
+        model = PybammModel(pybamm.lithium_ion.SPM())
+        converter = Converter(model, inputs=["Current function [A]"])
+        voltage = converter.emit(["Voltage [V]"])
+        time = converter.emit(["Time [s]"])
+        self.assertEqual(converter.emit(["Voltage [V]"]), voltage)
+        self.assertNotEqual(voltage, time)
+        both = converter.emit(["Voltage [V]", "Time [s]"])
+        self.assertEqual(len(re.findall(r"^out_i \{\n.*\n.*\n\}", both, re.MULTILINE)), 1)
+
+    def test_emit_independent_of_history(self):
+        model = PybammModel(pybamm.lithium_ion.SPM())
+        inputs = ["Current function [A]"]
+        outputs = model.get_all_outputs()
+        converter = Converter(model, inputs)
+        for output in reversed(outputs):
+            converter.emit([output])
+        for output in outputs[:5]:
+            self.assertEqual(converter.emit([output]), model.to_diffeq(inputs, [output]))
+
+    def test_emit_stream(self):
+        model = PybammModel(pybamm.lithium_ion.SPM())
+        converter = Converter(model, inputs=["Current function [A]"])
+        text = converter.emit(["Voltage [V]"])
+        stats = converter.cse_stats
+        converter.cse_stats = None
+        chunks = list(converter.emit_stream(["Voltage [V]"]))
+        self.assertEqual("".join(chunks), text)
+        self.assertEqual(converter.cse_stats, stats)
+        # one chunk per tensor, plus the list of inputs
+        self.assertEqual(len(chunks), len(re.findall(r"^\w+ \{$", text, re.MULTILINE)) + 1)
+
+        f = io.StringIO()
+        model.write_diffeq(f, ["Current function [A]"], ["Voltage [V]"])
+        self.assertEqual(f.getvalue(), text)
+
+    def test_var_pts(self):
+        model = PybammModel(pybamm.lithium_ion.SPM(), var_pts={"r_n": 7, "r_p": 9})
+        converter = Converter(model, inputs=[])
+        self.assertEqual(converter.model.len_rhs, 7 + 9)
+
+    def test_errors(self):
+        converter = Converter(PybammModel(pybamm.lithium_ion.SPM()), inputs=[])
+        with self.assertRaises(ValueError):
+            converter.emit([])
+        with self.assertRaises(ValueError):
+            converter.emit(["not an output"])
+        with self.assertRaises(TypeError):
+            converter.emit([1])
+        with self.assertRaises(ValueError):
+            Converter(PybammModel(pybamm.lithium_ion.SPM()), inputs=["not a parameter"])
+
+
+class TestDeterminism(unittest.TestCase):
+    script = """
+import hashlib
+import warnings
+warnings.filterwarnings("ignore")
+import pybamm
+from pybamm2diffsl.pybamm_model import PybammModel
+model = PybammModel(pybamm.lithium_ion.SPM())
+inputs = model.get_all_parameters()[:3]
+outputs = model.get_all_outputs()[:4] + ["Voltage [V]"]
+text = model.to_diffeq(inputs, outputs)
+print(hashlib.sha256(text.encode()).hexdigest(), model.fingerprint(inputs, outputs))
+"""
+
+    def run_with_seed(self, seed: str) -> str:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=root)
+        result = subprocess.run(
+            [sys.executable, "-c", self.script],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return result.stdout.split()
+
+    def test_across_processes(self):
+        self.assertEqual(self.run_with_seed("1"), self.run_with_seed("2"))
+
+    def test_repeated(self):
+        model = PybammModel(pybamm.lithium_ion.SPM())
+        inputs = ["Current function [A]"]
+        first = model.to_diffeq(inputs, ["Voltage [V]"])
+        second = PybammModel(pybamm.lithium_ion.SPM()).to_diffeq(inputs, ["Voltage [V]"])
+        self.assertEqual(first, second)
+
+
+class TestInputParameters(unittest.TestCase):
+    def test_values(self):
+        inputs = InputParameters(["Current function [A]", "Positive OCP [V]"], [0.68, None])
+        self.assertEqual(inputs.diffsl_names, ["currentfunctiona", "positiveocpv"])
+        np.testing.assert_array_equal(
+            inputs.values({"Positive OCP [V]": 4.0}), [0.68, 4.0]
+        )
+        np.testing.assert_array_equal(
+            inputs.values({"positiveocpv": 4.0, "currentfunctiona": 1.0}), [1.0, 4.0]
+        )
+        with self.assertRaises(ValueError):
+            inputs.values()
+        with self.assertRaises(ValueError):
+            inputs.values({"Positive OCP [V]": 4.0, "Voltage [V]": 1.0})
+        batch = inputs.batch([{"Positive OCP [V]": v} for v in (1.0, 2.0, 3.0)])
+        self.assertEqual(batch.shape, (3, 2))
+        np.testing.assert_array_equal(batch[:, 1], [1.0, 2.0, 3.0])
+
+    def test_all_inputs(self):
+        model = PybammModel(pybamm.lithium_ion.SPM())
+        all_inputs = model.get_all_inputs()
+        self.assertEqual(all_inputs, sorted(set(all_inputs)))
+        self.assertIn("Current function [A]", all_inputs)
+
+        converter = Converter(model, inputs=all_inputs)
+        text = converter.emit(["Voltage [V]"])
+        inputs = converter.input_parameters
+        self.assertEqual(text.split("\n")[0], f"in = [{', '.join(inputs.diffsl_names)}]")
+        defaults = inputs.values()
+        params = model.model.default_parameter_values
+        for name, value in zip(all_inputs, defaults):
+            self.assertEqual(value, params[name])
+
+
+class TestConversionCache(unittest.TestCase):
+    def test_fingerprint(self):
+        model = PybammModel(pybamm.lithium_ion.SPM())
+        inputs = ["Current function [A]"]
+        key = model.fingerprint(inputs, ["Voltage [V]"])
+        self.assertEqual(key, PybammModel(pybamm.lithium_ion.SPM()).fingerprint(
+            inputs, ["Voltage [V]"]
+        ))
+        self.assertNotEqual(key, model.fingerprint(inputs, ["Time [s]"]))
+        self.assertNotEqual(key, model.fingerprint([], ["Voltage [V]"]))
+        thermal = PybammModel(pybamm.lithium_ion.SPM({"thermal": "lumped"}))
+        self.assertNotEqual(key, thermal.fingerprint(inputs, ["Voltage [V]"]))
+        finer = PybammModel(pybamm.lithium_ion.SPM(), var_pts={"r_n": 40})
+        self.assertNotEqual(key, finer.fingerprint(inputs, ["Voltage [V]"]))
+
+    def test_cached(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = ConversionCache(path)
+            model = PybammModel(pybamm.lithium_ion.SPM(), cache=cache)
+            text = model.to_diffeq(["Current function [A]"], ["Voltage [V]"])
+            stats = model.cse_stats
+            self.assertEqual(cache.misses, 1)
+            model = PybammModel(pybamm.lithium_ion.SPM(), cache=cache)
+            model._to_diffeq_stream = None  # a hit must not convert again
+            self.assertEqual(model.to_diffeq(["Current function [A]"], ["Voltage [V]"]), text)
+            self.assertEqual(cache.hits, 1)
+            # the statistics of the conversion are restored with the text
+            self.assertEqual(model.cse_stats, stats)
+            self.assertGreater(stats["hoisted"], 0)
+
+
+class TestConstants(unittest.TestCase):
+    def test_vector_runs(self):
+        vector = np.array([[1.0], [1.0], [2.0], [0.0], [0.0], [1.0]])
+        self.assertEqual(
+            vector_to_diffeq_tensor("v", vector),
+            "v_i {\n  (0:2): 1.0,\n  (2:3): 2.0,\n  (3:5): 0.0,\n  (5:6): 1.0,\n}",
+        )
+        self.assertEqual(
+            vector_to_diffeq_tensor("v", csr_matrix(vector)),
+            vector_to_diffeq_tensor("v", vector),
+        )
+
+    def test_banded(self):
+        n = 5
+        matrix = diags([np.ones(n - 1), -2 * np.ones(n), np.ones(n - 1)], [-1, 0, 1])
+        self.assertEqual(
+            matrix_to_diffeq_tensor("A", csr_matrix(matrix)),
+            "A_ij {\n"
+            "  (0..4,0..4): -2.0,\n"
+            "  (0..3,1..4): 1.0,\n"
+            "  (1..4,0..3): 1.0,\n"
+            "}",
+        )
+
+    def test_non_uniform_diagonal(self):
+        matrix = csr_matrix(np.diag([1.0, 2.0, 2.0]))
+        self.assertEqual(
+            matrix_to_diffeq_tensor("A", matrix),
+            "A_ij {\n  (0,0): 1.0,\n  (1..2,1..2): 2.0,\n}",
+        )
+
+    def test_dense_blocks(self):
+        matrix = np.zeros((4, 6))
+        matrix[:, :3] = 0.5
+        matrix[1, 4] = 2.0
+        self.assertEqual(
+            matrix_to_diffeq_tensor("A", matrix),
+            "A_ij {\n  (0:4,0:3): 0.5,\n  (1,4): 2.0,\n  (3,5): 0.0,\n}",
+        )
+
+    def test_key(self):
+        dense = np.array([[1.0, 0.0], [0.0, 2.0]])
+        a = pybamm.Matrix(csr_matrix(dense), name="gradient")
+        b = pybamm.Matrix(dense, name="divergence")
+        self.assertNotEqual(a.id, b.id)
+        self.assertEqual(constant_key(a), constant_key(b))
+        self.assertNotEqual(constant_key(a), constant_key(pybamm.Matrix(2 * dense)))
+        self.assertNotEqual(
+            constant_key(pybamm.Matrix(np.eye(2))), constant_key(pybamm.Matrix(np.eye(3)))
+        )
+        self.assertNotEqual(
+            constant_key(pybamm.Vector(np.ones(2))),
+            constant_key(pybamm.Matrix(np.ones((2, 1)))),
+        )
+
+    def test_zero(self):
+        self.assertEqual(
+            matrix_to_diffeq_tensor("A", csr_matrix((2, 3))),
+            "A_ij {\n  (1,2): 0.0,\n}",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,13 @@
+import io
 import unittest
+from contextlib import redirect_stdout
 
 import numpy as np
 
+from pybamm2diffsl.cache import SolutionCache
 from pybamm2diffsl.diffeq import Diffeq
+from pybamm2diffsl.pybamm_model import InputParameters
+from pybamm2diffsl.solver import parse_stats
 from tests.logistic import logistic
 
 
@@ -25,3 +30,145 @@ class TestVector(unittest.TestCase):
         contents[0] = -1
         np.testing.assert_array_equal(contents, [-1, 2, 3, 4, 0])
         v.destroy()
+
+
+class TestSolver(unittest.TestCase):
+    def setUp(self):
+        self.diffeq = Diffeq(logistic)
+        self.options = self.diffeq.options(fixed_times=True)
+        self.solver = self.diffeq.solver(self.options)
+
+    def tearDown(self):
+        self.solver.destroy()
+        self.options.destroy()
+
+    def test_solve_batch(self):
+        times = np.linspace(0, 1, 20)
+        inputs = np.array([[1.0, 1.0], [2.0, 1.0], [1.0, 2.0]])
+        result = self.solver.solve_batch(times, inputs)
+        self.assertEqual(result.shape, (3, 20, 2))
+
+        times_vector = self.diffeq.vector(times)
+        for i, row in enumerate(inputs):
+            inputs_vector = self.diffeq.vector(row)
+            outputs = self.diffeq.vector([])
+            self.solver.solve(times_vector, inputs_vector, outputs)
+            np.testing.assert_array_almost_equal(
+                result[i], outputs.getFloat64Array().reshape(20, 2)
+            )
+            inputs_vector.destroy()
+            outputs.destroy()
+        np.testing.assert_array_equal(
+            self.solver.solve_batch(times_vector, inputs), result
+        )
+        times_vector.destroy()
+
+    def test_stats(self):
+        self.assertEqual(
+            parse_stats(
+                "Number of steps = 42\nNumber of error test failures: 3\n"
+                "t = 1.5e-2\nsolving...\nNumber of steps = 8\n"
+            ),
+            {"steps": 50, "error_test_failures": 3, "t": 0.015},
+        )
+
+        times = self.diffeq.vector(np.linspace(0, 1, 20))
+        inputs = self.diffeq.vector([1.0, 1.0])
+        outputs = self.diffeq.vector([])
+        self.solver.solve(times, inputs, outputs)
+        self.assertEqual(self.solver.last_stats, {})
+
+        o = self.diffeq.options(fixed_times=True, print_stats=True)
+        s = self.diffeq.solver(o)
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            s.solve(times, inputs, outputs)
+        stats = s.last_stats
+        self.assertGreater(stats["steps"], 0)
+        # the statistics are still printed
+        self.assertIn(f"Number of steps = {stats['steps']}", stdout.getvalue())
+
+        with redirect_stdout(io.StringIO()):
+            s.solve_batch(times, np.ones((3, 2)))
+        self.assertEqual(s.last_stats["steps"], 3 * stats["steps"])
+        s.destroy()
+        o.destroy()
+
+    def test_solution_cache(self):
+        cache = SolutionCache()
+        s = self.diffeq.solver(self.options, cache=cache)
+        times = self.diffeq.vector(np.linspace(0, 1, 20))
+        inputs = self.diffeq.vector([1.0, 2.0])
+        outputs = self.diffeq.vector([])
+        s.solve(times, inputs, outputs)
+        expected = outputs.getFloat64Array().copy()
+        outputs.resize(0)
+        s.solve(times, inputs, outputs)
+        np.testing.assert_array_equal(outputs.getFloat64Array(), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        batch = np.array([[1.0, 2.0], [2.0, 1.0], [2.0, 1.0]])
+        result = s.solve_batch(np.linspace(0, 1, 20), batch)
+        np.testing.assert_array_equal(result, self.solver.solve_batch(times, batch))
+        self.assertEqual((cache.hits, cache.misses), (3, 2))
+
+        # other options are not found
+        o = self.diffeq.options(fixed_times=True, rtol=1e-4)
+        self.diffeq.solver(o, cache=cache).solve(times, inputs, outputs)
+        self.assertEqual(cache.misses, 3)
+
+    def test_input_parameters(self):
+        parameters = InputParameters(["r", "k"], [1.0, None])
+        times = np.linspace(0, 1, 20)
+        with self.diffeq.arena():
+            s = self.diffeq.solver(self.options, input_parameters=parameters)
+            expected = s.solve_batch(times, np.array([[1.0, 2.0], [3.0, 2.0]]))
+            # unspecified inputs take their defaults
+            outputs = self.diffeq.vector([])
+            s.solve(self.diffeq.vector(times), {"k": 2.0}, outputs)
+            np.testing.assert_array_equal(
+                outputs.getFloat64Array().reshape(20, 2), expected[0]
+            )
+            np.testing.assert_array_equal(
+                s.solve_batch(times, [{"k": 2.0}, {"r": 3.0, "k": 2.0}]), expected
+            )
+            with self.assertRaises(ValueError):
+                s.solve(self.diffeq.vector(times), {}, outputs)  # k has no default
+            with self.assertRaises(ValueError):
+                self.solver.solve(self.diffeq.vector(times), {"k": 2.0}, outputs)
+            with self.assertRaises(ValueError):
+                self.diffeq.solver(self.options, input_parameters=InputParameters(["r"], [1]))
+
+    def test_solve_batch_errors(self):
+        times = np.linspace(0, 1, 20)
+        with self.assertRaises(ValueError):
+            self.solver.solve_batch(times, np.ones((3, 3)))
+        with self.assertRaises(ValueError):
+            self.solver.solve_batch(times[:1], np.ones((3, 2)))
+        o = self.diffeq.options(fixed_times=False)
+        s = self.diffeq.solver(o)
+        with self.assertRaises(ValueError):
+            s.solve_batch(times, np.ones((3, 2)))
+        s.destroy()
+        o.destroy()
+
+    def test_jacobian(self):
+        o = self.diffeq.options(fixed_times=True, fwd_sens=True, atol=1e-8, rtol=1e-8)
+        s = self.diffeq.solver(o)
+        times = np.linspace(0, 1, 20)
+        inputs = np.array([1.0, 2.0])
+        outputs, jac = s.jacobian(times, inputs, return_outputs=True)
+        self.assertEqual(jac.shape, (20, 2, 2))
+        np.testing.assert_array_almost_equal(
+            outputs, s.solve_batch(times, inputs[np.newaxis])[0]
+        )
+
+        h = 1e-6
+        perturbed = inputs + h * np.eye(2)
+        fd = (s.solve_batch(times, perturbed) - outputs) / h
+        np.testing.assert_allclose(jac, np.moveaxis(fd, 0, -1), atol=1e-4)
+
+        with self.assertRaises(ValueError):
+            self.solver.jacobian(times, inputs)
+        s.destroy()
+        o.destroy()
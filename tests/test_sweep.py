@@ -0,0 +1,30 @@
+import unittest
+
+import numpy as np
+
+from pybamm2diffsl.diffeq import Diffeq
+from pybamm2diffsl.sweep import ParallelSweep
+from tests.logistic import logistic
+
+
+class TestParallelSweep(unittest.TestCase):
+    def test_run(self):
+        times = np.linspace(0, 1, 20)
+        inputs = np.column_stack([np.linspace(0.5, 2.0, 25), np.ones(25)])
+
+        diffeq = Diffeq(logistic)
+        o = diffeq.options(fixed_times=True)
+        s = diffeq.solver(o)
+        expected = s.solve_batch(times, inputs)
+        s.destroy()
+        o.destroy()
+
+        progress = []
+        with ParallelSweep(logistic, max_workers=2) as sweep:
+            result = sweep.run(
+                times, inputs, chunk_size=4, progress=lambda *p: progress.append(p)
+            )
+            np.testing.assert_array_equal(result, expected)
+            np.testing.assert_array_equal(sweep.run(times, inputs[:3]), expected[:3])
+        self.assertEqual(len(progress), 7)
+        self.assertEqual(progress[-1], (25, 25))
@@ -0,0 +1,74 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from pybamm2diffsl.cache import TuningCache
+from pybamm2diffsl.diffeq import Diffeq
+from pybamm2diffsl.options import Options
+from pybamm2diffsl.tune import autotune, candidate_configs
+from tests.logistic import logistic
+
+
+class TestTune(unittest.TestCase):
+    def setUp(self):
+        self.tuning = Diffeq.tuning
+        self.tmpdir = tempfile.TemporaryDirectory()
+        Diffeq.tuning = TuningCache(self.tmpdir.name)
+        self.diffeq = Diffeq(logistic)
+        self.times = np.linspace(0, 1, 10)
+        self.configs = [
+            {
+                "linear_solver": Options.LinearSolver.LINEAR_SOLVER_DENSE,
+                "jacobian": Options.Jacobian.DENSE_JACOBIAN,
+            },
+            {
+                "linear_solver": Options.LinearSolver.LINEAR_SOLVER_KLU,
+                "jacobian": Options.Jacobian.SPARSE_JACOBIAN,
+                "rtol": 1e-5,
+            },
+        ]
+
+    def tearDown(self):
+        Diffeq.tuning = self.tuning
+        self.tmpdir.cleanup()
+
+    def test_candidates(self):
+        configs = candidate_configs()
+        # dense with 2 Jacobians, KLU with 1, 4 iterative solvers with 4 Jacobians
+        # and 3 preconditioners
+        self.assertEqual(len(configs), 2 + 1 + 4 * 4 * 3)
+        for config in configs:
+            if config["linear_solver"] == Options.LinearSolver.LINEAR_SOLVER_KLU:
+                self.assertEqual(config["jacobian"], Options.Jacobian.SPARSE_JACOBIAN)
+        self.assertEqual(len(candidate_configs(rtols=[1e-4, 1e-6])), 2 * len(configs))
+
+    def test_autotune(self):
+        self.assertEqual(self.diffeq.tuned_options(), {})
+        result = autotune(self.diffeq, self.times, configs=self.configs)
+        self.assertIn(result["options"], self.configs)
+        self.assertEqual(len(result["trials"]), 2)
+        for trial in result["trials"]:
+            self.assertIsNone(trial["error"])
+            self.assertGreater(trial["time"], 0)
+
+        # the winner is the default for this model from now on
+        expected = Options.default_settings()
+        expected.update(result["options"])
+        for diffeq in (self.diffeq, Diffeq(logistic)):
+            self.assertEqual(diffeq.tuned_options(), expected)
+            o = diffeq.options(atol=1e-4)
+            self.assertEqual(o.get_linear_solver(), expected["linear_solver"])
+            self.assertEqual(o.get_jacobian(), expected["jacobian"])
+            self.assertEqual(o.get_rtol(), expected["rtol"])
+            self.assertEqual(o.get_atol(), 1e-4)
+
+    def test_accuracy_check(self):
+        reference = np.zeros(2 * len(self.times))
+        with self.assertRaises(RuntimeError):
+            autotune(self.diffeq, self.times, configs=self.configs, reference=reference)
+        self.assertEqual(self.diffeq.tuned_options(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import array
 import unittest
 
 import numpy as np
@@ -25,3 +26,52 @@ class TestVector(unittest.TestCase):
         contents[0] = -1
         np.testing.assert_array_equal(contents, [-1, 2, 3, 4, 0])
         v.destroy()
+
+    def test_create_from_buffer(self):
+        for values in [
+            np.array([1.0, 2.0, 3.0]),
+            np.array([1, 2, 3], dtype=np.int32),
+            np.array([1.0, 0.0, 2.0, 0.0, 3.0, 0.0])[::2],
+            memoryview(np.array([1.0, 2.0, 3.0])),
+            array.array("d", [1.0, 2.0, 3.0]),
+        ]:
+            v = self.diffeq.vector(values)
+            np.testing.assert_array_equal(v.getFloat64Array(), [1, 2, 3])
+            v.destroy()
+
+    def test_create_empty(self):
+        v = self.diffeq.vector([])
+        self.assertEqual(len(v), 0)
+        v.destroy()
+
+    def test_create_large(self):
+        values = np.random.default_rng(0).random(100_000)
+        v = self.diffeq.vector(values)
+        np.testing.assert_array_equal(v.getFloat64Array(), values)
+        v.destroy()
+
+    def test_linspace(self):
+        v = self.diffeq.linspace(0.0, 1.0, 11)
+        np.testing.assert_array_almost_equal(v.getFloat64Array(), np.linspace(0, 1, 11))
+        v.destroy()
+
+    def test_view(self):
+        v = self.diffeq.vector([1, 2, 3])
+        view = v.view()
+        np.testing.assert_array_equal(view, [1, 2, 3])
+        generation = self.diffeq.memory_generation()
+
+        # force linear memory to grow
+        big = self.diffeq.vector(np.zeros(1_000_000))
+        self.assertGreater(self.diffeq.memory_generation(), generation)
+        view[0] = -1
+        np.testing.assert_array_equal(view, [-1, 2, 3])
+        self.assertEqual(v.get(0), -1)
+
+        v.resize(4)
+        self.assertEqual(len(view), 4)
+
+        v.destroy()
+        with self.assertRaises(RuntimeError):
+            view.array
+        big.destroy()